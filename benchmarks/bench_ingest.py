@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the vendorIngest job on a synthetic delivery.
+
+A delivery is generated with make_vendor_delivery.py in a scratch LCA
+root, and producer_vendorIngest.py, then (with --validator, which needs
+the lcatr, eotest and harnessed-jobs packages) validator_vendorIngest.py,
+are run on it in a fresh job directory, registering in the in-process
+localDatacat stand-in for the dataCatalog.  The wall time of each step
+and the producer's phase timings (vendorIngest_metrics.json) are
+printed, and can be saved as a baseline and compared to later runs, e.g.,
+
+  python bench_ingest.py --vendor ITL --naxis 544,2048 --scale 0.5 \
+      --save baseline_ITL.json
+  python bench_ingest.py --vendor ITL --naxis 544,2048 --scale 0.5 \
+      --compare baseline_ITL.json
+
+The producer needs python 2; use --python to select the interpreter.
+"""
+from __future__ import absolute_import, print_function, division
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict
+import make_vendor_delivery
+
+_repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+_job_dir = os.path.join(_repo_dir, 'harnessed_jobs', 'vendorIngest', 'v0')
+
+def run_step(script, jobdir, env, python, logfile):
+    "Run a job script in jobdir, returning its return code and wall time."
+    command = [python, os.path.join(_job_dir, script)]
+    tstart = time.time()
+    with open(logfile, 'w') as log:
+        retcode = subprocess.call(command, cwd=jobdir, env=env, stdout=log,
+                                  stderr=subprocess.STDOUT)
+    return retcode, time.time() - tstart
+
+def job_environment(lcaroot, jobdir, delivery, latency):
+    "Environment of the harnessed job scripts."
+    env = dict(os.environ)
+    unit_type = 'ITL-CCD' if delivery['vendor'] == 'ITL' else 'e2v-CCD'
+    pythonpath = [_job_dir, os.path.join(_repo_dir, 'python')]
+    if env.get('PYTHONPATH'):
+        pythonpath.append(env['PYTHONPATH'])
+    env.update(PWD=jobdir,
+               PYTHONPATH=os.pathsep.join(pythonpath),
+               LCATR_LIMS_URL='http://localhost/eTraveler/Dev',
+               LCATR_UNIT_ID=delivery['lsst_num'],
+               LCATR_UNIT_TYPE=unit_type,
+               VENDORINGEST_LCAROOT=lcaroot,
+               VENDORINGEST_GID=str(os.getgid()),
+               VENDORINGEST_LOCAL_DATACAT=str(latency))
+    return env
+
+def run_benchmark(args, workdir):
+    "Generate the delivery and run the job steps, returning the results."
+    lcaroot = os.path.join(workdir, 'lca')
+    naxis = None
+    if args.naxis is not None:
+        naxis = [int(x) for x in args.naxis.split(',')]
+    tstart = time.time()
+    delivery = make_vendor_delivery.make_delivery(
+        lcaroot, args.vendor, naxis=naxis, scale=args.scale, seed=args.seed,
+        compression=args.compression, verbose=False)
+    results = OrderedDict()
+    results['params'] = OrderedDict([('vendor', args.vendor),
+                                     ('naxis', args.naxis),
+                                     ('scale', args.scale),
+                                     ('compression', args.compression),
+                                     ('latency', args.latency)])
+    results['delivery'] = OrderedDict([('nfiles', delivery['nfiles']),
+                                       ('nbytes', delivery['nbytes']),
+                                       ('generation_time',
+                                        time.time() - tstart)])
+    ## The producer takes the job id from the name of its directory.
+    jobdir = os.path.join(workdir, 'jobs', '1000')
+    os.makedirs(jobdir)
+    env = job_environment(lcaroot, jobdir, delivery, args.latency)
+    steps = [('producer', 'producer_vendorIngest.py')]
+    if args.validator:
+        steps.append(('validator', 'validator_vendorIngest.py'))
+    for step, script in steps:
+        logfile = os.path.join(workdir, '%s.log' % step)
+        retcode, wall_time = run_step(script, jobdir, env, args.python,
+                                      logfile)
+        results[step] = OrderedDict([('returncode', retcode),
+                                     ('wall_time', wall_time)])
+        if retcode != 0:
+            print('%s failed (return code %i), see %s'
+                  % (script, retcode, logfile))
+            break
+    metrics_file = os.path.join(jobdir, 'vendorIngest_metrics.json')
+    if os.path.isfile(metrics_file):
+        with open(metrics_file) as fd:
+            metrics = json.load(fd, object_pairs_hook=OrderedDict)
+        results['phases'] = OrderedDict(
+            (name, phase['wall_time'])
+            for name, phase in metrics['phases'].items())
+    return results
+
+def timings(results):
+    "Flat dict of the timings to report and compare."
+    values = OrderedDict()
+    values['generation'] = results['delivery']['generation_time']
+    for step in ('producer', 'validator'):
+        if step in results:
+            values[step] = results[step]['wall_time']
+    for name, wall_time in results.get('phases', {}).items():
+        values['  ' + name] = wall_time
+    return values
+
+def report(results, baseline=None):
+    delivery = results['delivery']
+    print('%(nfiles)i FITS files, %(nbytes)i bytes of tarballs' % delivery)
+    print('%-22s %10s %10s %8s' % ('step/phase', 'time (s)', 'baseline',
+                                   'ratio'))
+    reference = timings(baseline) if baseline is not None else {}
+    for name, value in timings(results).items():
+        if name in reference and reference[name] > 0:
+            print('%-22s %10.2f %10.2f %8.2f' % (name, value, reference[name],
+                                                 value/reference[name]))
+        else:
+            print('%-22s %10.2f' % (name, value))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--vendor', default='ITL', choices=('ITL', 'E2V'))
+    parser.add_argument('--naxis', default='128,512',
+                        help='NAXIS1,NAXIS2 of the amplifier images')
+    parser.add_argument('--scale', type=float, default=0.25,
+                        help='factor applied to the numbers of frames')
+    parser.add_argument('--compression', default='bz2', choices=('bz2', 'gz'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='latency of each dataCatalog call (s)')
+    parser.add_argument('--validator', action='store_true',
+                        help='also run validator_vendorIngest.py')
+    parser.add_argument('--python', default=sys.executable,
+                        help='interpreter for the job scripts')
+    parser.add_argument('--workdir', default=None,
+                        help='scratch directory (default: a temporary one)')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the temporary scratch directory')
+    parser.add_argument('--save', default=None,
+                        help='write the results to this baseline file')
+    parser.add_argument('--compare', default=None,
+                        help='baseline file to compare the results to')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_ingest_')
+    try:
+        results = run_benchmark(args, workdir)
+    finally:
+        if args.keep or args.workdir is not None:
+            print('Scratch directory:', workdir)
+        else:
+            shutil.rmtree(workdir)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as fd:
+            baseline = json.load(fd, object_pairs_hook=OrderedDict)
+    report(results, baseline)
+    if args.save is not None:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=2)
+            output.write('\n')
+    steps = [results[x] for x in ('producer', 'validator') if x in results]
+    sys.exit(max(step['returncode'] for step in steps))
+
+if __name__ == '__main__':
+    main()
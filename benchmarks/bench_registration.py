@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Benchmark of dataCatalog registration of vendor deliveries against the
+in-process localDatacat stand-in for the dataCatalog.
+
+For synthetic delivery trees of each requested size, this times
+
+  register       registry.register() called once per file
+  regVendorFiles vendorRegistration.regVendorFiles() (bulk registration)
+  rerun          regVendorFiles() again, with a new registry, on the
+                 already registered files
+
+and prints the registrations/second achieved.  Each dataCatalog call
+sleeps for the given latency, and fails with the given error rate, so
+that the effects of concurrency and caching can be measured offline, e.g.,
+
+  python bench_registration.py --sizes 100,1000,10000 --latency 0.01 \
+      --workers 1,16
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from contextlib import contextmanager
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'harnessed_jobs', 'vendorIngest', 'v0'))
+import registry
+import localDatacat
+import vendorRegistration
+
+def make_tree(rootdir, nfiles, nfolders=10):
+    """
+    Create a synthetic delivery of nfiles empty files spread over
+    nfolders test-type subdirectories.
+    """
+    for i in range(nfiles):
+        folder = os.path.join(rootdir, 'test_%02i' % (i % nfolders))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        open(os.path.join(folder, 'file_%05i.fits' % i), 'w').close()
+
+@contextmanager
+def quiet():
+    "Discard the (verbose) output of the registration code."
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+def make_registry(catalog, args, use_cache=True):
+    "registry instance with LocalDatacat clients of catalog."
+    myDC = registry.registry()
+    myDC.quiet = True
+    myDC.useCache = use_cache
+    myDC.clientFactory = lambda: localDatacat.LocalDatacat(
+        catalog, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate)
+    return myDC
+
+def bench_register(rootdir, args, use_cache=True):
+    "Time registry.register() called once per file."
+    catalog = localDatacat.LocalCatalog()
+    myDC = make_registry(catalog, args, use_cache=use_cache)
+    files = []
+    for root, dirs, names in os.walk(rootdir):
+        folder = os.path.join('/LSST/bench', os.path.relpath(root, rootdir))
+        files.extend((os.path.join(root, x), os.path.normpath(folder))
+                     for x in names)
+    tstart = time.time()
+    with quiet():
+        for filename, folder in files:
+            myDC.register(filename, folder, 'slac.lca.archive', 'fits',
+                          'LSSTVENDORDATA')
+    return len(files), time.time() - tstart, catalog
+
+def bench_regVendorFiles(rootdir, args, workers, catalog=None):
+    "Time vendorRegistration.regVendorFiles()."
+    if catalog is None:
+        catalog = localDatacat.LocalCatalog()
+    myDC = make_registry(catalog, args)
+    tstart = time.time()
+    with quiet():
+        outcomes = vendorRegistration.regVendorFiles(
+            myDC, None, rootdir, '/LSST/bench', 'bench', numWorkers=workers)
+    return sum(outcomes.values()), time.time() - tstart, catalog
+
+def report(label, nfiles, workers, nregs, elapsed, catalog):
+    calls = sum(catalog.calls.values())
+    print('%-17s %7i %7i %10.2f %12.1f %10i' %
+          (label, nfiles, workers, elapsed, nregs/elapsed, calls))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='comma-separated numbers of files per delivery')
+    parser.add_argument('--workers', default='1,16',
+                        help='comma-separated numbers of registration threads')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='latency of each dataCatalog call (s)')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='max additional random latency (s)')
+    parser.add_argument('--error_rate', type=float, default=0.,
+                        help='probability of an injected error per call')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='also time register() without the folder/dataset cache')
+    args = parser.parse_args()
+
+    print('%-17s %7s %7s %10s %12s %10s' % ('benchmark', 'files', 'workers',
+                                            'time (s)', 'regs/s',
+                                            'DC calls'))
+    for nfiles in [int(x) for x in args.sizes.split(',')]:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            make_tree(tmpdir, nfiles)
+            report('register', nfiles, 1, *bench_register(tmpdir, args))
+            if args.no_cache:
+                report('register_nocache', nfiles, 1,
+                       *bench_register(tmpdir, args, use_cache=False))
+            for workers in [int(x) for x in args.workers.split(',')]:
+                result = bench_regVendorFiles(tmpdir, args, workers)
+                report('regVendorFiles', nfiles, workers, *result)
+                catalog = result[-1]
+                catalog.calls.clear()
+                report('rerun', nfiles, workers,
+                       *bench_regVendorFiles(tmpdir, args, workers,
+                                             catalog=catalog))
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
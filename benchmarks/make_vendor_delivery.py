@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic ITL and e2v vendor deliveries for end-to-end
+benchmarks of the vendorIngest job.
+
+A delivery is written to an FTP area laid out as the producer expects:
+
+  <lcaroot>/vendorData/FTP/<vendor>/delivery/<date>/
+      <vendor data tarball>, <metrology tarball> and their .md5 files,
+      with the <LSSTID>*.tar.bz2/.md5 and metrology*.tar.bz2/.md5
+      links to them
+  <lcaroot>/vendorData/FTP/<vendor>/<LSSTID> -> delivery/<date>
+
+The tarballs contain 16 amplifier FITS files of each test type, with
+the primary header keywords read by the FITS translators (ITL: EXPTIME,
+OBJECT, MONOWL, MONDIODE, DATE-OBS, TIME-OBS; e2v: EXPOSURE, WAVELEN,
+LIGHTPOW, MONDIODE, DEV_ID, TEMP_MEA, DATE-OBS, SYS_G#, and an ARCHON
+extension with SYS_N#), the vendor results files read by the validator
+(ITL .txt files, e2v .csv summaries and the Mechanical_Shim_Test_Sheet
+.xls) and the metrology scans.  The numbers of frames per test type are
+multiplied by scale, and the size of the amplifier images is set by
+naxis, e.g.,
+
+  python make_vendor_delivery.py /scratch/lca --vendor ITL \
+      --naxis 544,2048 --scale 1
+
+produces a delivery of the size of an actual ITL one, and
+
+  python make_vendor_delivery.py /scratch/lca --vendor E2V \
+      --naxis 64,64 --scale 0.2
+
+a small one for quick tests.
+"""
+from __future__ import absolute_import, print_function, division
+import os
+import glob
+import shutil
+import hashlib
+import tarfile
+import argparse
+import datetime
+import numpy as np
+import astropy.io.fits as fits
+
+__all__ = ['ItlDelivery', 'e2vDelivery', 'make_delivery']
+
+_test_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'tests')
+
+def _ini_file(filename, sections):
+    "Write an .ini style ITL results file from (section, items) pairs."
+    with open(filename, 'w') as output:
+        for section, items in sections:
+            output.write('[%s]\n' % section)
+            for key, value in items:
+                output.write('%s = %s\n' % (key, value))
+            output.write('\n')
+
+def _csv_file(filename, header, rows):
+    "Write an e2v summary .csv file."
+    with open(filename, 'w') as output:
+        output.write(','.join(header) + '\n')
+        for row in rows:
+            output.write(','.join(str(x) for x in row) + '\n')
+
+def _md5(filename, chunk_size=2**20):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+class VendorDelivery(object):
+    """
+    Base class of the synthetic deliveries.  Subclasses provide the
+    test types, file names, headers and results files of a vendor.
+    """
+    vendor = None
+    lsst_num = None
+    bias_level = 1000.
+    read_noise = 5.
+    wavelengths = np.arange(320, 1101, 20)
+
+    def __init__(self, naxis=(544, 2048), scale=1., seed=None,
+                 start=datetime.datetime(2016, 10, 28, 11, 32, 43)):
+        """
+        Constructor.
+        naxis = (NAXIS1, NAXIS2) of the amplifier images.
+        scale = Factor applied to the numbers of frames per test type.
+        """
+        self.naxis = tuple(naxis)
+        self.scale = scale
+        self.random = np.random.RandomState(seed)
+        self.obs_time = start
+        self.nfiles = 0
+
+    def num_frames(self, num):
+        "Number of frames of a test type taken num times in a delivery."
+        return max(1, int(round(num*self.scale)))
+
+    def qe_wavelengths(self):
+        "Wavelengths (nm) of the QE frames."
+        num = max(2, int(round(len(self.wavelengths)*self.scale)))
+        return np.linspace(self.wavelengths[0], self.wavelengths[-1],
+                           num).astype(int)
+
+    def _next_obs_time(self, exptime):
+        obs_time = self.obs_time
+        self.obs_time += datetime.timedelta(seconds=exptime + 20.)
+        return obs_time
+
+    def _image(self, signal):
+        "Bias plus signal (DN) plus read noise, as unsigned ints."
+        nx, ny = self.naxis
+        image = self.random.normal(self.bias_level + signal, self.read_noise,
+                                   size=(ny, nx))
+        return np.clip(image, 0, 65535).astype(np.uint16)
+
+    def amp_header(self, amp):
+        "Header of the image extension for amplifier amp."
+        nx, ny = self.naxis
+        header = fits.Header()
+        header['EXTNAME'] = 'Segment%02i' % (amp - 1)
+        header['AMPNO'] = amp
+        header['DATASEC'] = '[11:%i,1:%i]' % (nx - 20, ny - 20)
+        return header
+
+    def write_fits(self, filename, header, signal=0., extensions=()):
+        "Write a 16 amplifier FITS file."
+        hdus = fits.HDUList([fits.PrimaryHDU(header=header)])
+        for amp in range(1, 17):
+            hdus.append(fits.ImageHDU(data=self._image(signal),
+                                      header=self.amp_header(amp)))
+        hdus.extend(extensions)
+        hdus.writeto(filename, overwrite=True)
+        self.nfiles += 1
+
+    def write_data(self, outdir):
+        "Write the FITS files and results files of the delivery to outdir."
+        raise NotImplementedError
+
+    def write_metrology(self, outdir):
+        "Write the metrology files of the delivery to outdir."
+        raise NotImplementedError
+
+def _itl_flux(wl):
+    "Plausible ITL diode flux (photons/s/mm^2) at wavelength wl (nm)."
+    return 1e8*(wl/500.)**4
+
+class ItlDelivery(VendorDelivery):
+    "Synthetic ITL delivery, with the results in subdirectories per test."
+    vendor = 'ITL'
+    lsst_num = 'ITL-3800C-068'
+    vendor_id = 'ID068_SN20862'
+    tests = (('fe55', 5), ('bias', 10), ('dark', 5), ('superflat1', 10),
+             ('superflat2', 10), ('linearity', 20), ('ptc', 40))
+    trap_objects = ('pocketpump first bias', 'pocket pump',
+                    'pocketpump second bias', 'pocket pump reference flat')
+
+    def header(self, exptime, obj, monowl=500., mondiode=1e-9):
+        "Primary header of an ITL FITS file."
+        obs_time = self._next_obs_time(exptime)
+        header = fits.Header()
+        header['DATE-OBS'] = obs_time.strftime('%Y-%m-%d')
+        header['TIME-OBS'] = obs_time.strftime('%H:%M:%S.00')
+        header['EXPTIME'] = float(exptime)
+        header['OBJECT'] = obj
+        header['IMAGETYP'] = obj
+        header['MONOWL'] = float(monowl)
+        header['MONDIODE'] = mondiode
+        header['CCD_SERN'] = self.vendor_id
+        return header
+
+    def filename(self, subdir, test, index):
+        "ITL file name, e.g., ID068_SN20862_superflat.0001.fits"
+        return os.path.join(subdir, '%s_%s.%04i.fits'
+                            % (self.vendor_id, test, index))
+
+    def _write_test(self, outdir, test, num):
+        subdir = os.path.join(outdir, test)
+        os.makedirs(subdir)
+        ## plus a leading zero exposure frame, as in the ITL data
+        nframes = self.num_frames(num) + (test in ('fe55', 'dark', 'ptc'))
+        for iframe in range(nframes):
+            if test == 'bias' or (iframe == 0 and test in ('fe55', 'dark',
+                                                           'ptc')):
+                exptime, signal = 0., 0.
+            elif test == 'ptc':
+                ## pairs of frames with the same exposure time
+                exptime = 0.5*((iframe + 1)//2)
+                signal = 2000.*exptime
+            elif test == 'linearity':
+                exptime = 0.25*iframe
+                signal = 2000.*exptime
+            elif test == 'dark':
+                exptime, signal = 500., 2.
+            elif test == 'fe55':
+                exptime, signal = 60., 0.
+            else:
+                exptime = 5.
+                signal = 1000. if test == 'superflat1' else 20000.
+            filename = self.filename(subdir, test.rstrip('12'), iframe + 1)
+            self.write_fits(filename, self.header(exptime, test), signal)
+
+    def write_data(self, outdir):
+        "Write the FITS files and results files of the delivery to outdir."
+        outdir = os.path.join(outdir, self.vendor_id)
+        os.makedirs(outdir)
+        for test, num in self.tests:
+            self._write_test(outdir, test, num)
+        subdir = os.path.join(outdir, 'pocketpump')
+        os.makedirs(subdir)
+        for i, obj in enumerate(self.trap_objects):
+            exptime = 0. if obj.endswith('bias') else 1.
+            filename = self.filename(subdir, 'pocketpump', i + 1)
+            self.write_fits(filename, self.header(exptime, obj),
+                            1000.*exptime)
+        subdir = os.path.join(outdir, 'qe')
+        os.makedirs(subdir)
+        self.write_fits(self.filename(subdir, 'qe', 1),
+                        self.header(0., 'qe bias'))
+        for i, wl in enumerate(self.qe_wavelengths()):
+            filename = self.filename(subdir, 'qe', i + 2)
+            self.write_fits(filename, self.header(1., 'qe', monowl=wl,
+                                                  mondiode=_itl_flux(wl)),
+                            20000.)
+        self.write_results(outdir)
+        return outdir
+
+    def write_results(self, outdir):
+        "Write the ITL .txt results files."
+        exts = ['%02i' % amp for amp in range(16)]
+        def results(filename, *sections, **info):
+            info = [('DataFile', filename), ('numchans', 16)] + \
+                sorted(info.items())
+            _ini_file(os.path.join(outdir, filename),
+                      (('Info', info),) + sections)
+        gains = self.random.uniform(2.5, 3.5, 16)
+        noise = self.random.uniform(4., 7., 16)
+        results('fe55.txt',
+                ('SystemGain', [('gain_%s' % x, '%.3f' % g)
+                                for x, g in zip(exts, gains)]),
+                ('ReadNoise', [('readnoise_%s' % x, '%.2f' % n)
+                               for x, n in zip(exts, noise)]
+                 + [('systemnoisecorrection_%s' % x, '%.2f' % (0.3*n))
+                    for x, n in zip(exts, noise)]),
+                *[('Events Channel %s' % x, [('meansigma', '%.3f' % s),
+                                             ('numevents', 5000)])
+                  for x, s in zip(exts, self.random.uniform(0.3, 0.4, 16))])
+        results('brightdefects.txt', ('BrightRejection',
+                                      [('brightrejectedpixels', 120)]))
+        results('darkdefects.txt', ('DarkRejection',
+                                    [('darkrejectedpixels', 80)]))
+        fracs = (50., 90., 95., 99.)
+        results('dark.txt', ('DarkSignal',
+                             [('darkfrac%i' % i, frac)
+                              for i, frac in enumerate(fracs)]
+                             + [('darkrate%i' % i, '%.4f' % (0.001*frac))
+                                for i, frac in enumerate(fracs)]))
+        for filename in ('eper1.txt', 'eper2.txt'):
+            results(filename,
+                    ('HCTE', [('hcte_%s' % x, '%.7f' % (1. - 1e-6*c))
+                              for x, c in zip(exts, self.random.uniform(
+                                  1, 5, 16))]),
+                    ('VCTE', [('vcte_%s' % x, '%.7f' % (1. - 1e-6*c))
+                              for x, c in zip(exts, self.random.uniform(
+                                  1, 5, 16))]))
+        results('traps.txt', ('Traps', [('numtraps', 0)]))
+        results('linearity.txt', ('Residuals', [
+            ('residuals%i' % i,
+             ' '.join('%.3f' % x for x in self.random.normal(0, 0.5, 16)))
+            for i in range(self.num_frames(20))]))
+        results('prnu.txt', ('PRNU', [('DataFormat', 'Wavelength PRNU[%]')]
+                             + [('prnu_%02i' % i, '%i %.3f' % (wl, 1. + i/10.))
+                                for i, wl in enumerate((350, 450, 500, 620,
+                                                        750, 870, 1000))]))
+        results('qe.txt',
+                ('QE', [('DataFormat', 'Wave[nm] QE Mean[DN] ExpTime[s] '
+                         'Flux Throughput')]
+                 + [('QE_%02i' % i, '%.1f %.3f 19700 1.000 %.3e 0.920'
+                     % (wl, 0.9, _itl_flux(wl)))
+                    for i, wl in enumerate(self.qe_wavelengths())]),
+                CalScale='1.340', Grade='PASS')
+        with open(os.path.join(outdir, 'BNL_bias_stats.txt'), 'w') as output:
+            output.write('# amp  mean  stdev\n')
+            for amp in range(1, 17):
+                output.write('%i  %.2f  %.2f\n' % (amp, self.bias_level,
+                                                   self.read_noise))
+
+    def write_metrology(self, outdir):
+        "Write the metrology scan and its summary to outdir/metrology."
+        outdir = os.path.join(outdir, self.vendor_id, 'metrology')
+        os.makedirs(outdir)
+        znom = 12.992
+        quantiles = (0., 0.5, 1., 2.5, 25., 50., 75., 97.5, 99., 99.5, 100.)
+        zquan = np.sort(self.random.normal(znom, 0.002, len(quantiles)))
+        _ini_file(os.path.join(outdir, 'metrology.txt'),
+                  (('Info', [('DataFile', 'metrology.txt')]),
+                   ('Mounting', [('Grade', 'PASS')]),
+                   ('Height', [('ZNom', znom), ('Units', 'mm')]
+                    + [('ZQuan_%.1f' % q, '%.4f' % z)
+                       for q, z in zip(quantiles, zquan)]),
+                   ('Flatness', [('Grade', 'PASS'), ('Units', 'um')])))
+        scan_file = os.path.join(outdir, '%s_Z_Inspect.txt'
+                                 % self.vendor_id)
+        npoints = self.num_frames(2000)
+        with open(scan_file, 'w') as output:
+            output.write('Program: LSST_STA3800_Z_Inspect_R4.01.voy %s\n'
+                         % self.obs_time.strftime('%I:%M:%S %p  %A, %B %d, %Y'))
+            output.write('Company: University of Arizona   '
+                         'Imaging Technology Lab\n\n')
+            for x, y, z in zip(self.random.uniform(-20, 20, npoints),
+                               self.random.uniform(-20, 20, npoints),
+                               self.random.normal(znom, 0.002, npoints)):
+                output.write('%10.4f %10.4f %10.4f\n' % (x, y, z))
+
+class e2vDelivery(VendorDelivery):
+    "Synthetic e2v delivery, with all of the files at the top level."
+    vendor = 'E2V'
+    lsst_num = 'E2V-CCD250-179'
+    vendor_id = '16013-05-01'
+    naxis_default = (522, 2010)
+    tests = (('xray_xray', 5), ('noims_nois', 5), ('dark_dark', 5),
+             ('trapspp_cycl', 1), ('sflath_illu', 5), ('sflatl_illu', 5),
+             ('xtalk_illu', 2), ('ifwm_illu', 20))
+
+    def header(self, exposure, wavelen=500., lightpow=1.):
+        "Primary header of an e2v FITS file."
+        obs_time = self._next_obs_time(exposure)
+        header = fits.Header()
+        header['DATE-OBS'] = obs_time.strftime('%Y-%m-%dT%H:%M:%S.000')
+        header['EXPOSURE'] = float(exposure)
+        header['DEV_ID'] = self.vendor_id
+        header['WAVELEN'] = float(wavelen)
+        header['LIGHTPOW'] = float(lightpow)
+        header['MONDIODE'] = 0.
+        header['TEMP_MEA'] = -100.
+        for amp in range(1, 17):
+            header['SYS_G%i' % amp] = self.random.uniform(0.9, 1.1)
+        return header
+
+    def archon(self):
+        "ARCHON extension with the system noise of each amplifier."
+        header = fits.Header()
+        for amp in range(1, 17):
+            header['SYS_N%i' % amp] = self.random.uniform(1., 3.)
+        return fits.ImageHDU(header=header, name='ARCHON')
+
+    def filename(self, outdir, test, index):
+        return os.path.join(outdir, '%s_%s_%03i_%s.fits'
+                            % (self.vendor_id, test, index,
+                               self.obs_time.strftime('%Y%m%d%H%M%S')))
+
+    def write_data(self, outdir):
+        "Write the FITS files and results files of the delivery to outdir."
+        for test, num in self.tests:
+            for i in range(self.num_frames(num)):
+                exposure = {'noims_nois': 0., 'dark_dark': 500.,
+                            'ifwm_illu': 1. + i}.get(test, 5.)
+                signal = 0. if test in ('noims_nois', 'xray_xray',
+                                        'dark_dark') else 1000.*exposure
+                self.write_fits(self.filename(outdir, test, i),
+                                self.header(exposure), signal,
+                                extensions=[self.archon()])
+        for i, wl in enumerate(self.qe_wavelengths()):
+            self.write_fits(self.filename(outdir, 'flat_%04i_illu' % wl, i),
+                            self.header(1., wavelen=wl,
+                                        lightpow=_itl_flux(wl)*1e-8),
+                            20000., extensions=[self.archon()])
+        self.write_results(outdir)
+        return outdir
+
+    def write_results(self, outdir):
+        "Write the e2v .csv summaries and the Mechanical Shim Test Sheet."
+        stamp = self.obs_time.strftime('%Y%m%d%H%M%S')
+        def summary(name, header, columns, label_values=range(1, 17)):
+            filename = os.path.join(outdir, '%s_%s_Summary_%s.csv'
+                                    % (self.vendor_id, name, stamp))
+            rows = [[label] + [column(label) for column in columns]
+                    for label in label_values]
+            _csv_file(filename, header, rows)
+        uniform = lambda low, high: (lambda x: '%.6f'
+                                     % self.random.uniform(low, high))
+        integer = lambda low, high: (lambda x: self.random.randint(low, high))
+        summary('Gain_X-Ray', ['Amp', 'Gain (e-/DN)'], [uniform(2.5, 3.5)])
+        summary('PSF', ['Amp', 'PSF (um)'], [uniform(3.5, 4.5)])
+        summary('Noise_Multiple_Samples',
+                ['Amp', 'Samples', 'Read Noise (e-)', 'System Noise (e-)',
+                 'Total Noise (e-)'],
+                [lambda x: 4, uniform(3., 4.), uniform(0.5, 1.),
+                 uniform(4.5, 5.)])
+        summary('Darkness', ['Amp', 'Dark Current (e-/pix/s)',
+                             'Bright Pixels', 'Bright Pixel Signal',
+                             'Bright Columns'],
+                [uniform(0.001, 0.01), integer(0, 50), uniform(1, 10),
+                 integer(0, 3)])
+        summary('PRDefs', ['Amp', 'Dark Columns', 'Dark Pixels', 'Threshold'],
+                [integer(0, 3), integer(0, 50), lambda x: 80])
+        summary('TrapsPP', ['Amp', 'Traps'], [integer(0, 20)])
+        for level in ('Low', 'High'):
+            summary('CTE_Optical_%s' % level, ['Amp', 'Parallel CTE',
+                                               'Serial CTE'],
+                    [uniform(0.999995, 1.), uniform(0.999995, 1.)])
+        summary('PRNU', ['Wavelength', 'PRNU (%)'], [uniform(0.5, 2.)],
+                label_values=(350, 450, 500, 620, 750, 870, 1000))
+        summary('FWC_Multiple_Image', ['Amp', 'FWC (e-)',
+                                       'Non-Linearity (%)',
+                                       'Non-Linearity Signal (e-)'],
+                [uniform(1.2e5, 1.4e5), uniform(0.1, 0.3),
+                 uniform(8e4, 1e5)])
+        wls = self.qe_wavelengths()
+        _csv_file(os.path.join(outdir, '%s_QE_Summary_%s.csv'
+                               % (self.vendor_id, stamp)),
+                  ['Amp'] + ['%i' % wl for wl in wls],
+                  [[amp] + ['%.2f' % x for x in self.random.uniform(
+                      60, 95, len(wls))] for amp in range(1, 17)])
+        xls_file = sorted(glob.glob(os.path.join(
+            _test_data_dir, 'e2v_test_data',
+            '*Mechanical_Shim_Test_Sheet.xls')))[0]
+        shutil.copy(xls_file, os.path.join(
+            outdir, '%s_Mechanical_Shim_Test_Sheet.xls' % self.vendor_id))
+
+    def write_metrology(self, outdir):
+        "Write the CT100 metrology scan to outdir."
+        filename = os.path.join(outdir, '%s_CT100_%s.csv'
+                                % (self.vendor_id,
+                                   self.obs_time.strftime('%Y%m%d%H%M%S')))
+        npoints = self.num_frames(2000)
+        rows = zip(self.random.uniform(-20, 20, npoints),
+                   self.random.uniform(-20, 20, npoints),
+                   self.random.normal(13., 0.002, npoints))
+        _csv_file(filename, ['X', 'Y', 'Z'],
+                  [['%.4f' % x for x in row] for row in rows])
+
+def _tarball(srcdir, filename, compression):
+    "Tar up the contents of srcdir and write the .md5 file."
+    with tarfile.open(filename, 'w:%s' % compression) as tar:
+        for item in sorted(os.listdir(srcdir)):
+            tar.add(os.path.join(srcdir, item), arcname=item)
+    with open(filename + '.md5', 'w') as output:
+        output.write('%s  %s\n' % (_md5(filename), os.path.basename(filename)))
+    return os.path.getsize(filename)
+
+def make_delivery(lcaroot, vendor='ITL', naxis=None, scale=1., seed=None,
+                  delivery_date=None, compression='bz2', metrology=True,
+                  verbose=True):
+    """
+    Write a synthetic delivery for vendor ('ITL' or 'E2V') to the FTP
+    area under lcaroot.  Return a dict with the LSST ID, the FTP
+    directory and the numbers of files and bytes delivered.
+    """
+    if vendor.upper() == 'ITL':
+        delivery = ItlDelivery(naxis or (544, 2048), scale=scale, seed=seed)
+    elif vendor.upper() == 'E2V':
+        delivery = e2vDelivery(naxis or e2vDelivery.naxis_default,
+                               scale=scale, seed=seed)
+    else:
+        raise ValueError('Unknown vendor: %s' % vendor)
+    if delivery_date is None:
+        delivery_date = datetime.date.today().strftime('%Y%m%d')
+    ftpdir = os.path.join(lcaroot, 'vendorData', 'FTP', delivery.vendor)
+    deliverydir = os.path.join(ftpdir, 'delivery', delivery_date)
+    os.makedirs(deliverydir)
+    staging = os.path.join(deliverydir, '.staging')
+    ext = '.tar.%s' % compression
+    nbytes = 0
+    try:
+        datadir = os.path.join(staging, 'data')
+        os.makedirs(datadir)
+        if verbose:
+            print('Writing %s files to %s' % (delivery.vendor, datadir))
+        delivery.write_data(datadir)
+        tarball = os.path.join(deliverydir, delivery.vendor_id + ext)
+        if verbose:
+            print('Writing', tarball)
+        nbytes += _tarball(datadir, tarball, compression)
+        links = [(tarball, delivery.lsst_num + ext)]
+        if metrology:
+            metdir = os.path.join(staging, 'metrology')
+            os.makedirs(metdir)
+            delivery.write_metrology(metdir)
+            tarball = os.path.join(deliverydir,
+                                   delivery.vendor_id + '_metrology' + ext)
+            nbytes += _tarball(metdir, tarball, compression)
+            links.append((tarball, 'metrology' + ext))
+    finally:
+        shutil.rmtree(staging)
+    ## Standard file names are links to the vendor files
+    for target, link in links:
+        for suffix in ('', '.md5'):
+            os.symlink(os.path.basename(target) + suffix,
+                       os.path.join(deliverydir, link + suffix))
+    vendorFTPdir = os.path.join(ftpdir, delivery.lsst_num)
+    if os.path.lexists(vendorFTPdir):
+        os.remove(vendorFTPdir)
+    os.symlink(deliverydir, vendorFTPdir)
+    return dict(lsst_num=delivery.lsst_num, vendor=delivery.vendor,
+                vendorFTPdir=vendorFTPdir, nfiles=delivery.nfiles,
+                nbytes=nbytes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('lcaroot', help='root directory of the FTP area')
+    parser.add_argument('--vendor', default='ITL', choices=('ITL', 'E2V'))
+    parser.add_argument('--naxis', default=None,
+                        help='NAXIS1,NAXIS2 of the amplifier images')
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='factor applied to the numbers of frames')
+    parser.add_argument('--date', default=None,
+                        help='delivery date (YYYYMMDD), default today')
+    parser.add_argument('--compression', default='bz2', choices=('bz2', 'gz'))
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    naxis = None
+    if args.naxis is not None:
+        naxis = [int(x) for x in args.naxis.split(',')]
+    result = make_delivery(args.lcaroot, args.vendor, naxis=naxis,
+                           scale=args.scale, seed=args.seed,
+                           delivery_date=args.date,
+                           compression=args.compression)
+    print('%(vendor)s delivery for %(lsst_num)s: %(nfiles)i FITS files, '
+          '%(nbytes)i bytes of tarballs in %(vendorFTPdir)s' % result)
+
+if __name__ == '__main__':
+    main()
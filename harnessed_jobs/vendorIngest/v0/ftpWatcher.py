@@ -0,0 +1,294 @@
+"""
+Watcher of the vendor FTP area that pre-stages complete deliveries.
+
+Deliveries are announced in the FTP area by a link named after the
+sensor (see producer_vendorIngest.py),
+
+  $LSSTROOT/vendorData/FTP/<vendor>/<LSSTID> -> delivery/<date>
+
+pointing to a directory with the data tarball, <LSSTID>*.tar.bz2 (or
+.tar.gz), its .md5 checksum file, and optionally metrology tarball and
+checksum files.  FtpWatcher polls the vendor directories and considers
+a delivery complete once the tarballs and checksum files are present
+and their sizes have not changed for stable_polls consecutive polls.  A
+complete delivery is pre-staged right away: its tarballs are verified
+and extracted, with their final permissions, member indexes and an
+ingest manifest, into
+
+  $LSSTROOT/vendorData/<vendor>/<LSSTID>/<eTmode>/staged-<date>
+
+When the traveler step runs later, the producer finds this manifest as
+a resumable ingest of the same tarballs (ingestManifest.find_resumable)
+and only has to register the files.  The manifest is locked while a
+delivery is staged, so a producer started in the meantime waits for the
+watcher to finish; conversely, a delivery whose ingest directory holds
+a manifest locked by a running producer is left to that producer.
+
+The poll state (directory mtimes, file sizes and the status of each
+delivery) is kept in a JSON state file, so that a restarted watcher
+neither re-stages deliveries nor lists directories that have not
+changed: a delivery directory is only listed while its delivery is
+pending or when its mtime changes.
+
+  python ftpWatcher.py --lcaroot /nfs/farm/g/lsst/u1 --state watcher.json
+"""
+from __future__ import absolute_import, print_function
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import multiprocessing
+import tarballIngest
+import tarballIndex
+import ingestManifest
+
+__all__ = ['delivery_files', 'FtpWatcher']
+
+def delivery_files(flist, LSSTID):
+    """
+    Return the data, data checksum, metrology and metrology checksum
+    file names (or None) found in a delivery directory listing, using
+    the same recipe as the producer.
+    """
+    found = dict(datafile=None, md5file=None, metrologyDatafile=None,
+                 metrologyMd5file=None)
+    for name in flist:
+        if name.startswith('metrology'):
+            prefix = 'metrology'
+        elif name.startswith(LSSTID):
+            prefix = ''
+        else:
+            continue
+        if name.endswith('.tar.bz2') or name.endswith('.tar.gz'):
+            found[prefix + ('Datafile' if prefix else 'datafile')] = name
+        elif name.endswith('.md5') or name.endswith('.md5sum'):
+            found[prefix + ('Md5file' if prefix else 'md5file')] = name
+    return found
+
+class FtpWatcher(object):
+    "Poll the vendor FTP area and pre-stage complete deliveries."
+    def __init__(self, lcaroot, state_file, vendors=('ITL', 'E2V'),
+                 eTmode='Prod', stable_polls=2, processes=None,
+                 file_mode=0o660, dir_mode=0o770, gid=None, verbose=True):
+        """
+        Constructor.
+        lcaroot = ROOT of the LSST Camera data, i.e., $LSSTROOT
+        state_file = JSON file in which the poll state is kept
+        vendors = vendor directories of the FTP area to watch
+        eTmode = eTraveler mode (database) of the ingests to prepare
+        stable_polls = number of polls without size changes after which
+                       a delivery is considered complete
+        """
+        self.lcaroot = lcaroot
+        self.state_file = state_file
+        self.vendors = vendors
+        self.eTmode = eTmode
+        self.stable_polls = stable_polls
+        self.processes = processes
+        self.file_mode = file_mode
+        self.dir_mode = dir_mode
+        self.gid = gid
+        self.verbose = verbose
+        self.state = dict(dirs={}, deliveries={})
+        if os.path.isfile(state_file):
+            with open(state_file) as fd:
+                self.state = json.load(fd)
+        self._changed = False
+
+    def _log(self, *args):
+        if self.verbose:
+            print(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  *args)
+            sys.stdout.flush()
+
+    def write_state(self):
+        "Write the poll state, replacing the previous file atomically."
+        tmpfile = self.state_file + '.tmp'
+        with open(tmpfile, 'w') as output:
+            json.dump(self.state, output, indent=2, sort_keys=True)
+            output.write('\n')
+        os.rename(tmpfile, self.state_file)
+        self._changed = False
+
+    def _dir_changed(self, path):
+        "Return True if the mtime of directory path differs from the last poll."
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        if self.state['dirs'].get(path) == mtime:
+            return False
+        self.state['dirs'][path] = mtime
+        self._changed = True
+        return True
+
+    def poll(self):
+        """
+        Look for new or changed deliveries and pre-stage those that are
+        complete.  Return the list of LSST IDs staged by this poll.
+        """
+        staged = []
+        for vendor in self.vendors:
+            ftpdir = os.path.join(self.lcaroot, 'vendorData', 'FTP', vendor)
+            if self._dir_changed(ftpdir):
+                LSSTIDs = sorted(os.listdir(ftpdir))
+            else:
+                # Only the delivery directories already known can change.
+                LSSTIDs = sorted(LSSTID for LSSTID, entry
+                                 in self.state['deliveries'].items()
+                                 if entry['vendor'] == vendor)
+            for LSSTID in LSSTIDs:
+                link = os.path.join(ftpdir, LSSTID)
+                if not os.path.islink(link) or not os.path.isdir(link):
+                    continue
+                if self._check(vendor, LSSTID, link):
+                    staged.append(LSSTID)
+        if self._changed:
+            self.write_state()
+        return staged
+
+    def _check(self, vendor, LSSTID, link):
+        "Update the state of a delivery, staging it if it is complete."
+        target = os.path.realpath(link)
+        entry = self.state['deliveries'].get(LSSTID)
+        if entry is None or entry['target'] != target:
+            entry = dict(vendor=vendor, target=target, status='pending',
+                         sizes={}, stable=0)
+            self.state['deliveries'][LSSTID] = entry
+            self._changed = True
+            self._log('New delivery', LSSTID, '->', target)
+        if entry['status'] != 'pending':
+            if not self._dir_changed(target):
+                return False
+            # Files were added, removed or replaced: wait for them to
+            # be stable again.
+            entry.update(status='pending', sizes={}, stable=0)
+        else:
+            self._dir_changed(target)
+        files = delivery_files(os.listdir(target), LSSTID)
+        names = [name for name in files.values() if name is not None]
+        sizes = dict((name, os.path.getsize(os.path.join(target, name)))
+                     for name in names)
+        complete = (files['datafile'] is not None and
+                    files['md5file'] is not None and
+                    (files['metrologyDatafile'] is None) ==
+                    (files['metrologyMd5file'] is None))
+        if sizes != entry['sizes'] or not complete:
+            entry.update(sizes=sizes, stable=0, status='pending')
+            self._changed = True
+            return False
+        entry['stable'] += 1
+        self._changed = True
+        if entry['stable'] < self.stable_polls:
+            return False
+        try:
+            entry['vendorDir'] = self.stage(vendor, LSSTID, target, files)
+            entry['status'] = 'staged'
+        except ingestManifest.ManifestLocked as eobj:
+            self._log('Not pre-staging', LSSTID, '(being ingested):', eobj)
+            entry['status'] = 'busy'
+            return False
+        except Exception as eobj:
+            self._log('Pre-staging of', LSSTID, 'failed:', eobj)
+            entry.update(status='failed', error=str(eobj))
+            return False
+        self._log('Pre-staged', LSSTID, 'in', entry['vendorDir'])
+        return True
+
+    def stage(self, vendor, LSSTID, target, files):
+        """
+        Verify and extract the tarballs of a complete delivery into the
+        staging area, recording them in an ingest manifest that the
+        producer will resume.  Return the staging directory.  Raise
+        ingestManifest.ManifestLocked if another process, i.e., the
+        producer, holds an ingest manifest of the sensor.
+        """
+        tarballs = {}
+        for datafile, md5file in (('datafile', 'md5file'),
+                                  ('metrologyDatafile', 'metrologyMd5file')):
+            if files[datafile] is not None:
+                tarballs[files[datafile]] = tarballIngest.read_md5file(
+                    os.path.join(target, files[md5file]))
+        parent = os.path.join(self.lcaroot, 'vendorData', vendor, LSSTID,
+                              self.eTmode)
+        locked = ingestManifest.locked_manifests(parent)
+        if locked:
+            raise ingestManifest.ManifestLocked(
+                'Ingest manifest %s is in use' % locked[0])
+        manifest = ingestManifest.find_resumable(parent, tarballs, wait=False)
+        if manifest is None:
+            jobid = 'staged-' + os.path.basename(target)
+            suffix = 0
+            while os.path.lexists(os.path.join(parent, jobid)):
+                # Staged or ingested from an earlier version of the delivery.
+                suffix += 1
+                jobid = 'staged-%s-%i' % (os.path.basename(target), suffix)
+            vendorDir = os.path.join(parent, jobid)
+            vendorLDir = os.path.join('/LSST/vendorData/', vendor, LSSTID,
+                                      self.eTmode, jobid)
+            os.makedirs(vendorDir)
+            manifest = ingestManifest.IngestManifest(vendorDir + '.manifest',
+                                                     wait=False)
+            manifest.set_info(vendorDir=vendorDir, vendorLDir=vendorLDir,
+                              jobid=jobid, tarballs=tarballs, staged=True)
+        vendorDir = manifest.info['vendorDir']
+        try:
+            for tarball, md5 in sorted(tarballs.items()):
+                datafile = os.path.join(target, tarball)
+                index = tarballIndex.TarballIndex(datafile, md5=md5)
+                tarballIngest.extract_tarball(datafile, md5, vendorDir,
+                                              processes=self.processes,
+                                              manifest=manifest,
+                                              file_mode=self.file_mode,
+                                              dir_mode=self.dir_mode,
+                                              gid=self.gid, index=index,
+                                              verbose=False)
+                if index.members:
+                    index.write(vendorDir + '.' + tarball + '.index')
+        finally:
+            manifest.close()
+        return vendorDir
+
+    def run(self, interval=60., once=False):
+        "Poll every interval seconds (only once if once is True)."
+        while True:
+            self.poll()
+            if once:
+                return
+            time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pre-stage complete vendor deliveries in the FTP area.')
+    parser.add_argument('--lcaroot', default='/nfs/farm/g/lsst/u1',
+                        help='ROOT of all LSST Camera data')
+    parser.add_argument('--state', default='vendorIngest_ftpWatcher.json',
+                        help='poll state file')
+    parser.add_argument('--vendors', default='ITL,E2V',
+                        help='comma-separated vendor directories to watch')
+    parser.add_argument('--mode', default='Prod',
+                        help='eTraveler mode of the ingests (Prod, Dev, ...)')
+    parser.add_argument('--interval', type=float, default=60.,
+                        help='seconds between polls')
+    parser.add_argument('--stable-polls', type=int, default=2,
+                        help='polls without size changes for completion')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='processes for parallel decompression')
+    parser.add_argument('--gid', type=int,
+                        default=int(os.environ.get('VENDORINGEST_GID', 2218)),
+                        help='group id of the staged files')
+    parser.add_argument('--once', action='store_true',
+                        help='poll once and exit')
+    args = parser.parse_args()
+
+    watcher = FtpWatcher(args.lcaroot, args.state,
+                         vendors=args.vendors.split(','), eTmode=args.mode,
+                         stable_polls=args.stable_polls,
+                         processes=args.processes, gid=args.gid)
+    watcher.run(interval=args.interval, once=args.once)
+
+if __name__ == '__main__':
+    main()
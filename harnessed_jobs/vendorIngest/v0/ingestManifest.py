@@ -0,0 +1,215 @@
+"""
+On-disk manifest recording the progress of a vendor data ingest.
+
+The manifest lives next to the unpacked delivery (vendorDir) as
+vendorDir + '.manifest'.  It is an append-only file with one JSON
+record per line, so that every state change costs a single small
+append and a partially written last line (e.g., after a crash) is
+simply ignored when the manifest is read back.  It holds
+
+  - general information about the ingest (vendorDir, vendorLDir,
+    job id, tarball checksums, completion),
+  - the tarballs whose md5 checksums have been verified, and
+  - for each tar member its tarball, type, size, mtime, content md5
+    and the ingest phases completed for it.
+
+A rerun of the producer for the same delivery uses the manifest to
+skip the work that has already been done.  Records may be added from
+several threads, e.g., while tarballs are extracted concurrently.
+
+An IngestManifest holds an exclusive flock on its file until it is
+closed, so that only one process at a time, e.g., the FTP watcher or
+the producer, extracts and registers the files of a delivery.
+"""
+from __future__ import absolute_import, print_function
+import os
+import glob
+import json
+import fcntl
+import threading
+from collections import OrderedDict
+
+__all__ = ['IngestManifest', 'ManifestLocked', 'find_resumable',
+           'locked_manifests']
+
+class ManifestLocked(IOError):
+    "Raised when an ingest manifest is held by another process."
+
+class IngestManifest(object):
+    """
+    Append-only manifest of the tarballs and members of a vendor
+    delivery and of their per-phase ingest state.
+    """
+    phases = ('extracted', 'permissions', 'registered')
+
+    def __init__(self, filename, wait=True):
+        """
+        Constructor.
+        filename = manifest file, created if it does not exist
+        wait = if True, wait for another process holding the manifest to
+               close it, otherwise raise ManifestLocked
+        """
+        self.filename = filename
+        self.info = {}
+        self.verified = {}
+        self.members = OrderedDict()
+        self._lock = threading.RLock()
+        self._output = open(filename, 'a')
+        try:
+            fcntl.flock(self._output.fileno(),
+                        fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self._output.close()
+            raise ManifestLocked('Ingest manifest %s is in use' % filename)
+        # Replay the records only once the lock is held, since the
+        # process that held it may have added some.
+        truncated = self._replay()
+        if truncated:
+            # Terminate a partially written last record.
+            self._output.write('\n')
+
+    def _replay(self):
+        """
+        Rebuild the manifest state from the records on disk.  Return
+        True if the last record is not newline-terminated.
+        """
+        line = '\n'
+        with open(self.filename) as input_:
+            for line in input_:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Incomplete record from an interrupted write.
+                    continue
+                self._apply(record)
+        return not line.endswith('\n')
+
+    def _apply(self, record):
+        kind = record['record']
+        if kind == 'info':
+            self.info.update(record['info'])
+        elif kind == 'verified':
+            self.verified[record['tarball']] = record['md5']
+        elif kind == 'member':
+            entry = dict((key, record[key]) for key in
+                         ('tarball', 'type', 'size', 'mtime', 'md5'))
+            entry['phases'] = set(record.get('phases', ()))
+            self.members[record['name']] = entry
+        elif kind == 'phase':
+            member = self.members.setdefault(record['name'],
+                                             dict(tarball=None, type=None,
+                                                  size=None, mtime=None,
+                                                  md5=None, phases=set()))
+            member['phases'].add(record['phase'])
+        elif kind == 'reset':
+            for name in [name for name, member in self.members.items()
+                         if member['tarball'] == record['tarball']]:
+                del self.members[name]
+            self.verified.pop(record['tarball'], None)
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            self._output.write(json.dumps(record) + '\n')
+            self._output.flush()
+
+    def set_info(self, **kwds):
+        "Record general information about this ingest."
+        self._append(dict(record='info', info=kwds))
+
+    @property
+    def complete(self):
+        "True if the ingest has been marked as complete."
+        return self.info.get('complete', False)
+
+    def add_member(self, name, tarball, type_, size, mtime, md5,
+                   phases=('extracted',)):
+        "Record a tar member and the phases already completed for it."
+        self._append(dict(record='member', name=name, tarball=tarball,
+                          type=type_, size=size, mtime=mtime, md5=md5,
+                          phases=list(phases)))
+
+    def mark(self, name, phase):
+        "Record the completion of an ingest phase for a member."
+        if phase not in self.phases:
+            raise ValueError('Unknown ingest phase: %s' % phase)
+        if not self.done(name, phase):
+            self._append(dict(record='phase', name=name, phase=phase))
+
+    def done(self, name, phase):
+        "Return True if phase has been completed for the named member."
+        try:
+            return phase in self.members[name]['phases']
+        except KeyError:
+            return False
+
+    def pending(self, phase, tarball=None):
+        "Return the names of the members for which phase is not done."
+        with self._lock:
+            return [name for name, member in self.members.items()
+                    if phase not in member['phases'] and
+                    (tarball is None or member['tarball'] == tarball)]
+
+    def tarball_verified(self, tarball, md5):
+        "Record a successful checksum verification of a tarball."
+        self._append(dict(record='verified', tarball=tarball, md5=md5))
+
+    def is_extracted(self, tarball, md5):
+        """
+        Return True if tarball has been verified against md5 and all of
+        its members have been extracted.
+        """
+        if self.verified.get(tarball) != md5:
+            return False
+        return not self.pending('extracted', tarball=tarball)
+
+    def reset(self, tarball):
+        "Forget the verification and all members of a tarball."
+        self._append(dict(record='reset', tarball=tarball))
+
+    def sync(self):
+        "Force the manifest to disk, e.g., at the end of a phase."
+        with self._lock:
+            self._output.flush()
+            os.fsync(self._output.fileno())
+
+    def close(self):
+        "Sync and close the manifest file, releasing its lock."
+        if not self._output.closed:
+            self.sync()
+            self._output.close()
+
+def locked_manifests(parent_dir):
+    "Return the manifest files in parent_dir held by another process."
+    locked = []
+    for filename in sorted(glob.glob(os.path.join(parent_dir, '*.manifest'))):
+        try:
+            fd = open(filename)
+        except IOError:
+            continue
+        with fd:
+            try:
+                fcntl.flock(fd.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError:
+                locked.append(filename)
+    return locked
+
+def find_resumable(parent_dir, tarballs, wait=True):
+    """
+    Return the IngestManifest of an incomplete ingest in parent_dir of
+    the same tarballs, i.e., with identical names and md5 checksums, or
+    None if there is no such ingest.  Manifests held by another process
+    are waited for, or skipped if wait is False.
+    """
+    for filename in sorted(glob.glob(os.path.join(parent_dir, '*.manifest')),
+                           key=os.path.getmtime, reverse=True):
+        try:
+            manifest = IngestManifest(filename, wait=wait)
+        except ManifestLocked:
+            continue
+        if (not manifest.complete and
+            manifest.info.get('tarballs') == tarballs and
+            os.path.isdir(manifest.info.get('vendorDir', ''))):
+            return manifest
+        manifest.close()
+    return None
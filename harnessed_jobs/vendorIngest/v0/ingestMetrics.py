@@ -0,0 +1,165 @@
+"""
+Timing and throughput instrumentation of the vendor data ingest.
+
+IngestMetrics records, for each phase of an ingest (e.g., FTP listing,
+checksum, extraction, permissions, registration), its wall time and the
+numbers of bytes and files processed, and, for individual operations
+such as the dataCatalog client calls, the distribution of their
+latencies.  The results are written to a JSON file, so that the phase
+dominating an ingest can be identified and ingest runs compared.
+
+Typical use:
+
+    metrics = IngestMetrics()
+    with metrics.phase('extraction') as phase:
+        ...
+        phase.add(nbytes=size, nfiles=1)
+    metrics.record('create', seconds)
+    metrics.write('vendorIngest_metrics.json')
+"""
+from __future__ import absolute_import, print_function
+import json
+import time
+import socket
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+__all__ = ['LatencyHistogram', 'Phase', 'IngestMetrics']
+
+class LatencyHistogram(object):
+    """
+    Histogram of operation latencies with logarithmic bins from 1 ms to
+    100 s, plus the number, total, minimum and maximum of the latencies.
+    """
+    edges = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+             1., 2., 5., 10., 20., 50., 100.)
+
+    def __init__(self):
+        self.counts = [0]*(len(self.edges) + 1)
+        self.num = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        "Add a latency, in seconds."
+        index = 0
+        while index < len(self.edges) and seconds >= self.edges[index]:
+            index += 1
+        self.counts[index] += 1
+        self.num += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def as_dict(self):
+        "Summary of the latencies, with the histogram bins labeled by their upper edges."
+        bins = OrderedDict()
+        for edge, count in zip(self.edges + ('inf',), self.counts):
+            bins['<%s' % edge] = count
+        return OrderedDict([('calls', self.num),
+                            ('total_time', self.total),
+                            ('mean_latency',
+                             self.total/self.num if self.num else None),
+                            ('min_latency', self.min),
+                            ('max_latency', self.max),
+                            ('histogram', bins)])
+
+class Phase(object):
+    """
+    Accumulated wall time, bytes, files and other counts of an ingest
+    phase, over all the times it was entered.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.
+        self.entries = 0
+        self.nbytes = 0
+        self.nfiles = 0
+        self.counts = OrderedDict()
+
+    def add(self, nbytes=0, nfiles=0, **counts):
+        "Add to the numbers of bytes and files, and to any other counts."
+        self.nbytes += nbytes
+        self.nfiles += nfiles
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def as_dict(self):
+        "Summary of the phase, including its throughput."
+        result = OrderedDict([('wall_time', self.wall_time),
+                              ('entries', self.entries),
+                              ('bytes', self.nbytes),
+                              ('files', self.nfiles)])
+        if self.wall_time > 0:
+            result['bytes_per_second'] = self.nbytes/self.wall_time
+            result['files_per_second'] = self.nfiles/self.wall_time
+        result.update(self.counts)
+        return result
+
+class IngestMetrics(object):
+    """
+    Phase timings and operation latencies of an ingest.  record() may
+    be called from several threads.
+    """
+    def __init__(self, **info):
+        self.info = OrderedDict(sorted(info.items()))
+        self.info.setdefault('host', socket.gethostname())
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.operations = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager timing one pass through the named phase.  It
+        returns the Phase object, to which bytes and files are added.
+        """
+        phase = self.phases.setdefault(name, Phase(name))
+        phase.entries += 1
+        tstart = time.time()
+        try:
+            yield phase
+        finally:
+            phase.wall_time += time.time() - tstart
+
+    def record(self, operation, seconds):
+        "Record the latency of one call of the named operation."
+        with self._lock:
+            if operation not in self.operations:
+                self.operations[operation] = LatencyHistogram()
+            self.operations[operation].add(seconds)
+
+    def as_dict(self):
+        "All metrics as a JSON-serializable dict."
+        with self._lock:
+            operations = OrderedDict((name, hist.as_dict()) for name, hist
+                                     in self.operations.items())
+        return OrderedDict([('info', self.info),
+                            ('start_time', self.start),
+                            ('wall_time', time.time() - self.start),
+                            ('phases', OrderedDict(
+                                (name, phase.as_dict())
+                                for name, phase in self.phases.items())),
+                            ('operations', operations)])
+
+    def write(self, filename):
+        "Write the metrics to a JSON file."
+        with open(filename, 'w') as output:
+            json.dump(self.as_dict(), output, indent=2)
+            output.write('\n')
+
+    def summary(self):
+        "Print a table of the phases and operations."
+        print('\n Ingest phase summary:')
+        for name, phase in self.phases.items():
+            print('%-20s %10.2f s %14i bytes %8i files' %
+                  (name, phase.wall_time, phase.nbytes, phase.nfiles))
+        if self.operations:
+            print('\n Operation latencies:')
+        for name, hist in self.operations.items():
+            print('%-20s %8i calls, mean %8.4f s, max %8.4f s' %
+                  (name, hist.num, hist.total/hist.num, hist.max))
+        print()
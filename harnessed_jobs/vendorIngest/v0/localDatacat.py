@@ -0,0 +1,197 @@
+"""
+In-process stand-in for the SRS dataCatalog RESTful client.
+
+LocalDatacat implements the client methods used by registry.doDC()
+(exists, children, mkdir, create_dataset, path, mkloc, patch_dataset)
+on an in-memory LocalCatalog, with configurable latency and error rate
+injected into every call.  Several clients, e.g., one per registry
+worker thread, can share one catalog:
+
+    catalog = LocalCatalog()
+    myDC = registry.registry()
+    myDC.clientFactory = lambda: LocalDatacat(catalog, latency=0.02,
+                                              error_rate=0.01)
+
+so that registration can be tested and benchmarked without the live
+dataCatalog.  catalog.calls counts the calls made per method.
+"""
+from __future__ import absolute_import, print_function
+import os
+import copy
+import time
+import random
+import threading
+
+__all__ = ['LocalDatacatError', 'Folder', 'Location', 'Dataset',
+           'LocalCatalog', 'LocalDatacat']
+
+class LocalDatacatError(Exception):
+    "Error returned by the stand-in dataCatalog."
+    def __init__(self, message, code=500):
+        super(LocalDatacatError, self).__init__(message)
+        self.message = message
+        self.code = code
+
+class Folder(object):
+    "dataCatalog folder."
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        self.path = path
+
+class Location(object):
+    "Location (site) of a dataset."
+    def __init__(self, site, resource):
+        self.name = site
+        self.site = site
+        self.resource = resource
+        self.scanStatus = 'UNSCANNED'
+
+class Dataset(object):
+    """
+    dataCatalog dataset.  As for the datacat client, a dataset with a
+    single location has site, resource and scanStatus attributes, and
+    one with several locations has a locations list instead.
+    """
+    def __init__(self, path, dataType, fileFormat, versionMetadata):
+        self.name = os.path.basename(path)
+        self.path = path
+        self.dataType = dataType
+        self.fileFormat = fileFormat
+        self.versionMetadata = dict(versionMetadata or {})
+        self._locations = []
+
+    def view(self):
+        "Copy of the dataset as returned to a client."
+        ds = copy.copy(self)
+        ds.versionMetadata = dict(self.versionMetadata)
+        del ds._locations
+        if len(self._locations) == 1:
+            location = self._locations[0]
+            ds.site = location.site
+            ds.resource = location.resource
+            ds.scanStatus = location.scanStatus
+        else:
+            ds.locations = [copy.copy(x) for x in self._locations]
+        return ds
+
+class LocalCatalog(object):
+    "Thread-safe in-memory folder and dataset store."
+    def __init__(self, root='/LSST'):
+        self.lock = threading.RLock()
+        self.folders = set([root])
+        self.datasets = {}
+        self.calls = {}
+
+    def count(self, method):
+        "Count a call of a client method."
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+class LocalDatacat(object):
+    """
+    Client of a LocalCatalog with the call signatures of the datacat
+    client.  Each call sleeps for latency seconds (plus a uniformly
+    distributed jitter) and fails with a LocalDatacatError with
+    probability error_rate, before it is carried out.
+    """
+    def __init__(self, catalog=None, latency=0., jitter=0., error_rate=0.,
+                 seed=None):
+        self.catalog = catalog if catalog is not None else LocalCatalog()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def _call(self, method):
+        self.catalog.count(method)
+        delay = self.latency + self.jitter*self.random.random()
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise LocalDatacatError('Injected error in %s' % method, 503)
+
+    def _dataset(self, path):
+        try:
+            return self.catalog.datasets[path]
+        except KeyError:
+            raise LocalDatacatError('No such dataset: %s' % path, 404)
+
+    def exists(self, path, versionId=None, site=None):
+        self._call('exists')
+        with self.catalog.lock:
+            return path in self.catalog.folders or \
+                path in self.catalog.datasets
+
+    def children(self, path, versionId=None, site=None, offset=None,
+                 max_num=None):
+        self._call('children')
+        with self.catalog.lock:
+            if path not in self.catalog.folders:
+                raise LocalDatacatError('No such folder: %s' % path, 404)
+            entries = [Folder(x) for x in self.catalog.folders
+                       if os.path.dirname(x) == path]
+            entries.extend(ds.view() for x, ds in
+                           self.catalog.datasets.items()
+                           if os.path.dirname(x) == path)
+        entries.sort(key=lambda x: x.path)
+        offset = offset or 0
+        if max_num is None:
+            return entries[offset:]
+        return entries[offset:offset + max_num]
+
+    def mkdir(self, path, type='folder', parents=False, **kwargs):
+        self._call('mkdir')
+        with self.catalog.lock:
+            if path in self.catalog.folders:
+                raise LocalDatacatError('Folder exists: %s' % path, 409)
+            parent = os.path.dirname(path)
+            if parent not in self.catalog.folders and not parents:
+                raise LocalDatacatError('No such folder: %s' % parent, 404)
+            while path not in ('', '/') and path not in self.catalog.folders:
+                self.catalog.folders.add(path)
+                path = os.path.dirname(path)
+        return Folder(path)
+
+    def create_dataset(self, path, name, dataType, fileFormat,
+                       versionId='new', site=None, resource=None,
+                       versionMetadata=None, **kwargs):
+        self._call('create_dataset')
+        dcLoc = os.path.join(path, name)
+        with self.catalog.lock:
+            if path not in self.catalog.folders:
+                raise LocalDatacatError('No such folder: %s' % path, 404)
+            if dcLoc in self.catalog.datasets:
+                raise LocalDatacatError('Dataset exists: %s' % dcLoc, 409)
+            ds = Dataset(dcLoc, dataType, fileFormat, versionMetadata)
+            ds._locations.append(Location(site, resource))
+            self.catalog.datasets[dcLoc] = ds
+            return ds.view()
+
+    def path(self, path, versionId=None, site=None):
+        self._call('path')
+        with self.catalog.lock:
+            if path in self.catalog.folders:
+                return Folder(path)
+            return self._dataset(path).view()
+
+    def mkloc(self, path, site, resource, versionId='current', **kwargs):
+        self._call('mkloc')
+        with self.catalog.lock:
+            ds = self._dataset(path)
+            if site in [x.site for x in ds._locations]:
+                raise LocalDatacatError('Location exists: %s' % site, 409)
+            ds._locations.append(Location(site, resource))
+            return ds.view()
+
+    def patch_dataset(self, path, dataset, versionId='current', site=None,
+                      **kwargs):
+        self._call('patch_dataset')
+        with self.catalog.lock:
+            ds = self._dataset(path)
+            dataset = dict(dataset)
+            ds.versionMetadata.update(dataset.pop('versionMetadata', {}))
+            for location in ds._locations:
+                if site is None or location.site == site:
+                    for key, value in dataset.items():
+                        setattr(location, key, value)
+            return ds.view()
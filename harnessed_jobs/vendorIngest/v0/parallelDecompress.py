@@ -0,0 +1,359 @@
+"""
+Multi-core decompression of vendor delivery tarballs.
+
+bzip2 compresses its input in independent blocks of at most 900 kB.
+Each block starts with the 48-bit magic number 0x314159265359 and the
+stream ends with 0x177245385090, neither of which is byte aligned.
+ParallelBz2Reader locates these markers in the compressed stream,
+re-wraps every block as a standalone single-block bzip2 stream and
+decodes the blocks in a process pool, returning the decompressed bytes
+in their original order through a file-like read() interface that can
+be handed to tarfile in stream mode ('r|').
+
+gzip deflate streams cannot be split this way, so gzip deliveries are
+handled by PipelinedGzipReader, which overlaps reading the compressed
+file (in a separate thread) with inflating it.
+
+Both readers record seek points, i.e., the positions in the compressed
+stream at which decoding can start (bzip2 blocks, gzip members) and the
+corresponding offsets in the decompressed stream, from which
+tarballIndex builds a random-access index of a delivery tarball.
+"""
+from __future__ import absolute_import, print_function
+import bz2
+import zlib
+import binascii
+import threading
+import multiprocessing
+from collections import deque
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+__all__ = ['ParallelDecompressError', 'compression_type', 'Bz2BlockSplitter',
+           'ParallelBz2Reader', 'PipelinedGzipReader', 'open_decompressed']
+
+_block_magic = 0x314159265359
+_eos_magic = 0x177245385090
+_mask48 = (1 << 48) - 1
+
+class ParallelDecompressError(RuntimeError):
+    """
+    The compressed stream could not be decoded block by block.  The
+    caller should fall back to serial decompression.
+    """
+    pass
+
+def compression_type(filename):
+    "Return 'bz2', 'gz' or None based on the leading magic bytes."
+    with open(filename, 'rb') as fd:
+        head = fd.read(3)
+    if head == b'BZh':
+        return 'bz2'
+    if head[:2] == b'\x1f\x8b':
+        return 'gz'
+    return None
+
+def _bytes_to_int(data):
+    return int(binascii.hexlify(data), 16)
+
+def _int_to_bytes(value, nbytes):
+    return binascii.unhexlify('%0*x' % (2*nbytes, value))
+
+def _magic_patterns():
+    """
+    For each marker and each of the 8 possible bit alignments, return
+    the fully determined bytes of the marker, their offset within the
+    7-byte window that starts at the byte containing the first marker
+    bit, and the alignment.
+    """
+    patterns = []
+    for kind, magic in (('block', _block_magic), ('eos', _eos_magic)):
+        for shift in range(8):
+            window = _int_to_bytes(magic << (8 - shift), 7)
+            if shift == 0:
+                patterns.append((kind, magic, shift, window[0:6], 0))
+            else:
+                patterns.append((kind, magic, shift, window[1:6], 1))
+    return patterns
+
+_patterns = _magic_patterns()
+
+class Bz2BlockSplitter(object):
+    """
+    Incrementally locate bzip2 block boundaries in a compressed byte
+    stream.  feed() returns the complete blocks found so far as
+    (data, start_bit, end_bit) tuples, where data holds the bytes
+    spanning the block and start_bit/end_bit delimit it within data.
+    The stream bit offsets delimiting all blocks found are appended to
+    block_bits.
+    """
+    def __init__(self):
+        self.block_bits = []
+        self.buf = b''
+        self.base = 0            # stream byte offset of buf[0]
+        self.scan_from = 0       # next window start (index into buf)
+        self.current = None      # stream bit offset of open block
+        self.nblocks = 0
+
+    def _markers(self, limit):
+        "Markers with window starts in [scan_from, limit)."
+        found = []
+        buf = self.buf
+        for kind, magic, shift, key, offset in _patterns:
+            pos = self.scan_from + offset
+            end = limit + offset + len(key) - 1
+            while True:
+                pos = buf.find(key, pos, end)
+                if pos == -1:
+                    break
+                start = pos - offset
+                window = buf[start:start + 7].ljust(7, b'\0')
+                if (_bytes_to_int(window) >> (8 - shift)) & _mask48 == magic:
+                    found.append((8*(self.base + start) + shift, kind))
+                pos += 1
+        return sorted(found)
+
+    def feed(self, data, eof=False):
+        "Append compressed bytes and return any newly completed blocks."
+        self.buf += data
+        limit = len(self.buf) if eof else max(len(self.buf) - 6,
+                                              self.scan_from)
+        blocks = []
+        for bit, kind in self._markers(limit):
+            if self.current is not None:
+                blocks.append(self._slice(self.current, bit))
+            if kind == 'block':
+                self.current = bit
+            else:
+                self.current = None
+        self.scan_from = limit
+        # Discard bytes no longer needed for the open block or scanning.
+        if self.current is None:
+            keep = self.base + self.scan_from
+        else:
+            keep = min(self.current//8, self.base + self.scan_from)
+        self.buf = self.buf[keep - self.base:]
+        self.scan_from -= keep - self.base
+        self.base = keep
+        if eof and self.current is not None:
+            raise ParallelDecompressError('Truncated bzip2 stream')
+        self.nblocks += len(blocks)
+        return blocks
+
+    def _slice(self, start, end):
+        self.block_bits.append((start, end))
+        first = start//8
+        last = (end + 7)//8
+        data = self.buf[first - self.base:last - self.base]
+        return data, start - 8*first, end - 8*first
+
+def decompress_block(job):
+    """
+    Decode one bzip2 block, given as (data, start_bit, end_bit), by
+    wrapping it in a stream header and an end-of-stream trailer.  The
+    stream CRC of a single-block stream equals the block CRC.
+    """
+    data, start, end = job
+    nbits = end - start
+    if nbits <= 80:
+        raise ParallelDecompressError('Spurious bzip2 block marker')
+    value = (_bytes_to_int(data) >> (8*len(data) - end)) & ((1 << nbits) - 1)
+    crc = (value >> (nbits - 80)) & 0xffffffff
+    pad = -(nbits + 80) % 8
+    value = (((value << 48 | _eos_magic) << 32) | crc) << pad
+    stream = b'BZh9' + _int_to_bytes(value, (nbits + 80 + pad)//8)
+    try:
+        return bz2.decompress(stream)
+    except (IOError, OSError, ValueError, EOFError) as eobj:
+        raise ParallelDecompressError('bzip2 block decode failed: %s' % eobj)
+
+class _DecodedReader(object):
+    "Base class providing read() over a sequence of decoded chunks."
+    def __init__(self):
+        self._out = b''
+        self._pos = 0
+        self.nbytes_out = 0
+
+    def _next_chunk(self):
+        "Return the next decoded chunk, or None at end of stream."
+        raise NotImplementedError
+
+    def read(self, size=-1):
+        pieces = []
+        wanted = size if size is not None and size >= 0 else None
+        while wanted is None or wanted > 0:
+            if self._pos >= len(self._out):
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                self._out, self._pos = chunk, 0
+                continue
+            stop = len(self._out) if wanted is None \
+                   else min(len(self._out), self._pos + wanted)
+            piece = self._out[self._pos:stop]
+            self._pos = stop
+            pieces.append(piece)
+            if wanted is not None:
+                wanted -= len(piece)
+        data = b''.join(pieces)
+        self.nbytes_out += len(data)
+        return data
+
+class ParallelBz2Reader(_DecodedReader):
+    """
+    File-like reader returning the decompressed content of a bzip2
+    stream, with the blocks decoded by a pool of worker processes.
+    At most max_pending blocks are in flight, so memory use is bounded
+    by roughly max_pending times the block size.
+    """
+    def __init__(self, fileobj, processes=None, chunk_size=1024*1024,
+                 max_pending=None):
+        super(ParallelBz2Reader, self).__init__()
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2*processes
+        self.splitter = Bz2BlockSplitter()
+        self.pool = multiprocessing.Pool(processes)
+        self.pending = deque()
+        self.ready = deque()
+        self.eof = False
+        self.block_sizes = []
+
+    def _fill(self):
+        while (len(self.pending) + len(self.ready) < self.max_pending
+               and not self.eof):
+            data = self.fileobj.read(self.chunk_size)
+            self.eof = not data
+            self.ready.extend(self.splitter.feed(data, eof=self.eof))
+        while self.ready and len(self.pending) < self.max_pending:
+            self.pending.append(self.pool.apply_async(decompress_block,
+                                                      (self.ready.popleft(),)))
+
+    def _next_chunk(self):
+        self._fill()
+        if not self.pending:
+            return None
+        chunk = self.pending.popleft().get()
+        self.block_sizes.append(len(chunk))
+        return chunk
+
+    def seek_points(self):
+        """
+        Return (start_bit, end_bit, offset, size) for the blocks decoded
+        so far: the bit range of the block in the compressed stream and
+        the offset and size of its content in the decompressed stream.
+        """
+        points = []
+        offset = 0
+        for (start, end), size in zip(self.splitter.block_bits,
+                                      self.block_sizes):
+            points.append((start, end, offset, size))
+            offset += size
+        return points
+
+    def close(self):
+        "Shut down the worker pool."
+        self.pool.terminate()
+        self.pool.join()
+
+class PipelinedGzipReader(_DecodedReader):
+    """
+    File-like reader returning the inflated content of a (possibly
+    multi-member) gzip stream.  A background thread reads compressed
+    chunks into a bounded queue while the caller's thread inflates
+    them, so that file I/O overlaps with decompression.
+    """
+    def __init__(self, fileobj, chunk_size=1024*1024, depth=8):
+        super(PipelinedGzipReader, self).__init__()
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=depth)
+        self.decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.stopped = threading.Event()
+        self.error = None
+        self.done = False
+        self.nbytes_in = 0
+        self.members = [(0, 0)]
+        self._inflated = 0
+        self.thread = threading.Thread(target=self._reader)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _reader(self):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.fileobj.read(self.chunk_size)
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if not chunk:
+                    return
+        except Exception as eobj:
+            self.error = eobj
+            self.queue.put(b'')
+
+    def _next_chunk(self):
+        while not self.done:
+            chunk = self.queue.get()
+            if self.error is not None:
+                raise self.error
+            if not chunk:
+                self.done = True
+                out = self.decomp.flush()
+                self._inflated += len(out)
+                return out or None
+            self.nbytes_in += len(chunk)
+            out = self.decomp.decompress(chunk)
+            while self.decomp.unused_data:
+                # Start of the next gzip member, if any.
+                rest = self.decomp.unused_data
+                if rest[:2] != b'\x1f\x8b':
+                    break
+                self.members.append((self.nbytes_in - len(rest),
+                                     self._inflated + len(out)))
+                self.decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                out += self.decomp.decompress(rest)
+            self._inflated += len(out)
+            if out:
+                return out
+        return None
+
+    def seek_points(self):
+        """
+        Return (start_byte, offset) for the gzip members read so far: the
+        byte offset of the member in the compressed stream and that of
+        its content in the decompressed stream.  Inflating cannot resume
+        within a gzip member, so these are the only seek points.
+        """
+        return list(self.members)
+
+    def close(self):
+        "Stop the reader thread, leaving unread input in fileobj."
+        self.stopped.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+def open_decompressed(fileobj, comptype, processes=None,
+                      chunk_size=1024*1024):
+    """
+    Return a parallel or pipelined decompressing reader over fileobj
+    for comptype 'bz2' or 'gz'.  The reader's close() method must be
+    called when done.
+    """
+    if comptype == 'bz2':
+        return ParallelBz2Reader(fileobj, processes=processes,
+                                 chunk_size=chunk_size)
+    if comptype == 'gz':
+        return PipelinedGzipReader(fileobj, chunk_size=chunk_size)
+    raise ValueError('Unsupported compression type: %s' % comptype)
@@ -56,22 +56,40 @@ where
 
 """
 import os,sys, shutil
-import hashlib
+import threading
 import subprocess, shlex
 import datetime
-import tarfile
+import multiprocessing
 import registry
+import tarballIngest
+import ingestManifest
+import ingestMetrics
+import vendorRegistration
+import streamingTranslation
+import tarballIndex
 
 
 debug = False
 dryrun = False
+numProcesses = multiprocessing.cpu_count()   ## for parallel decompression of tarballs
+numRegWorkers = 16     ## concurrent dataCatalog registrations (1 = serial)
+useRegJournal = True   ## journal registrations and send them in the background
+regDrainTimeout = 3600 ## max seconds to wait for journaled registrations at the end
+fileMode = 0o660       ## rw permissions for owner and group, none for world
+dirMode = 0o770        ## all permissions for owner and group, none for world
+lsstGid = int(os.environ.get('VENDORINGEST_GID',2218))   ## 2218 = 'lsst'
+streamTranslation = True   ## translate FITS files for the validator while extracting them
+indexTarballs = True       ## write member indexes for random access to the archived tarballs
+progressInterval = 60.     ## seconds between progress reports while extracting tarballs
 
 
 print '\n\nIngest LSST Vendor Data.'
 start = datetime.datetime.now()
+metrics = ingestMetrics.IngestMetrics()   ## per-phase timing, written to metricsFile
 print 'Configuration:\n============='
 print 'Now Running ',sys.argv[0]
 print 'Start time: ',start
+print 'Decompression processes: ',numProcesses
 print 'Current working directory (os.environ): ',os.environ['PWD']
 #rc = os.system('printenv|grep -i lcatr')
 if debug: rc = os.system('echo ALL ENVIRONMENT VARIABLES;printenv|sort;echo END ENVVAR LIST')
@@ -107,6 +125,7 @@ print 'Vendor: ',vendor
 print 'SensorID: ',LSSTID
 
 LCAROOT = '/nfs/farm/g/lsst/u1'    ## ROOT of all LSST Camera data at SLAC
+LCAROOT = os.environ.get('VENDORINGEST_LCAROOT',LCAROOT)   ## e.g., synthetic deliveries for benchmarks
 
 vendorFTPdir = os.path.join(LCAROOT,'vendorData/FTP',vendor,LSSTID) ## physical location of tarball
 vendorDir = os.path.join(LCAROOT,'vendorData',vendor,LSSTID,eTmode,jobid) ## physical location to store
@@ -117,10 +136,24 @@ print 'vendorDir (output)         = ',vendorDir
 print 'vendorLDir (registration)  = ',vendorLDir
 print '==================================================\n'
 
+metricsFile = os.path.join(pwd,'vendorIngest_metrics.json')
+metrics.info.update(jobid=jobid,LSSTID=LSSTID,vendor=vendor,eTmode=eTmode)
+
 ####################################################################################
 ## Setup RESTful dataCatalog client
 ####################################################################################
 myDC = registry.registry(debug=debug,dryrun=dryrun)
+myDC.metrics = metrics
+
+## For benchmarks and tests, register in an in-process stand-in for the
+## dataCatalog, with the given latency (s) per call
+if 'VENDORINGEST_LOCAL_DATACAT' in os.environ:
+   import localDatacat
+   localCatalog = localDatacat.LocalCatalog()
+   localLatency = float(os.environ['VENDORINGEST_LOCAL_DATACAT'] or 0)
+   myDC.clientFactory = lambda: localDatacat.LocalDatacat(localCatalog,latency=localLatency)
+   print 'Using local dataCatalog stand-in, latency = ',localLatency
+   pass
 
 myDC.init()
 
@@ -134,111 +167,94 @@ sys.stdout.flush()
 ####################################################################################
 ####################################################################################
 
-def sanitize(path):
-   """Remove offending characters from string"""
-   newPath = path.replace(' ','_').replace('(','').replace(')','')
-   if debug: print 'original  string[',len(path),']: ',path
-   if debug: print 'sanitized string[',len(newPath),']: ',newPath
-   return newPath
+def readMd5file(vendorFTPdir,md5file):
+   """Return the vendor-supplied md5 checksum"""
+   md5file = os.path.join(vendorFTPdir,md5file)
+   try:
+      return tarballIngest.read_md5file(md5file)
+   except ValueError:
+      print '\n%ERROR: Unable to parse supplied md5 file: ',md5file
+      sys.exit(1)
+      pass
+   return
 
 
 
-def regVendorFiles(targetDirRoot,targetLDirRoot,deliveryTime):
-   """Register vendor files at SLAC in dataCatalog"""
-   if debug: print '===\nEntering regVendorFiles(',targetDirRoot,',',targetLDirRoot,',',deliveryTime,')'
-   site = 'slac.lca.archive'
+def unpackTarfiles(vendorFTPdir,tarfiles):
 
-   myDC.dumpConfig()
+# md5 checksum comparison, pre- and post-ftp, computed in the same pass
+# over each tarball that uncompresses/untars it into the target directory.
+# Files and directories are created with their final permissions and group.
+# The tarballs of a delivery (data, metrology) are handled concurrently;
+# if one of them fails, the others are stopped and the ingest fails.
+# With a registration journal, the files of each tarball are journaled for
+# registration as soon as its checksum is verified, so that the journal
+# flusher registers them during the rest of the extraction, translation
+# and permission adjustments.
+   print '\nVerify md5 checksums and unpack tarballs: ',', '.join(datafile for datafile,md5old in tarfiles)
+   print datetime.datetime.now()
+   sys.stdout.flush()
 
-   dType = 'LSSTVENDORDATA'
-   filetypeMap = {'fits':'fits','fit':'fits','txt':'txt','jpg':'jpg','png':'png','pdf':'pdf','html':'html','htm':'html','xls':'xls'}
-   metaData = {"vendorDeliveryTime":deliveryTime}
+   jobs = []
+   for datafile,md5old in tarfiles:
+      index = None
+      if indexTarballs: index = tarballIndex.TarballIndex(os.path.join(vendorFTPdir,datafile),md5=md5old)
+      jobs.append((os.path.join(vendorFTPdir,datafile),md5old,{'index':index}))
+      pass
 
-   for root,dirs,files in os.walk(targetDirRoot):
-      print '-----------------'
-      sys.stdout.flush()
-      if debug:
-         print 'root = ',root
-         print '# dirs = ',len(dirs)
-         print '# files = ',len(files)
+   regLock = threading.Lock()
+   def registerTarball(datafile,members):
+      with regLock:
+         vendorRegistration.regVendorFiles(myDC,manifest,vendorDir,vendorLDir,deliveryTime,
+                                           numWorkers=numRegWorkers,metrics=metrics,
+                                           tarball=os.path.basename(datafile),debug=debug)
          pass
+      sys.stdout.flush()
+      return
+   done = None
+   if myDC.journal != None: done = registerTarball
 
-      commonPath = os.path.relpath(root,targetDirRoot)
-      if commonPath == '.': commonPath=''
-      if debug:print 'commonPath = ',commonPath
-
-      for file in files:                   ## Loop over all vendor files and register in dataCat
-         if debug: print 'Adding dataCatalog registration for file: ',file
-
-         filePath = os.path.join(root,file)
-         dcFolder = os.path.join(targetLDirRoot,sanitize(commonPath))
-         
-         # Extract file extension and assign dataCatalog "file type"
-         ext = os.path.splitext(file)[1].strip('.')
-         if ext in filetypeMap:
-            fType = filetypeMap[ext]
-         else:
-            fType = 'dat'
-            pass
- 
-         if debug:
-            print '\n Add registry data:'
-            print 'filePath = ',filePath
-            print 'dcFolder = ',dcFolder
-            print 'site     = ',site
-            print 'fType    = ',fType
-            print 'dType    = ',dType
+   try:
+      with metrics.phase('extraction') as phase:
+         results = tarballIngest.extract_tarballs(jobs,vendorDir,interval=progressInterval,counts=permCounts,
+                                                  processes=numProcesses,manifest=manifest,file_mode=fileMode,
+                                                  dir_mode=dirMode,gid=lsstGid,consumer=translation,done=done)
+         for (datafile,md5old,options),members in zip(jobs,results):
+            phase.add(nbytes=os.path.getsize(datafile),nfiles=len(members),
+                      bytes_extracted=sum(member.size for member in members if member.isfile()))
             pass
-
-         myDC.register(filePath, dcFolder, site, fType, dType, metaData=metaData)
-         sys.stdout.flush()
          pass
-      pass
-   myDC.dumpStats()
-   return
-
-
-def unpackTarfile(vendorFTPdir,datafile,md5file):
-
-# md5 checksum comparison, pre- and post-ftp
-   print '\nVerify md5 checksums: ',md5file
-   print datetime.datetime.now()
-
-   md5file = os.path.join(vendorFTPdir,md5file)
-   datafile = os.path.join(vendorFTPdir,datafile)
-
-   md5old = open(md5file).read().split()
-   if len(md5old) == 1 or len(md5old) == 2:      ## Current e2v and ITL practice
-      md5old = md5old[0].upper()
-   elif len(md5old) >= 3:
-      md5old = open(md5file).read().split()[2].upper()
-   else:
-      print '\n%ERROR: Unable to parse supplied md5 file: ',md5file
+   except tarballIngest.ChecksumError as e:
+      print '\n%ERROR: Checksum error in vendor tarball (extracted files removed):\n',e
       sys.exit(1)
-
-   md5new = hashlib.md5(open(datafile).read()).hexdigest().upper()
-   print 'Old e2v checksum = ',md5old
-   print 'New md5 checksum = ',md5new
-   if md5old != md5new:
-      print '\n%ERROR: Checksum error in vendor tarball:\n old md5 = ',md5old,'\n new md5 = ',md5new
+   except Exception as e:
+      print '\n%ERROR: Failed to extract from vendor tarballs: ',e
       sys.exit(1)
       pass
    print 'Checksums match.'
 
-# Uncompress/untar into target directory
-   print 'Uncompress and unpack tarball: ',datafile
-   print datetime.datetime.now()
-   sys.stdout.flush()
-
-   try:
-      tarfile.open(datafile,'r').extractall(vendorDir)
-   except:
-      print '\n%ERROR: Failed to extractall from vendor tarball', filename
-      sys.exit(1)
+# Member indexes of the archived tarballs, built during the extraction, or
+# in a separate pass if a tarball had already been extracted
+   for datafile,md5old,options in jobs:
+      index = options['index']
+      indexFile = vendorDir+'.'+os.path.basename(datafile)+'.index'
+      if index == None or (len(index.members) == 0 and os.path.isfile(indexFile)): continue
+      try:
+         with metrics.phase('indexing') as phase:
+            if len(index.members) == 0:
+               index = tarballIndex.build_index(datafile,md5=md5old,processes=numProcesses)
+               pass
+            index.write(indexFile)
+            phase.add(nfiles=len(index.members))
+            pass
+         print 'Tarball member index: ',indexFile
+      except Exception as e:
+         print 'WARNING: Unable to write tarball member index ',indexFile,': ',e
+         pass
       pass
    return
 
-######################## end of unpackTarfile() #############################
+######################## end of unpackTarfiles() ############################
 
 
 
@@ -258,7 +274,10 @@ if vendor == 'e2v' or vendor == 'E2V' or vendor == 'ITL':
 
    print 'Check for vendor data in FTP directory.'
    try:
-      flist = os.listdir(vendorFTPdir)
+      with metrics.phase('ftp_listing') as phase:
+         flist = os.listdir(vendorFTPdir)
+         phase.add(nfiles=len(flist))
+         pass
    except:
       print '\n%ERROR: Failure to find vendor ftp directory ',vendorFTPdir
       sys.exit(1)
@@ -320,21 +339,86 @@ if vendor == 'e2v' or vendor == 'E2V' or vendor == 'ITL':
       print ' metrology data file checksum = ',metrologyMd5file
       pass
 
+   with metrics.phase('checksum') as phase:
+      tarballs = {datafile:readMd5file(vendorFTPdir,md5file)}
+      if metrology: tarballs[metrologyDatafile] = readMd5file(vendorFTPdir,metrologyMd5file)
+      phase.add(nfiles=len(tarballs))
+      pass
+
+
+# Resume an interrupted ingest of the same delivery, if there is one,
+# otherwise start a new ingest manifest next to the target directory.
+# Manifests locked by the FTP watcher (or another job) are waited for.
+   for lockedManifest in ingestManifest.locked_manifests(os.path.dirname(vendorDir)):
+      print 'Waiting for the ingest manifest in use by another process: ',lockedManifest
+      pass
+   sys.stdout.flush()
+   manifest = ingestManifest.find_resumable(os.path.dirname(vendorDir),tarballs)
+   if manifest != None:
+      vendorDir = manifest.info['vendorDir']
+      vendorLDir = manifest.info['vendorLDir']
+      if manifest.info.get('staged'):
+         print 'Delivery pre-staged by the FTP watcher (ftpWatcher.py), using manifest ',manifest.filename
+      else:
+         print 'Resuming interrupted ingest (job ',manifest.info['jobid'],') using manifest ',manifest.filename
+         pass
+      print 'vendorDir (output)         = ',vendorDir
+      print 'vendorLDir (registration)  = ',vendorLDir
+   else:
+      if not os.access(os.path.dirname(vendorDir),os.F_OK): os.makedirs(os.path.dirname(vendorDir))
+      manifest = ingestManifest.IngestManifest(vendorDir+'.manifest')
+      manifest.set_info(vendorDir=vendorDir,vendorLDir=vendorLDir,jobid=jobid,tarballs=tarballs)
+      pass
+   print 'Ingest manifest: ',manifest.filename
+
+
+# Send journaled registrations in the background, starting with any left
+# pending by an interrupted ingest of this delivery
+   if useRegJournal:
+      journalFile = manifest.info.get('journal')
+      if journalFile == None or not os.path.isfile(journalFile):
+         journalFile = os.path.join(pwd,'registration.journal')
+         manifest.set_info(journal=journalFile)
+         pass
+      myDC.enableJournal(journalFile,numWorkers=numRegWorkers)
+      pass
+
    
 # Create target directory for Vendor Data
    print 'Create target directory for vendor data.'
    if not os.access(vendorDir,os.F_OK): os.makedirs(vendorDir)
 
 
-# Check MD5 checksums, then unpack tar file
-   unpackTarfile(vendorFTPdir,datafile,md5file)
+# Translate the vendor FITS files (into the job directory, for the
+# validator) as they are extracted, rather than reading them back later
+   translation = None
+   translationFile = os.path.join(pwd,'vendorIngest_translation.json')
+   if streamTranslation:
+      try:
+         if vendor == 'ITL':
+            from ItlFitsTranslator import ItlFitsTranslator as FitsTranslator
+         else:
+            from e2vFitsTranslator import e2vFitsTranslator as FitsTranslator
+            pass
+         translation = streamingTranslation.StreamingTranslation(FitsTranslator(LSSTID,vendorDir,'.'),verbose=debug)
+      except ImportError as e:
+         print 'WARNING: FITS translators unavailable, translation left to the validator: ',e
+         pass
+      pass
+
+
+# Delivery time (the name of the delivery directory), for the registrations
+   deliveryTime = os.path.basename(os.readlink(vendorFTPdir))
+
 
-   if metrology: unpackTarfile(vendorFTPdir,metrologyDatafile,metrologyMd5file)
+# Check MD5 checksums, then unpack tar files
+   permCounts = {}
+   tarfiles = [(datafile,tarballs[datafile])]
+   if metrology: tarfiles.append((metrologyDatafile,tarballs[metrologyDatafile]))
+   unpackTarfiles(vendorFTPdir,tarfiles)
 
 
 # Create a sym-link containing the delivery time (for posterity)
-   deliveryTime = os.readlink(vendorFTPdir)
-   deliveryTime = os.path.basename(deliveryTime)
    print 'Create sym link for deliveryTime (from vendorFTPdir) = ',deliveryTime
    os.symlink(deliveryTime,'deliveryTime')
    
@@ -353,27 +437,88 @@ if vendor == 'e2v' or vendor == 'E2V' or vendor == 'ITL':
       pass
 
 
-# Change file permissions and group owner
-   print 'Adjust file permissions'
-   for dirpath, dirnames, filenames in os.walk(topOfDelivery):
-      for dirname in dirnames:
-         path = os.path.join(dirpath, dirname)
-         os.chmod(path, 0o770)     ## all permissions for owner and group, none for world
-         os.lchown(path,-1,2218)
+# Finish the translation of the FITS files streamed from the tarballs.
+# Should it fail, or not have seen the files (already extracted by an
+# interrupted ingest), the validator translates the unpacked files.
+   if translation != None:
+      print '\nFinish translation of vendor FITS files'
+      with metrics.phase('translation') as phase:
+         try:
+            outfiles = translation.close()
+            if translation.num_members > 0:
+               translation.write(translationFile)
+               print 'Translated ',len(outfiles),' files, listed in ',translationFile
+               pass
+            phase.add(nfiles=len(outfiles),members=translation.num_members)
+         except Exception as e:
+            print 'WARNING: Streaming translation failed, translation left to the validator: ',e
+            for outfile in translation.translator.outfiles:
+               if os.path.isfile(outfile): os.remove(outfile)
+               pass
+            pass
          pass
-      for filename in filenames:
-         path = os.path.join(dirpath, filename)
-         os.chmod(path, 0o660)     ## rw permissions for owner and group, none for world
-         os.lchown(path,-1,2218)    ## 2218 = 'lsst'
+      pass
+
+
+# File permissions and group owner were set during extraction.  Only
+# members extracted without them (by an earlier version of this job)
+# still need to be adjusted.
+   print 'File permissions and group set during extraction:'
+   print ' members = ',permCounts.get('members',0),', chmod/chown calls = ',permCounts.get('metadata_ops',0),', calls saved = ',permCounts.get('metadata_ops_saved',0)
+   with metrics.phase('permissions') as phase:
+      phase.add(**permCounts)
+      numAdjusted = 0
+      for member in manifest.pending('permissions'):
+         path = os.path.join(topOfDelivery, member)
+         if manifest.members[member]['type'] == 'dir':
+            os.chmod(path, dirMode)
+         elif manifest.members[member]['type'] != 'symlink':
+            os.chmod(path, fileMode)
+            pass
+         os.lchown(path,-1,lsstGid)
+         manifest.mark(member,'permissions')
+         numAdjusted += 1
          pass
+      phase.add(nfiles=numAdjusted,metadata_ops=2*numAdjusted)
       pass
+   if numAdjusted > 0: print 'Adjusted file permissions of ',numAdjusted,' further members'
+   manifest.sync()
 
 
-# Register files in dataCatalog
+# Register files in dataCatalog (with a journal, only those not yet
+# journaled as their tarball was verified, e.g., extracted by an earlier job)
    print '\n===\nRegister vendor data in dataCatalog'
    print datetime.datetime.now()
-   regVendorFiles(vendorDir,vendorLDir,deliveryTime)
+   vendorRegistration.regVendorFiles(myDC,manifest,vendorDir,vendorLDir,deliveryTime,
+                                     numWorkers=numRegWorkers,metrics=metrics,debug=debug)
+
+   complete = True
+   if myDC.journal != None:
+      print '\n===\nWait for journaled dataCatalog registrations'
+      print datetime.datetime.now()
+      sys.stdout.flush()
+      with metrics.phase('registration_drain') as phase:
+         complete = myDC.drain(timeout=regDrainTimeout)
+         phase.add(**myDC.journal.counts())
+         pass
+      myDC.dumpStats()
+      myDC.closeJournal()
+      pass
 
+   if complete: manifest.set_info(complete=True)
+   manifest.close()
+
+# Record phase timings and dataCatalog call latencies with the job outputs
+   metrics.summary()
+   metrics.write(metricsFile)
+   print 'Ingest metrics written to ',metricsFile
+
+   if not complete:
+      ## The ingest is left incomplete, so that a later job for this
+      ## delivery resumes it and retries the journaled registrations
+      print '\n%ERROR: Not all dataCatalog registrations completed, see journal ',journalFile
+      sys.exit(1)
+      pass
    pass
 
 
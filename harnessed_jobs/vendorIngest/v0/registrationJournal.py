@@ -0,0 +1,140 @@
+"""
+Durable journal of pending dataCatalog registrations.
+
+Registration requests are appended to a sqlite database (normally in
+the job directory) before they are sent to the dataCatalog, and are
+only marked as done once the dataCatalog has accepted them.  The
+journal thereby survives a crash of the job that wrote it: reopening
+the file gives back every registration that was not completed, so that
+a later job can finish draining it, including those the earlier job gave
+up after too many attempts (see requeue_failed).
+
+Each entry holds the arguments of registry.register(), its state
+('pending', 'done' or 'failed'), the number of attempts made, the
+time before which it should not be retried and the outcome of the last
+attempt.
+"""
+from __future__ import absolute_import, print_function
+import json
+import time
+import sqlite3
+import threading
+
+__all__ = ['RegistrationJournal']
+
+class RegistrationJournal(object):
+    """
+    sqlite-backed journal of registry.register() requests, safe to use
+    from several threads.
+    """
+    fields = ('fn', 'dcFolder', 'site', 'fType', 'dType', 'metaData')
+
+    def __init__(self, filename, max_attempts=10):
+        self.filename = filename
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""create table if not exists registrations
+                                  (id integer primary key, fn text,
+                                   dcFolder text, site text, fType text,
+                                   dType text, metaData text,
+                                   state text default 'pending',
+                                   attempts integer default 0,
+                                   next_try real default 0,
+                                   outcome text)""")
+
+    def append(self, records):
+        """
+        Journal registration requests, given as (fn, dcFolder, site,
+        fType, dType[, metaData]) tuples, in a single transaction.
+        """
+        rows = []
+        for record in records:
+            record = list(record) + [{}]*(len(self.fields) - len(record))
+            rows.append(record[:5] + [json.dumps(record[5])])
+        with self._lock, self._conn:
+            self._conn.executemany("""insert into registrations
+                                      (fn, dcFolder, site, fType, dType,
+                                       metaData) values (?, ?, ?, ?, ?, ?)""",
+                                   rows)
+        return len(rows)
+
+    def pending(self, limit=None, now=None):
+        """
+        Return up to limit (id, attempts, record) tuples of the pending
+        requests that are due for a (re)try, oldest first.
+        """
+        if now is None:
+            now = time.time()
+        query = """select id, attempts, fn, dcFolder, site, fType, dType,
+                   metaData from registrations where state = 'pending'
+                   and next_try <= ? order by id"""
+        args = [now]
+        if limit is not None:
+            query += ' limit ?'
+            args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [(row[0], row[1], tuple(row[2:7]) + (json.loads(row[7]),))
+                for row in rows]
+
+    def complete(self, results):
+        "Mark requests as done, given (id, outcome) pairs."
+        with self._lock, self._conn:
+            self._conn.executemany("""update registrations set state = 'done',
+                                      attempts = attempts + 1, outcome = ?
+                                      where id = ?""",
+                                   [(outcome, id_) for id_, outcome in results])
+
+    def retry(self, id_, delay, outcome='error'):
+        """
+        Record a failed attempt.  The request is retried no earlier than
+        delay seconds from now, or marked as failed once max_attempts
+        attempts have been made.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("""update registrations set
+                                  attempts = attempts + 1, next_try = ?,
+                                  outcome = ?,
+                                  state = case when attempts + 1 >= ?
+                                          then 'failed' else state end
+                                  where id = ?""",
+                               (time.time() + delay, outcome,
+                                self.max_attempts, id_))
+
+    def requeue_failed(self):
+        """
+        Return the requests given up by an earlier job to the pending
+        state, with their attempts reset, and return their number.
+        """
+        with self._lock, self._conn:
+            return self._conn.execute("""update registrations set
+                                         state = 'pending', attempts = 0,
+                                         next_try = 0
+                                         where state = 'failed'""").rowcount
+
+    def counts(self):
+        "Return a dict of the number of requests in each state."
+        counts = dict(pending=0, done=0, failed=0)
+        with self._lock:
+            for state, count in self._conn.execute(
+                    """select state, count(*) from registrations
+                       group by state"""):
+                counts[state] = count
+        return counts
+
+    def next_try(self):
+        """
+        Return the earliest time at which a pending request is due, or
+        None if there are no pending requests.
+        """
+        with self._lock:
+            return self._conn.execute("""select min(next_try) from
+                                         registrations where
+                                         state = 'pending'""").fetchone()[0]
+
+    def close(self):
+        "Close the journal database."
+        with self._lock:
+            self._conn.close()
@@ -9,6 +9,8 @@ It offers these advantages over the raw interface:
 2. Sensibly handles exceptions
 3. Provides a simple way to register/add location/recrawl datasets
 4. Can print out a summary of interesting metadata for a specified dataset
+5. Optionally journals registrations to disk and sends them to the dataCatalog
+   from a background thread (see enableJournal)
 
 """
 #-------------------------------------------------------------------------
@@ -16,6 +18,23 @@ It offers these advantages over the raw interface:
 import os,sys
 import subprocess,shlex
 import datetime
+import time
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import registrationJournal
+
+## Outcomes of a registration request (see register_many)
+REGISTERED = 'registered'                   ## fresh registration
+ALREADY_REGISTERED = 'already registered'   ## nothing to do
+LOCATION_ADDED = 'location added'           ## new location (site) for existing dataset
+RECRAWL_REQUESTED = 'recrawl requested'     ## existing dataset flagged for recrawl
+ERROR = 'error'                             ## dataCatalog exception(s) encountered
+
+
+def fingerprint(size,digest):
+    """Content fingerprint of a file, from its size and a hash of its content"""
+    return '%d:%s' % (size,digest.lower())
 
 ##################################################################
 #######
@@ -30,33 +49,84 @@ class registry(object):
         self.quiet = False     ## True disables routine output
         self.dryrun = dryrun
 
-        ## RESTful interface to dataCatalog
+        ## RESTful interface to dataCatalog (one client session per thread)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._folderLocks = {}
         self.dcVersion = None
         self.client = None
+        self.clientFactory = None   ## [optional] callable returning a new client
 
         ## Controls
         self.addLoc = True       ## Add new location (site), if necessary
         self.reCrawl = True      ## Flag a reCrawl, if appropriate
         self.abortOnException = False   # dataCatalog Restful interface errors
+        self.useCache = True     ## Cache known folders and datasets (see folderExists/datasetExists)
+        self.listingPageSize = 1000   ## Max number of children per folder listing call
+        self.batchSize = 100     ## Max number of datasets per register_many() work unit
+        self.fingerprintKey = 'contentFingerprint'   ## versionMetadata key holding fingerprint()
+
+        ## Cache of dataCatalog folders and datasets known to exist
+        self.knownFolders = set()     ## folder paths
+        self.listedFolders = set()    ## folders whose datasets are all in knownDatasets
+        self.unlistedFolders = set()  ## folders for which the listing failed
+        self.knownDatasets = {}       ## dataset path -> dataset object (None if not fetched)
+
+        ## Journaled registration (see enableJournal)
+        self.journal = None
+        self.journalWorkers = 1    ## threads used by the journal flusher
+        self.retryDelay = 5.       ## seconds before the first retry of a failed registration
+        self.maxRetryDelay = 300.  ## max seconds between retries
+        self._flusher = None
+        self._wakeup = threading.Event()
+        self._stopFlusher = False
 
         ## DataCatalog metadata
         self.filetypeMap = {'fits':'fits','fit':'fits','root':'root','txt':'txt','jpg':'jpg','png':'png','pdf':'pdf','html':'html','htm':'html','xls':'xls','lims':'lims'}
         self.dryRunList = ['create_dataset','patch_dataset','mkdir','mkloc']
 
+        ## Instrumentation: latencies of client calls are recorded (under
+        ## the opNames operation names) if metrics is set, see ingestMetrics
+        self.metrics = None
+        self.opNames = {'create_dataset':'create','patch_dataset':'patch'}
+
         ## Statistics
         self.numNewFolders = 0
         self.numRegistered = 0
         self.numAlreadyRegistered = 0
         self.numAddLocs = 0
         self.numReCrawl = 0
+        self.numSkippedReCrawl = 0
         self.numExceptions = 0
+        self.numFolderListings = 0
+        self.numCacheHits = 0
+        self.numCacheMisses = 0
+        return
+
+
+    @property
+    def client(self):
+        """RESTful client of the calling thread"""
+        return getattr(self._local,'client',None)
+
+    @client.setter
+    def client(self,value):
+        self._local.client = value
         return
 
 
     def init(self):
-        """initialize the RESTful interface to the dataCatalog"""
+        """
+        initialize the RESTful interface to the dataCatalog for the calling thread.
+        Each (worker) thread gets its own client, so that HTTP connections
+        are reused within a thread rather than reopened.
+        """
         if self.client != None: return
-        print 'Initializing RESTful dataCatalog interface'
+        if not self.quiet: print 'Initializing RESTful dataCatalog interface'
+
+        if self.clientFactory != None:
+            self.client = self.clientFactory()
+            return
 
         import datacat
         config_path = os.getenv('DATACAT_CONFIG')
@@ -82,6 +152,8 @@ class registry(object):
         print 'Add new location, if needed    ',self.addLoc
         print 'Flag a recrawl, if needed      ',self.reCrawl
         print 'Abort on exception             ',self.abortOnException
+        print 'Cache folders and datasets     ',self.useCache
+        print 'Registration journal           ',None if self.journal == None else self.journal.filename
         print 'Debug flag                     ',self.debug
         print 'Dryrun flag                    ',self.dryrun
         print
@@ -96,33 +168,69 @@ class registry(object):
         print 'Number of datasets not registered = ',self.numAlreadyRegistered
         print 'Number of added locations         = ',self.numAddLocs
         print 'Number of re-crawl requests       = ',self.numReCrawl
+        print 'Number of skipped re-crawls       = ',self.numSkippedReCrawl
         print 'Number of exceptions encountered  = ',self.numExceptions
+        print 'Number of folder listings         = ',self.numFolderListings
+        print 'Number of cache hits              = ',self.numCacheHits
+        print 'Number of cache misses            = ',self.numCacheMisses
+        if self.journal != None:
+            counts = self.journal.counts()
+            print 'Journal file                      = ',self.journal.filename
+            print 'Number of journaled, pending      = ',counts['pending']
+            print 'Number of journaled, done         = ',counts['done']
+            print 'Number of journaled, failed       = ',counts['failed']
+            pass
         print
         return
 
         
 
+    def _count(self,stat,n=1):
+        """Thread-safe increment of a statistics counter"""
+        with self._lock:
+            setattr(self,stat,getattr(self,stat)+n)
+            pass
+        if stat == 'numExceptions':
+            self._local.numExceptions = self._threadExceptions() + n
+        return
+
+
+    def _threadExceptions(self):
+        """Number of exceptions encountered by the calling thread"""
+        return getattr(self._local,'numExceptions',0)
+
+
+    def _folderLock(self,dcFolder):
+        """Lock serializing the creation and listing of a folder across threads"""
+        with self._lock:
+            return self._folderLocks.setdefault(dcFolder,threading.Lock())
+
+
     def doDC(self, method, *args, **kwargs):
         """
       Execute a single RESTful dataCatalog interface method, ** with exception handling **
       RESTful client methods available to doDC():
          exists()         check if dataset or folder exists
+         children()       list the contents of a folder
          mkdir()          create dataCatalog folder(s)
          create_dataset() register dataset in dataCatalog
          path()           fetch metadata for dataset or folder
          mkloc()          add a new location (site) for dataset
          patch_dataset()  update metadata for dataset
+      If a metrics object is set, the latency of every call is recorded
+      with metrics.record(operation,seconds), see opNames.
       """
         cname = method.im_class.__name__
         fname = method.im_func.__name__
         mname = cname+'.'+fname
         if self.debug: print 'Entering doDC',mname,',',args,',',kwargs
         if not fname in self.dryRunList or not self.dryrun:
+            tstart = time.time()
             try:
                 return method(*args, **kwargs)
             except Exception as e:
                 ekeys = e.__dict__.keys()
-                self.numExceptions += 1
+                self._count('numExceptions')
                 print '\n%Exception in ',mname
                 for key in ekeys:
                     if key == 'raw': continue
@@ -131,12 +239,108 @@ class registry(object):
                 if self.abortOnException: raise Exception(e)
                 rc = 1
                 pass
+            finally:
+                if self.metrics != None: self.metrics.record(self.opNames.get(fname,fname),time.time()-tstart)
+                pass
         else:
             print '\n***Dry run'
             return
         pass
 
 
+    def _addFolder(self,dcFolder):
+        """Add a folder and its parent folders to the cache"""
+        with self._lock:
+            while dcFolder not in ('','/'):
+                self.knownFolders.add(dcFolder)
+                dcFolder = os.path.dirname(dcFolder)
+                pass
+            pass
+        return
+
+
+    def folderExists(self,dcFolder):
+        """Check if a dataCatalog folder exists, using the cache if possible"""
+        if self.useCache and dcFolder in self.knownFolders:
+            self._count('numCacheHits')
+            return True
+        self._count('numCacheMisses')
+        exists = self.doDC(self.client.exists, dcFolder)
+        if exists: self._addFolder(dcFolder)
+        return exists
+
+
+    def listFolder(self,dcFolder):
+        """
+        Prime the cache with the contents of an existing dataCatalog folder
+        using one children() listing call (per page of listingPageSize).
+        Returns True if the listing succeeded.
+        """
+        datasets = {}
+        folders = []
+        offset = 0
+        while True:
+            self._count('numFolderListings')
+            children = self.doDC(self.client.children, dcFolder, site='all', offset=offset, max_num=self.listingPageSize)
+            if children == None:
+                self.unlistedFolders.add(dcFolder)
+                return False
+            for child in children:
+                path = os.path.join(dcFolder,child.name)
+                if 'dataset' in type(child).__name__.lower():
+                    datasets[path] = child
+                else:
+                    folders.append(path)
+                    pass
+                pass
+            if len(children) < self.listingPageSize: break
+            offset += len(children)
+            pass
+        with self._lock:
+            self.knownDatasets.update(datasets)
+            for folder in folders: self._addFolder(folder)
+            self.listedFolders.add(dcFolder)
+            pass
+        if self.debug: print 'Cached listing of ',dcFolder,': ',len(datasets),' datasets, ',len(folders),' folders'
+        return True
+
+
+    def datasetExists(self,dcLoc):
+        """
+        Check if a dataset exists.  The first lookup in a folder lists the
+        folder, subsequent lookups in that folder are answered by the cache.
+        """
+        dcFolder = os.path.dirname(dcLoc)
+        if self.useCache:
+            with self._folderLock(dcFolder):
+                listed = dcFolder in self.listedFolders or \
+                         (dcFolder not in self.unlistedFolders and self.listFolder(dcFolder))
+                pass
+            if listed:
+                self._count('numCacheHits')
+                return dcLoc in self.knownDatasets
+            pass
+        self._count('numCacheMisses')
+        return self.doDC(self.client.exists, dcLoc)
+
+
+    def datasetInfo(self,dcLoc,versionMetadata=False):
+        """
+        Fetch dataset metadata for all sites, using the cache if possible.
+        With versionMetadata=True, a cached dataset is only used if it
+        includes the version metadata.
+        """
+        ds = self.knownDatasets.get(dcLoc)
+        if versionMetadata and ds != None and 'versionMetadata' not in ds.__dict__: ds = None
+        if self.useCache and ds != None and ('site' in ds.__dict__ or 'locations' in ds.__dict__):
+            self._count('numCacheHits')
+            return ds
+        self._count('numCacheMisses')
+        ds = self.doDC(self.client.path, dcLoc, site='all')
+        if ds != None: self.knownDatasets[dcLoc] = ds
+        return ds
+
+
     def register(self,fn,dcFolder,site,fType,dType,metaData={}):
         """
         Register a single file in the dataCatalog
@@ -147,28 +351,144 @@ class registry(object):
          dType = data type (ennumerated set defined in dataCatalog)
          metaData = [optional] dict of metadata to be stored with dataset
         
+         If metaData contains a content fingerprint (see fingerprint() and
+         fingerprintKey), a reCrawl is only requested if the fingerprint
+         stored with the existing dataset differs.
+
          A request to register a file in the dataCatalog may have one of these effects:
            1) fresh registration with one site + crawl
            2) add new location + crawl
            3) recrawl  (for existing registration being updated because file has changed)
         NOTE: 'crawl' currently only works at SLAC
+
+        Returns True if no dataCatalog exceptions were encountered.
+
+        register() may be called concurrently from several threads.
         """
         
         if not self.quiet: print '\n** registry.register: ',fn
 
-        addLoc = False
-        reCrawl = False
-        crawlSite = False
-        if site.startswith('slac') or site.startswith('SLAC'):crawlSite = True
+        ## Verify RESTful interface is ready to go
+        if self.client == None:
+            self.init()
+            pass
 
+        if dcFolder.endswith('/'): dcFolder = dcFolder.rstrip('/')
+        newFolder = self._makeFolder(dcFolder)
+        return self._registerDataset(fn,dcFolder,site,fType,dType,metaData,newFolder) != ERROR
+
+
+    def register_many(self,records,numWorkers=1):
+        """
+        Register many files in the dataCatalog
+         records = iterable of (fn, dcFolder, site, fType, dType[, metaData])
+                   tuples or of dicts with these keys (see register())
+         numWorkers = number of threads issuing dataCatalog requests
+
+        The records are grouped by dataCatalog folder.  All missing folders
+        are created in a first pass, then the datasets of each folder are
+        registered in work units of at most batchSize datasets, so that the
+        first lookup in a folder lists it once for the whole batch.
+
+        Returns the per-file outcome table: a list of (fn, outcome) in the
+        order of records, where outcome is one of REGISTERED,
+        ALREADY_REGISTERED, LOCATION_ADDED, RECRAWL_REQUESTED or ERROR.
+        """
+        fields = ('fn','dcFolder','site','fType','dType','metaData')
+        requests = []
+        for record in records:
+            if isinstance(record,dict):
+                record = [record.get(field,{}) for field in fields]
+            else:
+                record = list(record) + [{}]*(len(fields)-len(record))
+                pass
+            record[1] = record[1].rstrip('/')
+            requests.append(record)
+            pass
+
+        byFolder = OrderedDict()
+        for index,record in enumerate(requests):
+            byFolder.setdefault(record[1],[]).append(index)
+            pass
+        if not self.quiet: print '\n** registry.register_many: ',len(requests),' files in ',len(byFolder),' folders'
 
-        ## Verify RESTful interface is ready to go
         if self.client == None:
             self.init()
             pass
 
+        ## Pass 1: create all missing folders
+        newFolders = set()
+        for dcFolder in byFolder:
+            if self._makeFolder(dcFolder): newFolders.add(dcFolder)
+            pass
+
+        ## Pass 2: register the datasets, folder by folder, in batches
+        batches = []
+        for dcFolder,indices in byFolder.items():
+            for first in range(0,len(indices),self.batchSize):
+                batches.append(indices[first:first+self.batchSize])
+                pass
+            pass
+
+        def registerBatch(batch):
+            if self.client == None: self.init()
+            results = []
+            for index in batch:
+                fn,dcFolder,site,fType,dType,metaData = requests[index]
+                if not self.quiet: print '\n** registry.register: ',fn
+                results.append((index,self._registerDataset(fn,dcFolder,site,fType,dType,metaData,dcFolder in newFolders)))
+                pass
+            return results
+
+        outcomes = [None]*len(requests)
+        if numWorkers > 1 and len(batches) > 1:
+            pool = ThreadPool(min(numWorkers,len(batches)))
+            try:
+                for results in pool.imap_unordered(registerBatch,batches):
+                    for index,outcome in results: outcomes[index] = outcome
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+                pass
+        else:
+            for batch in batches:
+                for index,outcome in registerBatch(batch): outcomes[index] = outcome
+                pass
+            pass
+        return [(requests[index][0],outcomes[index]) for index in range(len(requests))]
+
+
+    def _makeFolder(self,dcFolder):
+        """Create dataCatalog folder, if necessary.  Returns True if it was (to be) created."""
+        with self._folderLock(dcFolder):
+            if self.folderExists(dcFolder): return False
+            if self.debug or not self.quiet: print 'Create folder ',dcFolder
+            nexc = self._threadExceptions()
+            self.doDC(self.client.mkdir, dcFolder, parents=True)
+            if self._threadExceptions() == nexc and not self.dryrun:
+                ## A new folder is known to be empty
+                self._addFolder(dcFolder)
+                self.listedFolders.add(dcFolder)
+                pass
+            self._count('numNewFolders')
+            pass
+        return True
+
+
+    def _registerDataset(self,fn,dcFolder,site,fType,dType,metaData,newFolder=False):
+        """
+        Register a single file in an existing (or newly created) dataCatalog
+        folder, and return the outcome of the request (see register_many)
+        """
+        numExceptions = self._threadExceptions()
+
+        addLoc = False
+        reCrawl = False
+        crawlSite = False
+        if site.startswith('slac') or site.startswith('SLAC'):crawlSite = True
+
         ## Use filename as dataset name
-        if dcFolder.endswith('/'): dcFolder = dcFolder.rstrip('/')
         datasetName = os.path.basename(fn)
         dcLoc = os.path.join(dcFolder,datasetName)
         if self.debug:
@@ -177,27 +497,23 @@ class registry(object):
             print 'dcLoc = ',dcLoc
             pass
         
-
-
-        ## Create target dataCatalog folder, if necessary, then perform fresh registration
-        if not self.doDC(self.client.exists, dcFolder):
-            if self.debug or not self.quiet: print 'Create folder and register.'
-            self.doDC(self.client.mkdir, dcFolder, parents=True)
-            self.numNewFolders += 1
-            self.doDC(self.client.create_dataset, dcFolder, datasetName, dType, fType, site=site, resource=fn, versionMetadata=metaData)
-            self.numRegistered += 1
-            return
-
+        ## Fresh registration in a new folder
+        if newFolder:
+            if self.debug or not self.quiet: print 'New folder: fresh registration'
+            self._createDataset(fn, dcFolder, datasetName, dType, fType, site, metaData)
+            outcome = REGISTERED
 
         ## Folder already exists, decide how to handle this registration request
-        if not self.doDC(self.client.exists, dcLoc):
+        elif not self.datasetExists(dcLoc):
             if self.debug or not self.quiet: print 'File not previously registered: fresh registration'
-            self.doDC(self.client.create_dataset, dcFolder, datasetName, dType, fType, site=site, resource=fn, versionMetadata=metaData)
-            self.numRegistered += 1
+            self._createDataset(fn, dcFolder, datasetName, dType, fType, site, metaData)
+            outcome = REGISTERED
         else:
             if self.debug: print 'File already registered'
-            self.numAlreadyRegistered += 1
-            ds = self.doDC(self.client.path, dcLoc, site='all')
+            self._count('numAlreadyRegistered')
+            outcome = ALREADY_REGISTERED
+            ds = self.datasetInfo(dcLoc)
+            if ds == None: return ERROR
             if self.debug: print 'ds = ',ds
             if self.debug: print 'ds.__dict__.keys() = ',ds.__dict__.keys()
             if 'site' in ds.__dict__.keys():
@@ -233,21 +549,167 @@ class registry(object):
                 print 'reCrawl = ',reCrawl
                 pass
 
+            if reCrawl and not addLoc and self._unchanged(dcLoc,metaData):
+                ## Same content as when the dataset was (last) crawled,
+                ## and no new location which the crawler has yet to scan
+                if self.debug or not self.quiet: print 'Content fingerprint unchanged: no reCrawl'
+                reCrawl = False
+                self._count('numSkippedReCrawl')
+                pass
+
             if addLoc:
                 ## Add a new location (site) for this dataset
                 if self.debug or not self.quiet: print 'Adding location ',site
                 self.doDC(self.client.mkloc, dcLoc, site=site, resource=fn)
-                self.numAddLocs += 1
+                self.knownDatasets[dcLoc] = None     ## cached locations are now stale
+                self._count('numAddLocs')
+                outcome = LOCATION_ADDED
                 pass
             
             if reCrawl:
                 ## Request dataset be reprocessed by the crawler
                 if self.debug or not self.quiet: print 'Requesting reCrawl'
                 patch_dict = {"scanStatus":"UNSCANNED"}
+                if self.fingerprintKey in metaData:
+                    patch_dict["versionMetadata"] = {self.fingerprintKey:metaData[self.fingerprintKey]}
+                    pass
                 self.doDC(self.client.patch_dataset, dcLoc, patch_dict, site=site)
-                self.numReCrawl += 1
+                self.knownDatasets[dcLoc] = None     ## cached metadata is now stale
+                self._count('numReCrawl')
+                if not addLoc: outcome = RECRAWL_REQUESTED
                 pass
             pass
+        if self._threadExceptions() != numExceptions: outcome = ERROR
+        return outcome
+
+
+    def _unchanged(self,dcLoc,metaData):
+        """True if the dataset has the content fingerprint given in metaData"""
+        newPrint = metaData.get(self.fingerprintKey)
+        if newPrint == None: return False
+        ds = self.datasetInfo(dcLoc,versionMetadata=True)
+        if ds == None: return False
+        oldPrint = (getattr(ds,'versionMetadata',None) or {}).get(self.fingerprintKey)
+        if self.debug: print 'Content fingerprint: old = ',oldPrint,', new = ',newPrint
+        return oldPrint == newPrint
+
+
+    def _createDataset(self,fn,dcFolder,datasetName,dType,fType,site,metaData):
+        """Fresh registration of a dataset, recorded in the cache"""
+        nexc = self._threadExceptions()
+        self.doDC(self.client.create_dataset, dcFolder, datasetName, dType, fType, site=site, resource=fn, versionMetadata=metaData)
+        if self._threadExceptions() == nexc and not self.dryrun:
+            self.knownDatasets[os.path.join(dcFolder,datasetName)] = None
+            pass
+        self._count('numRegistered')
+        return
+
+
+    def enableJournal(self,filename,numWorkers=1,maxAttempts=10):
+        """
+        Switch to journaled, asynchronous registration.
+         filename = sqlite journal file, normally in the job directory
+         numWorkers = number of threads used to send registrations
+         maxAttempts = number of attempts before a registration is given up
+
+        Registrations passed to submit() are first made durable in the
+        journal, then sent to the dataCatalog by a background flusher
+        thread, with retries (and exponential backoff) for requests that
+        encounter exceptions.  Use drain() to wait for their completion.
+
+        If filename is the journal of an earlier (e.g., crashed) job, the
+        registrations it left pending, or gave up, are sent as well.
+        """
+        if self.journal != None: self.closeJournal()
+        if not self.quiet: print 'Using registration journal ',filename
+        self.journal = registrationJournal.RegistrationJournal(filename,max_attempts=maxAttempts)
+        numRequeued = self.journal.requeue_failed()
+        if numRequeued > 0 and not self.quiet: print 'Retrying ',numRequeued,' registrations given up by an earlier job'
+        self.journalWorkers = numWorkers
+        self._stopFlusher = False
+        self._flusher = threading.Thread(target=self._flush)
+        self._flusher.daemon = True
+        self._flusher.start()
+        return
+
+
+    def submit(self,records):
+        """
+        Journal registration requests, given as records as for
+        register_many(), for asynchronous registration.  Returns the
+        number of requests journaled.
+        """
+        if self.journal == None:
+            raise RuntimeError('registry.submit() requires enableJournal()')
+        n = self.journal.append(records)
+        self._wakeup.set()
+        return n
+
+
+    def _flush(self):
+        """Background thread: send journaled registrations to the dataCatalog"""
+        while not self._stopFlusher:
+            entries = self.journal.pending(limit=self.batchSize*max(1,self.journalWorkers))
+            if len(entries) == 0:
+                ## Sleep until new submissions, the next retry, or at most 1 s
+                nextTry = self.journal.next_try()
+                wait = 1. if nextTry == None else min(1.,max(0.01,nextTry-time.time()))
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                continue
+            records = [record for id_,attempts,record in entries]
+            try:
+                outcomes = self.register_many(records,numWorkers=self.journalWorkers)
+            except Exception as e:
+                print '\n%Exception in registration journal flusher: ',e
+                outcomes = [(record[0],ERROR) for record in records]
+                pass
+            done = []
+            for (id_,attempts,record),(fn,outcome) in zip(entries,outcomes):
+                if outcome == ERROR:
+                    delay = min(self.maxRetryDelay,self.retryDelay*2**attempts)
+                    if not self.quiet: print 'Registration of ',fn,' failed, retry in ',delay,' s'
+                    self.journal.retry(id_,delay)
+                else:
+                    done.append((id_,outcome))
+                    pass
+                pass
+            self.journal.complete(done)
+            pass
+        return
+
+
+    def drain(self,timeout=None):
+        """
+        Wait until all journaled registrations have been sent (or given
+        up), for at most timeout seconds (None = no limit).
+        Returns True if all journaled registrations succeeded.
+        """
+        if self.journal == None: return True
+        if timeout != None: deadline = time.time() + timeout
+        while True:
+            counts = self.journal.counts()
+            if counts['pending'] == 0: return counts['failed'] == 0
+            if self._flusher == None or not self._flusher.is_alive():
+                print '%ERROR: registration journal flusher is not running'
+                return False
+            if timeout != None and time.time() >= deadline:
+                print 'Timeout draining registration journal: ',counts['pending'],' pending'
+                return False
+            time.sleep(0.1)
+            pass
+        return
+
+
+    def closeJournal(self):
+        """Stop the journal flusher and close the journal (pending entries remain in it)"""
+        if self.journal == None: return
+        self._stopFlusher = True
+        self._wakeup.set()
+        self._flusher.join()
+        self._flusher = None
+        self.journal.close()
+        self.journal = None
         return
 
 
@@ -0,0 +1,107 @@
+"""
+Translation of vendor FITS files as they are extracted from the
+delivery tarball.
+
+StreamingTranslation is a tarballIngest.extract_tarball consumer that
+passes the FITS members selected by the stream_rules of a vendor FITS
+translator (see VendorFitsTranslator) to it, so that the translated
+files are written during the ingest and each vendor file is read from
+the tarball only, rather than again from the unpacked tree by the
+validator.  The translation runs in a background thread, while the
+extraction of the following members proceeds; at most max_pending
+members are held in memory waiting to be translated.
+
+The translated files and the earliest observation date are recorded in
+a JSON file in the job directory, from which the validator takes them:
+
+    translation = StreamingTranslation(translator)
+    extract_tarball(datafile, md5, targetDir, consumer=translation)
+    translation.close()
+    translation.write('vendorIngest_translation.json')
+"""
+from __future__ import absolute_import, print_function
+import io
+import json
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+__all__ = ['StreamingTranslation', 'read_translation']
+
+class StreamingTranslation(object):
+    "extract_tarball consumer translating members in a background thread."
+    def __init__(self, translator, max_pending=2, time_stamp=None,
+                 verbose=False):
+        """
+        Constructor.
+        translator = VendorFitsTranslator subclass instance
+        max_pending = maximum number of members queued for translation
+        """
+        self.translator = translator
+        self.time_stamp = translator.start_stream(time_stamp=time_stamp,
+                                                  verbose=verbose)
+        self.outfiles = None
+        self.num_members = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._translate)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _translate(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self.num_members += 1
+            if self.error is not None:
+                continue
+            name, data = item
+            try:
+                self.translator.stream_member(name, io.BytesIO(data))
+            except Exception as eobj:
+                self.error = eobj
+
+    def accepts(self, name):
+        "Return True if the translator handles the member name."
+        return self.error is None and self.translator.stream_accepts(name)
+
+    def add(self, name, data):
+        "Queue the content of a member for translation (thread-safe)."
+        self._queue.put((name, data))
+
+    def close(self):
+        """
+        Wait for the queued members to be translated and finish the
+        translation.  Return the list of translated files, or raise the
+        first exception raised by the translator.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            if self.error is None:
+                self.outfiles = self.translator.finish_stream()
+        if self.error is not None:
+            raise self.error
+        return self.outfiles
+
+    def write(self, filename):
+        "Record the translated files and observation date in a JSON file."
+        try:
+            date_obs = self.translator.date_obs
+        except ValueError:
+            date_obs = None   # no files translated
+        with open(filename, 'w') as output:
+            json.dump(dict(outfiles=self.outfiles, date_obs=date_obs,
+                           time_stamp=self.time_stamp,
+                           num_members=self.num_members), output, indent=2)
+            output.write('\n')
+
+def read_translation(filename):
+    "Return the translated files and observation date recorded by write()."
+    with open(filename) as fd:
+        translation = json.load(fd)
+    return [str(x) for x in translation['outfiles']], translation['date_obs']
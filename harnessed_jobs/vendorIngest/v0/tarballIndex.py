@@ -0,0 +1,271 @@
+"""
+Random-access member index of archived vendor delivery tarballs.
+
+A TarballIndex maps each member of a (compressed) tarball to the offset
+and size of its content in the decompressed tar stream, and records the
+seek points of the compressed stream at which decoding can start:
+
+  bzip2 - every block (see parallelDecompress.Bz2BlockSplitter), given
+          by its bit range in the file and the offset and size of its
+          content, so a member is read by decoding only the blocks that
+          overlap it, i.e., in O(member size);
+  gzip  - every gzip member of the file.  Inflating cannot be resumed
+          within a gzip member without the preceding 32 kB of output,
+          which zlib does not let python restore, so for the usual
+          single-member .tar.gz the content is inflated from the start
+          of the file up to the member read;
+  none  - uncompressed tarballs are read directly at the member offset.
+
+The index is filled during the single-pass ingest of the tarball (see
+tarballIngest.extract_tarball) or by build_index(), written as JSON
+next to the unpacked delivery, and allows individual files to be taken
+from the archived tarball without unpacking it again, e.g.,
+
+  index = TarballIndex.read(indexFile)
+  for name in index.names('*/qe/*.fits'):
+      data = index.read_member(name)
+
+or, from the command line,
+
+  python tarballIndex.py <indexFile> --list
+  python tarballIndex.py <indexFile> --extract '*_Z_Inspect.txt' -o <dir>
+"""
+from __future__ import absolute_import, print_function
+import os
+import bz2
+import json
+import zlib
+import bisect
+import fnmatch
+import tarfile
+import argparse
+from collections import OrderedDict
+import parallelDecompress
+
+__all__ = ['TarballIndex', 'build_index']
+
+_chunk_size = 1024*1024
+
+class TarballIndex(object):
+    "Member offsets and compressed-stream seek points of a tarball."
+    def __init__(self, tarball, md5=None, compression=None):
+        """
+        Constructor.
+        tarball = path to the .tar, .tar.gz or .tar.bz2 file
+        md5 = [optional] checksum of the tarball
+        compression = 'bz2', 'gz' or None
+        """
+        self.tarball = os.path.realpath(tarball)
+        self.md5 = md5.upper() if md5 is not None else None
+        self.compression = compression
+        self.seek_points = None
+        self.members = OrderedDict()
+        self._offsets = None
+
+    def add_member(self, member):
+        "Record a tarfile.TarInfo read from the tar stream."
+        kind = 'file' if member.isfile() else \
+               'dir' if member.isdir() else \
+               'symlink' if member.issym() else 'other'
+        self.members[os.path.normpath(member.name)] = \
+            [member.offset_data, member.size, kind, member.mtime]
+
+    def set_seek_points(self, compression, points):
+        """
+        Record the seek points returned by the seek_points() method of
+        a parallelDecompress reader, or None if the stream was decoded
+        serially (reads then decompress from the start of the file).
+        """
+        self.compression = compression
+        self.seek_points = [list(x) for x in points] \
+                           if points is not None else None
+        self._offsets = None
+
+    def write(self, filename):
+        "Write the index as JSON, replacing any previous version atomically."
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'w') as output:
+            json.dump(OrderedDict([('tarball', self.tarball),
+                                   ('md5', self.md5),
+                                   ('compression', self.compression),
+                                   ('seek_points', self.seek_points),
+                                   ('members', self.members)]), output)
+            output.write('\n')
+        os.rename(tmpfile, filename)
+
+    @classmethod
+    def read(cls, filename, tarball=None):
+        """
+        Read an index written by write().  tarball overrides the path
+        recorded in the index, e.g., for a relocated archive.
+        """
+        with open(filename) as fd:
+            contents = json.load(fd, object_pairs_hook=OrderedDict)
+        index = cls(tarball or contents['tarball'], md5=contents['md5'],
+                    compression=contents['compression'])
+        index.set_seek_points(contents['compression'],
+                              contents['seek_points'])
+        index.members = OrderedDict((str(name), value) for name, value
+                                    in contents['members'].items())
+        return index
+
+    def names(self, pattern=None):
+        "Names of the regular file members, optionally matching a pattern."
+        return [name for name, (offset, size, kind, mtime)
+                in self.members.items() if kind == 'file' and
+                (pattern is None or fnmatch.fnmatch(name, pattern))]
+
+    def read_member(self, name):
+        "Return the content of the regular file member name."
+        offset, size, kind, mtime = self.members[os.path.normpath(name)]
+        if kind != 'file':
+            raise ValueError('Not a regular file member: %s' % name)
+        with open(self.tarball, 'rb') as fd:
+            if self.compression is None:
+                fd.seek(offset)
+                return fd.read(size)
+            if self.compression == 'bz2' and self.seek_points is not None:
+                return self._read_bz2_blocks(fd, offset, size)
+            start, skip = 0, offset
+            if self.compression == 'gz' and self.seek_points is not None:
+                i = self._seek_point(offset)
+                start, skip = self.seek_points[i][0], \
+                              offset - self.seek_points[i][1]
+            return _inflate_range(fd, self.compression, start, skip, size)
+
+    def extract_member(self, name, targetDir):
+        "Write the regular file member name below targetDir, returning its path."
+        path = os.path.join(targetDir, os.path.normpath(name))
+        data = self.read_member(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as output:
+            output.write(data)
+        mtime = self.members[os.path.normpath(name)][3]
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def _seek_point(self, offset):
+        "Index of the last seek point at or before a decompressed offset."
+        if self._offsets is None:
+            column = 2 if self.compression == 'bz2' else 1
+            self._offsets = [x[column] for x in self.seek_points]
+        return bisect.bisect_right(self._offsets, offset) - 1
+
+    def _read_bz2_blocks(self, fd, offset, size):
+        "Decode the bzip2 blocks overlapping [offset, offset + size)."
+        i = self._seek_point(offset)
+        pieces = []
+        end = offset + size
+        while size > 0 and i < len(self.seek_points):
+            start_bit, end_bit, block_offset, block_size = self.seek_points[i]
+            if block_offset >= end:
+                break
+            first = start_bit//8
+            fd.seek(first)
+            data = fd.read((end_bit + 7)//8 - first)
+            block = parallelDecompress.decompress_block(
+                (data, start_bit - 8*first, end_bit - 8*first))
+            pieces.append(block[max(offset - block_offset, 0):
+                                end - block_offset])
+            i += 1
+        data = b''.join(pieces)
+        if len(data) != size:
+            raise IOError('Truncated member at offset %i of %s'
+                          % (offset, self.tarball))
+        return data
+
+def _decompressor(compression):
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _inflate_range(fd, compression, start, skip, size):
+    """
+    Decompress the (possibly multi-stream) data starting at byte start
+    of fd, discarding the first skip bytes of output and returning the
+    following size bytes.
+    """
+    fd.seek(start)
+    decomp = _decompressor(compression)
+    pieces = []
+    wanted = size
+    while wanted > 0:
+        chunk = fd.read(_chunk_size)
+        if not chunk:
+            break
+        while chunk:
+            out = decomp.decompress(chunk)
+            chunk = decomp.unused_data
+            if compression == 'gz' and chunk[:2] != b'\x1f\x8b':
+                chunk = b''     # trailing bytes after the last gzip member
+            if skip >= len(out):
+                skip -= len(out)
+            else:
+                piece = out[skip:skip + wanted]
+                skip = 0
+                pieces.append(piece)
+                wanted -= len(piece)
+            if chunk:
+                decomp = _decompressor(compression)
+    data = b''.join(pieces)
+    if wanted > 0:
+        raise IOError('Truncated member in %s' % fd.name)
+    return data
+
+def build_index(datafile, md5=None, processes=1, chunk_size=_chunk_size):
+    """
+    Build the index of a tarball, e.g., one ingested before indexes were
+    written, in a separate pass over the file.
+    """
+    comptype = parallelDecompress.compression_type(datafile)
+    index = TarballIndex(datafile, md5=md5)
+    with open(datafile, 'rb') as raw:
+        stream = None
+        try:
+            if comptype is None:
+                tar = tarfile.open(fileobj=raw, mode='r|', bufsize=chunk_size)
+            else:
+                stream = parallelDecompress.open_decompressed(
+                    raw, comptype, processes=processes, chunk_size=chunk_size)
+                tar = tarfile.open(fileobj=stream, mode='r|',
+                                   bufsize=chunk_size)
+            for member in tar:
+                index.add_member(member)
+            tar.close()
+            if stream is not None:
+                # Decode the rest of the stream for the final seek points.
+                while stream.read(chunk_size):
+                    pass
+                index.set_seek_points(comptype, stream.seek_points())
+            else:
+                index.set_seek_points(None, [])
+        finally:
+            if stream is not None:
+                stream.close()
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='List or extract members of an indexed vendor tarball.')
+    parser.add_argument('index', help='index file written at ingest')
+    parser.add_argument('--tarball', default=None,
+                        help='location of the tarball, if moved')
+    parser.add_argument('--list', action='store_true',
+                        help='list the regular file members')
+    parser.add_argument('--extract', default=None,
+                        help='glob pattern of the members to extract')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='directory in which to extract members')
+    args = parser.parse_args()
+
+    index = TarballIndex.read(args.index, tarball=args.tarball)
+    if args.list:
+        for name in index.names():
+            print('%12i %s' % (index.members[name][1], name))
+    if args.extract is not None:
+        for name in index.names(args.extract):
+            print(index.extract_member(name, args.outdir))
+
+if __name__ == '__main__':
+    main()
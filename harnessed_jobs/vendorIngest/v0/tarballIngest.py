@@ -0,0 +1,554 @@
+"""
+Single-pass verification and extraction of vendor delivery tarballs.
+
+The compressed bytes of a delivery are read once, in bounded-size
+chunks.  Each chunk updates the md5 digest and is then handed to the
+decompressor and tar reader, so the checksum and the unpacking share
+the same read of the (NFS-resident) tarball.  Since the checksum is
+only known at the end of the stream, any members extracted from a
+tarball whose checksum does not match are removed again.
+
+Optionally, decompression is spread over several cores using the
+parallelDecompress module, and the extracted members and their md5
+checksums are recorded in an ingestManifest.IngestManifest so that an
+interrupted ingest can be resumed.
+
+The final permissions and group of the extracted files and directories
+can be set as each member is created (see extract_tarball), rather than
+by a second pass over the unpacked tree.
+
+The content of selected members can also be handed to a consumer (e.g.,
+the FITS translators, see streamingTranslation) as it is extracted, so
+that it need not be read back from the unpacked tree.
+
+The offsets of the members in the decompressed stream and the seek
+points of the compressed stream can be recorded in a
+tarballIndex.TarballIndex, from which single members can later be read
+back from the archived tarball.
+
+extract_tarballs() verifies and extracts the tarballs of a delivery
+(e.g., EO data and metrology) concurrently, with a common progress
+report, and stops all of them as soon as one fails.  A callable can be
+run as each tarball is verified, e.g., to journal the registration of
+its files while the other tarballs are still being extracted.
+"""
+from __future__ import absolute_import, print_function
+import os
+import time
+import stat
+import hashlib
+import tarfile
+import threading
+import parallelDecompress
+
+__all__ = ['ChecksumError', 'ExtractionCancelled', 'HashingReader',
+           'read_md5file', 'extract_tarball', 'extract_tarballs']
+
+_chunk_size = 1024*1024
+
+class ChecksumError(RuntimeError):
+    "The md5 checksum of a tarball does not match the delivered value."
+    pass
+
+class ExtractionCancelled(RuntimeError):
+    "The extraction was stopped because that of another tarball failed."
+    pass
+
+def read_md5file(md5file):
+    """
+    Return the upper-case md5 checksum contained in a vendor-supplied
+    .md5 or .md5sum file.
+    """
+    with open(md5file) as fd:
+        tokens = fd.read().split()
+    if len(tokens) == 1 or len(tokens) == 2:      ## Current e2v and ITL practice
+        return tokens[0].upper()
+    elif len(tokens) >= 3:
+        return tokens[2].upper()
+    raise ValueError('Unable to parse supplied md5 file: %s' % md5file)
+
+class HashingReader(object):
+    """
+    Read-only file-like wrapper that updates an md5 digest with every
+    byte passed through it.  Reads are served in chunks of at most
+    chunk_size bytes so that memory use does not grow with file size.
+    If given, progress is called with the number of bytes read so far
+    after every read; an exception it raises aborts the read.
+    """
+    def __init__(self, fileobj, chunk_size=_chunk_size, progress=None):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.md5 = hashlib.md5()
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        "Read and hash up to size bytes (all remaining bytes if size < 0)."
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(self.chunk_size)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        data = self.fileobj.read(min(size, self.chunk_size))
+        self.md5.update(data)
+        self.nbytes += len(data)
+        if self.progress is not None:
+            self.progress(self.nbytes)
+        return data
+
+    def drain(self):
+        "Hash any bytes remaining after the consumer has stopped reading."
+        while self.read(self.chunk_size):
+            pass
+
+    def hexdigest(self):
+        "Upper-case hex digest of the bytes read so far."
+        return self.md5.hexdigest().upper()
+
+def _rollback(extracted, targetDir):
+    """
+    Remove extracted members, deepest paths first.  Directories are
+    only removed if they are empty.
+    """
+    for member in sorted(extracted, key=lambda x: x.name, reverse=True):
+        path = os.path.join(targetDir, member.name)
+        try:
+            if member.isdir():
+                os.rmdir(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _member_type(member):
+    if member.isdir():
+        return 'dir'
+    if member.isfile():
+        return 'file'
+    if member.issym():
+        return 'symlink'
+    return 'other'
+
+class _Attributes(object):
+    """
+    Final mode and group of the extracted members, applied as each
+    member is created.  Files and directories are created with their
+    final mode (os.open, os.mkdir), less the bits masked by the umask,
+    which is left alone since it is shared with the other threads of
+    the process.  Any bits it removed and the group are then set, for
+    files using the open file descriptor of the new file.
+
+    counts holds the number of members handled, of chmod/chown calls
+    made, and of calls saved with respect to a separate chmod and
+    chown of every member.
+    """
+    def __init__(self, file_mode=None, dir_mode=None, gid=None):
+        self.file_mode = file_mode
+        self.dir_mode = dir_mode
+        self.gid = gid
+        self.counts = dict(members=0, metadata_ops=0, metadata_ops_saved=0)
+
+    def apply(self, status, mode, chmod, chown):
+        """
+        Bring the mode and group of a new member, with the given stat
+        result, to mode (None = unchanged) and self.gid, using the chmod
+        and chown callables.
+        """
+        if self.file_mode is None and self.dir_mode is None and \
+           self.gid is None:
+            return
+        ops = 0
+        if mode is not None and stat.S_IMODE(status.st_mode) != mode:
+            chmod(mode)
+            ops += 1
+        if self.gid is not None and status.st_gid != self.gid:
+            chown(-1, self.gid)
+            ops += 1
+        self.counts['members'] += 1
+        self.counts['metadata_ops'] += ops
+        self.counts['metadata_ops_saved'] += 2 - ops
+
+    def makedirs(self, path):
+        """
+        Create a directory and any missing parents, with the final
+        directory mode and group.
+        """
+        if os.path.isdir(path):
+            return
+        parent = os.path.dirname(path)
+        if parent and parent != path:
+            self.makedirs(parent)
+        os.mkdir(path, 0o777 if self.dir_mode is None else self.dir_mode)
+        self.apply(os.lstat(path), self.dir_mode,
+                   lambda mode: os.chmod(path, mode),
+                   lambda uid, gid: os.lchown(path, uid, gid))
+
+def _extract_file(tar, member, targetDir, chunk_size, attributes,
+                  chunks=None):
+    """
+    Extract a regular file member, returning the md5 checksum of its
+    content computed while it is written.  If chunks is a list, the
+    content is also appended to it.
+    """
+    path = os.path.join(targetDir, member.name)
+    attributes.makedirs(os.path.dirname(path))
+    md5 = hashlib.md5()
+    source = tar.extractfile(member)
+    mode = attributes.file_mode
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                 getattr(os, 'O_BINARY', 0),
+                 0o666 if mode is None else mode)
+    with os.fdopen(fd, 'wb') as output:
+        while True:
+            data = source.read(chunk_size)
+            if not data:
+                break
+            md5.update(data)
+            output.write(data)
+            if chunks is not None:
+                chunks.append(data)
+        output.flush()
+        if mode is None:
+            tar.chmod(member, path)
+        attributes.apply(os.fstat(fd), mode,
+                         lambda mode: os.fchmod(fd, mode),
+                         lambda uid, gid: os.fchown(fd, uid, gid))
+        if os.utime in getattr(os, 'supports_fd', ()):
+            os.utime(fd, (member.mtime, member.mtime))
+            fd = None
+    if fd is not None:
+        tar.utime(member, path)
+    return md5.hexdigest()
+
+def _extract_other(tar, member, targetDir, attributes):
+    "Extract a directory, symlink or other non-regular member."
+    path = os.path.join(targetDir, member.name)
+    if member.isdir() and attributes.dir_mode is not None:
+        if not os.path.isdir(path):
+            attributes.makedirs(path)
+        else:
+            attributes.apply(os.lstat(path), attributes.dir_mode,
+                             lambda mode: os.chmod(path, mode),
+                             lambda uid, gid: os.lchown(path, uid, gid))
+        return
+    attributes.makedirs(os.path.dirname(path))
+    tar.extract(member, targetDir)
+    if attributes.gid is not None:
+        attributes.apply(os.lstat(path), None, None,
+                         lambda uid, gid: os.lchown(path, uid, gid))
+
+def _already_extracted(manifest, member, targetDir):
+    """
+    Return True if the manifest records member as extracted with the
+    same size and mtime as the file now on disk.
+    """
+    name = os.path.normpath(member.name)
+    if manifest is None or not manifest.done(name, 'extracted'):
+        return False
+    previous = manifest.members[name]
+    if previous['size'] != member.size or previous['mtime'] != member.mtime:
+        return False
+    path = os.path.join(targetDir, member.name)
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return False
+    if member.isfile():
+        return stat.st_size == member.size and \
+            int(stat.st_mtime) == int(member.mtime)
+    return True
+
+def _consume(consumer, member, data):
+    "Hand the content of a member to the consumer."
+    consumer.add(os.path.normpath(member.name), data)
+
+def _extract(datafile, md5, targetDir, chunk_size, comptype, processes,
+             manifest, attributes, consumer, index, progress, verbose):
+    "Single pass over datafile with optional parallel decompression."
+    tarball = os.path.basename(datafile)
+    phases = ('extracted',)
+    if attributes.gid is not None and attributes.dir_mode is not None \
+       and attributes.file_mode is not None:
+        phases = ('extracted', 'permissions')
+    extracted = []
+    skipped = []
+    with open(datafile, 'rb') as raw:
+        reader = HashingReader(raw, chunk_size=chunk_size, progress=progress)
+        stream = None
+        try:
+            if comptype is None:
+                tar = tarfile.open(fileobj=reader, mode='r|*',
+                                   bufsize=chunk_size)
+            else:
+                stream = parallelDecompress.open_decompressed(
+                    reader, comptype, processes=processes,
+                    chunk_size=chunk_size)
+                tar = tarfile.open(fileobj=stream, mode='r|',
+                                   bufsize=chunk_size)
+            for member in tar:
+                if index is not None:
+                    index.add_member(member)
+                wanted = consumer is not None and member.isfile() and \
+                    consumer.accepts(os.path.normpath(member.name))
+                if _already_extracted(manifest, member, targetDir):
+                    skipped.append(member)
+                    if wanted:
+                        with open(os.path.join(targetDir, member.name),
+                                  'rb') as fd:
+                            _consume(consumer, member, fd.read())
+                    continue
+                member_md5 = None
+                if member.isfile():
+                    chunks = [] if wanted else None
+                    member_md5 = _extract_file(tar, member, targetDir,
+                                               chunk_size, attributes, chunks)
+                    if wanted:
+                        _consume(consumer, member, b''.join(chunks))
+                else:
+                    _extract_other(tar, member, targetDir, attributes)
+                extracted.append(member)
+                if manifest is not None:
+                    manifest.add_member(os.path.normpath(member.name),
+                                        tarball,
+                                        _member_type(member), member.size,
+                                        member.mtime, member_md5,
+                                        phases=phases)
+            tar.close()
+            if index is not None:
+                if stream is not None:
+                    index.set_seek_points(comptype, stream.seek_points())
+                else:
+                    serial = parallelDecompress.compression_type(datafile)
+                    index.set_seek_points(serial, None if serial else [])
+            if stream is not None:
+                stream.close()
+                stream = None
+            # Trailing bytes after the end-of-archive marker are part
+            # of the delivered checksum.
+            reader.drain()
+        except:
+            # With a manifest, the members extracted so far are kept so
+            # that a rerun can resume; they are only trusted after the
+            # checksum of the full tarball has been verified.
+            if manifest is None:
+                _rollback(extracted, targetDir)
+            raise
+        finally:
+            if stream is not None:
+                stream.close()
+    md5new = reader.hexdigest()
+    if verbose:
+        print('Old vendor checksum = ', md5.upper())
+        print('New md5 checksum    = ', md5new)
+        print('Bytes read = ', reader.nbytes, ', members extracted = ',
+              len(extracted), ', members already present = ', len(skipped))
+        if attributes.counts['members']:
+            print('Permission/group changes made = ',
+                  attributes.counts['metadata_ops'], ', saved = ',
+                  attributes.counts['metadata_ops_saved'])
+    if md5new != md5.upper():
+        _rollback(extracted + skipped, targetDir)
+        if manifest is not None:
+            manifest.reset(tarball)
+        raise ChecksumError('Checksum error in %s: expected %s, found %s'
+                            % (datafile, md5.upper(), md5new))
+    if manifest is not None:
+        manifest.tarball_verified(tarball, md5.upper())
+        manifest.sync()
+    return extracted
+
+def extract_tarball(datafile, md5, targetDir, chunk_size=_chunk_size,
+                    processes=1, manifest=None, file_mode=None,
+                    dir_mode=None, gid=None, counts=None, consumer=None,
+                    index=None, progress=None, verbose=True):
+    """
+    Verify the md5 checksum of a (possibly compressed) tarball while
+    extracting it into targetDir, reading the file only once.
+
+    datafile = path to the .tar, .tar.gz or .tar.bz2 file
+    md5 = expected md5 checksum (hex string, any case)
+    targetDir = directory in which to unpack the tarball
+    processes = number of processes used to decompress bzip2 blocks
+                (None = all cores).  For gzip files, any value other
+                than 1 enables pipelined reading and inflating.
+    manifest = [optional] ingestManifest.IngestManifest in which the
+               tarball's members and their checksums are recorded
+    file_mode, dir_mode = [optional] permissions of the extracted files
+               and directories (default: as given in the tarball)
+    gid = [optional] group id of the extracted members
+    counts = [optional] dict in which the numbers of 'members' created,
+             of chmod/chown calls made ('metadata_ops') and of calls
+             saved by setting the final attributes at creation time
+             ('metadata_ops_saved') are accumulated
+    consumer = [optional] object with accepts(name) and add(name, data)
+               methods: the content of each regular file member whose
+               (normalized) name is accepted is passed to add() once
+               the member has been extracted.  Members found already
+               extracted are read back from targetDir.  Since the
+               checksum is verified at the end of the tarball, the
+               consumer may be given members of a corrupt tarball.
+    index = [optional] tarballIndex.TarballIndex in which the offsets of
+            all members and the seek points of the compressed stream
+            are recorded.  Seek points are found by the parallel
+            decoders, which are then used even if processes is 1.
+            The index is left empty if the tarball is not read (see
+            below).
+    progress = [optional] callable passed the number of compressed bytes
+               read so far after each read; it may raise an exception
+               to stop the extraction
+
+    Returns the list of TarInfo members extracted by this call.  If
+    the checksum does not match, the extracted members are removed and
+    a ChecksumError is raised.  Without a manifest, any other failure
+    also removes the extracted members before the exception is
+    propagated.  With a manifest, a tarball that has already been
+    verified and fully extracted is not read again, and members that
+    were extracted by an interrupted earlier run are not rewritten.
+
+    If the compressed stream cannot be decoded in parallel, the tarball
+    is extracted again with serial decompression.
+
+    If all of file_mode, dir_mode and gid are given, the members are
+    recorded in the manifest with both the 'extracted' and the
+    'permissions' phase done.
+    """
+    if (manifest is not None and
+        manifest.is_extracted(os.path.basename(datafile), md5.upper())):
+        if verbose:
+            print('Tarball already verified and extracted:', datafile)
+        return []
+    comptype = None
+    if processes is None or processes > 1 or index is not None:
+        comptype = parallelDecompress.compression_type(datafile)
+    attributes = _Attributes(file_mode, dir_mode, gid)
+    try:
+        try:
+            return _extract(datafile, md5, targetDir, chunk_size, comptype,
+                            processes, manifest, attributes, consumer, index,
+                            progress, verbose)
+        except parallelDecompress.ParallelDecompressError as eobj:
+            if verbose:
+                print('Parallel decompression failed:', eobj)
+                print('Retrying with serial decompression.')
+        return _extract(datafile, md5, targetDir, chunk_size, None, 1,
+                        manifest, attributes, consumer, index, progress,
+                        verbose)
+    finally:
+        if counts is not None:
+            for key, value in attributes.counts.items():
+                counts[key] = counts.get(key, 0) + value
+
+class _Progress(object):
+    """
+    Bytes read from each of several tarballs being extracted, reported
+    at most every interval seconds, and cancellation of the remaining
+    extractions after a failure.
+    """
+    def __init__(self, datafiles, interval, verbose):
+        self.sizes = dict((x, os.path.getsize(x)) for x in datafiles)
+        self.nbytes = dict.fromkeys(datafiles, 0)
+        self.datafiles = datafiles
+        self.interval = interval
+        self.verbose = verbose
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._tstart = self._last = time.time()
+
+    def callback(self, datafile):
+        "Progress callable for the extraction of datafile."
+        def update(nbytes):
+            if self.cancelled.is_set():
+                raise ExtractionCancelled('Extraction of %s cancelled'
+                                          % datafile)
+            with self._lock:
+                self.nbytes[datafile] = nbytes
+                now = time.time()
+                if self.verbose and now - self._last >= self.interval:
+                    self._last = now
+                    self.report()
+        return update
+
+    def report(self):
+        "Print the fraction of each tarball and of the total read so far."
+        total = sum(self.sizes.values())
+        done = sum(self.nbytes.values())
+        print('Extraction progress: %.1f of %.1f MB (%.0f%%) after %.0f s; %s'
+              % (done/1e6, total/1e6, 100.*done/max(total, 1),
+                 time.time() - self._tstart,
+                 ', '.join('%s %.0f%%' % (os.path.basename(x),
+                                          100.*self.nbytes[x]/
+                                          max(self.sizes[x], 1))
+                           for x in self.datafiles)))
+
+def extract_tarballs(jobs, targetDir, max_workers=None, interval=60.,
+                     counts=None, done=None, verbose=True, **kwds):
+    """
+    Verify and extract several tarballs into targetDir concurrently,
+    using one thread per tarball (at most max_workers, largest tarballs
+    first), with a common progress report every interval seconds.
+
+    jobs = list of (datafile, md5, options), where options is a dict of
+           extract_tarball keyword arguments for that tarball only
+           (e.g., index), or None
+    counts = [optional] dict accumulating the counts of all tarballs
+    done = [optional] callable passed the datafile and the list of
+           members extracted once a tarball has been verified (and
+           extracted), in the thread that extracted it; an exception
+           it raises fails the extraction like that of the tarball
+    kwds = extract_tarball keyword arguments common to all tarballs
+
+    Returns the lists of TarInfo members extracted, in the order of
+    jobs.  If the extraction of a tarball fails, those still running
+    are cancelled (with the usual cleanup, see extract_tarball), and
+    the first exception raised, e.g., a ChecksumError, is re-raised
+    once all threads have finished.
+    """
+    progress = _Progress([job[0] for job in jobs], interval, verbose)
+    order = sorted(range(len(jobs)), reverse=True,
+                   key=lambda i: progress.sizes[jobs[i][0]])
+    results = [None]*len(jobs)
+    errors = []
+    job_counts = [dict() for job in jobs]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not order or errors:
+                    return
+                i = order.pop(0)
+            datafile, md5, options = jobs[i]
+            options = dict(kwds, **(options or {}))
+            try:
+                results[i] = extract_tarball(
+                    datafile, md5, targetDir, counts=job_counts[i],
+                    progress=progress.callback(datafile), verbose=verbose,
+                    **options)
+                if done is not None:
+                    done(datafile, results[i])
+            except Exception as eobj:
+                with lock:
+                    if not isinstance(eobj, ExtractionCancelled):
+                        errors.append(eobj)
+                progress.cancelled.set()
+                if verbose:
+                    print('Extraction of %s failed: %s' % (datafile, eobj))
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(max_workers or len(jobs), len(jobs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if counts is not None:
+        for job_count in job_counts:
+            for key, value in job_count.items():
+                counts[key] = counts.get(key, 0) + value
+    if errors:
+        raise errors[0]
+    if verbose:
+        progress.report()
+    return results
@@ -7,7 +7,6 @@ import glob
 import re
 import fnmatch
 import shutil
-import subprocess
 import datetime
 from collections import OrderedDict
 import ConfigParser
@@ -15,6 +14,10 @@ import numpy as np
 import lcatr.schema
 import siteUtils
 import vendorDataUtils
+import streamingTranslation
+from deliveryTree import DeliveryTree
+from fitsHeaderIndex import HeaderIndex
+from translationManifest import TranslationManifest
 from ItlFitsTranslator import ItlFitsTranslator
 from e2vFitsTranslator import e2vFitsTranslator
 
@@ -75,14 +78,16 @@ class ItlResults(VendorResults):
                         'prnu' : 'prnu.txt',
                         'qe_analysis' : 'qe.txt',
                         'metrology' : 'metrology.txt'}
-    def __init__(self, rootdir, verbose=True):
+    def __init__(self, rootdir, verbose=True, tree=None):
         """
         Constructor.
         rootdir = Top level directory containing all of the results files.
+        tree = [optional] DeliveryTree of rootdir
         """
         super(ItlResults, self).__init__()
-        command = 'find %s/ -name \*.txt -print' % rootdir
-        text_files = subprocess.check_output(command, shell=True).split()
+        if tree is None:
+            tree = DeliveryTree(rootdir.rstrip('/'))
+        text_files = tree.find('*.txt')
         if verbose:
             print("Found ITL results files:")
             for item in text_files:
@@ -386,21 +391,23 @@ class ItlResults(VendorResults):
 
 class e2vResults(VendorResults):
     "Class to process e2v CCD results."
-    def __init__(self, rootdir):
+    def __init__(self, rootdir, tree=None):
         """
         Constructor.
         rootdir = Top level directory containing all of the results files.
+        tree = [optional] DeliveryTree of rootdir
         """
         super(e2vResults, self).__init__()
-        self.rootdir = rootdir.replace(' ', '\ ')
+        self.rootdir = rootdir
+        if tree is None:
+            tree = DeliveryTree(rootdir.rstrip('/'))
+        self.tree = tree
 
     def _csv_data(self, *args, **kwds):
         "Method to extract per amp data from csv file."
         amp_data = {}
         subpath = os.path.join(*args)
-        command = 'find %s/ -name %s -print' % (self.rootdir, subpath)
-        results = subprocess.check_output(command, shell=True)
-        csv_file = sorted(results.split('\n')[:-1])[0]
+        csv_file = sorted(self.tree.find(subpath))[0]
         try:
             label = kwds['label']
         except KeyError:
@@ -418,9 +425,9 @@ class e2vResults(VendorResults):
         job = 'fe55_analysis'
         gains = {}
         psf_sigmas = {}
-        for amp, tokens in self._csv_data('\*Gain\*X-Ray\*_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*Gain*X-Ray*_Summary*.csv'):
             gains[amp] = float(tokens[0])
-        for amp, tokens in self._csv_data('\*PSF\*_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*PSF*_Summary*.csv'):
             psf_sigmas[amp] = float(tokens[0])
         results = []
         for amp in self._amps:
@@ -434,7 +441,7 @@ class e2vResults(VendorResults):
         job = 'read_noise'
         results = []
         system_noise_data = {}
-        for amp, tokens in self._csv_data('\*Noise\*Multiple\*Samples\*Summary\*.csv'):
+        for amp, tokens in self._csv_data('*Noise*Multiple*Samples*Summary*.csv'):
             read_noise = float(tokens[1])
             total_noise = float(tokens[3])
             system_noise = np.sqrt(total_noise**2 - read_noise**2)
@@ -463,7 +470,7 @@ class e2vResults(VendorResults):
         "Process the bright defects results."
         job = 'bright_defects'
         results = []
-        for amp, tokens in self._csv_data('\*Darkness_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*Darkness_Summary*.csv'):
             bright_pixels = int(tokens[1])
             bright_columns = int(tokens[3])
             results.append(validate(job, amp=amp, bright_pixels=bright_pixels,
@@ -474,7 +481,7 @@ class e2vResults(VendorResults):
         "Process the dark defects results."
         job = 'dark_defects'
         results = []
-        for amp, tokens in self._csv_data('\*PRDefs_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*PRDefs_Summary*.csv'):
             dark_pixels = int(tokens[-2])
             dark_columns = int(tokens[-3])
             results.append(validate(job, amp=amp, dark_pixels=dark_pixels,
@@ -485,7 +492,7 @@ class e2vResults(VendorResults):
         "Process the traps results."
         job = 'traps'
         results = []
-        for amp, tokens in self._csv_data('\*TrapsPP_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*TrapsPP_Summary*.csv'):
             num_traps = int(tokens[0])
             results.append(validate(job, amp=amp, num_traps=num_traps))
         return results
@@ -494,7 +501,7 @@ class e2vResults(VendorResults):
         "Process the dark current results."
         job = 'dark_current'
         results = []
-        for amp, tokens in self._csv_data('\*Darkness_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*Darkness_Summary*.csv'):
             dark_current = float(tokens[0])
             results.append(validate(job, amp=amp,
                                     dark_current_95CL=dark_current))
@@ -505,10 +512,10 @@ class e2vResults(VendorResults):
         job = 'cte_vendorIngest'
         results = []
         scti_low, pcti_low, scti_high, pcti_high = {}, {}, {}, {}
-        for amp, tokens in self._csv_data('\*CTE\*Optical\*Low_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*CTE*Optical*Low_Summary*.csv'):
             pcti_low[amp] = 1. - float(tokens[0])
             scti_low[amp] = 1. - float(tokens[1])
-        for amp, tokens in self._csv_data('\*CTE\*Optical\*High_Summary\*.csv'):
+        for amp, tokens in self._csv_data('*CTE*Optical*High_Summary*.csv'):
             pcti_high[amp] = 1. - float(tokens[0])
             scti_high[amp] = 1. - float(tokens[1])
         for amp in self._amps:
@@ -523,7 +530,7 @@ class e2vResults(VendorResults):
         "Process the PRNU results."
         job = 'prnu'
         results = []
-        for wl, tokens in self._csv_data('\*PRNU_Summary\*.csv',
+        for wl, tokens in self._csv_data('*PRNU_Summary*.csv',
                                          label='Wavelength'):
             prnu_percent = float(tokens[0])
             results.append(validate(job, wavelength=wl,
@@ -534,7 +541,7 @@ class e2vResults(VendorResults):
         "Process the flat pairs results."
         job = 'flat_pairs'
         results = []
-        for amp, tokens in self._csv_data('\*FWC\*Multiple\*Image\*Summary\*.csv'):
+        for amp, tokens in self._csv_data('*FWC*Multiple*Image*Summary*.csv'):
             full_well = float(tokens[0])
             # convert e2v number from percentages to fractions.
             max_frac_dev = float(tokens[1])/100.
@@ -550,10 +557,7 @@ class e2vResults(VendorResults):
     def qe_analysis(self):
         "Process the QE results."
         job = 'qe_analysis'
-        subpath = '\*QE_Summary\*.csv'
-        command = 'find %s/ -name %s -print' % (self.rootdir, subpath)
-        find_results = subprocess.check_output(command, shell=True)
-        csv_file = find_results.split('\n')[0]
+        csv_file = self.tree.find('*QE_Summary*.csv')[0]
         qe_results = dict((band, []) for band in self.qe_band_passes)
         for line in open(csv_file):
             tokens = line.split(',')
@@ -587,9 +591,7 @@ class e2vResults(VendorResults):
     def metrology(self):
         "Process the metrology results."
         results = {}
-        command = ('find %s/ -name \*Mechanical_Shim_Test_Sheet.xls -print'
-                   % self.rootdir)
-        xls_file = subprocess.check_output(command, shell=True).split('\n')[0]
+        xls_file = self.tree.find('*Mechanical_Shim_Test_Sheet.xls')[0]
         e2v_values = vendorDataUtils.get_e2v_xls_values(xls_file)
         results['zmean'] = e2v_values.get('Mean Height', -999)
         results['deviation_from_znom'] = \
@@ -628,20 +630,19 @@ def extract_ITL_metrology_date(txtfile):
     obs_date = datetime.datetime(year, month, day, hours, minutes, seconds)
     return obs_date.strftime('%Y-%m-%dT%H:%M:%S')
 
-def ITL_metrology_files(rootdir, expected_num=1):
+def ITL_metrology_files(rootdir, expected_num=1, tree=None):
     """
     Find the ITL metrology scan files assuming they have filenames of
     the form '*Z_Inspect*.txt' or the '*.txt' extension and the first
     non-blank line starts with the word "Program".  If the number of
     files found does not match the expected number, a RuntimeError
-    will be raised.
+    will be raised.  tree is an optional DeliveryTree of rootdir.
     """
-    command = 'find %s -name \*.txt -print | grep metrology' % rootdir
-    try:
-        txt_files = subprocess.check_output(command, shell=True).split()
-    except subprocess.CalledProcessError as eobj:
-        print("No metrology files found:")
-        print(eobj)
+    if tree is None:
+        tree = DeliveryTree(rootdir)
+    txt_files = [x for x in tree.find('*.txt') if 'metrology' in x]
+    if not txt_files:
+        print("No metrology files found in", rootdir)
         return []
     met_files = [txt_file for txt_file in txt_files
                  if fnmatch.fnmatch(txt_file, '*ID*SN*Z_Inspect*.txt')]
@@ -662,19 +663,16 @@ def ITL_metrology_files(rootdir, expected_num=1):
                            + (" expected %i." % expected_num))
     return met_files
 
-def e2v_metrology_files(rootdir, expected_num=1):
+def e2v_metrology_files(rootdir, expected_num=1, tree=None):
     """
     Find the e2v metrology scan files assuming the filenames end with
     'CT100*.csv'.  If the number of files found does not match the
-    expected number, a RuntimeError will be raised.
+    expected number, a RuntimeError will be raised.  tree is an
+    optional DeliveryTree of rootdir.
     """
-    command = 'find %s -name \*CT100\*.csv -print' % rootdir
-    try:
-        met_files = subprocess.check_output(command, shell=True).split()
-    except subprocess.CalledProcessError as eobj:
-        print("Exception raised while running 'find' for metrology data:")
-        print(eobj)
-        met_files = []
+    if tree is None:
+        tree = DeliveryTree(rootdir)
+    met_files = tree.find('*CT100*.csv')
     if len(met_files) == 0:
         print("No metrology files found.")
         return []
@@ -707,21 +705,56 @@ if __name__ == '__main__':
     vendorDataDir = os.readlink('vendorData')
     print('Vendor data location:', vendorDataDir)
 
+    # Header keywords of the vendor FITS files, kept next to the
+    # delivery so that its files are scanned only once.
+    header_index = HeaderIndex(vendorDataDir.rstrip('/') + '.headers')
+
+    # Outputs of earlier translations of the delivery, reused for
+    # unchanged vendor files when the job is rerun, unless
+    # VENDORINGEST_FORCE_TRANSLATION is set.
+    manifest_file = vendorDataDir.rstrip('/') + '.translation'
+    force = bool(os.environ.get('VENDORINGEST_FORCE_TRANSLATION'))
+
+    # Files of the delivery, read once for all of the lookups below.
+    tree = DeliveryTree(vendorDataDir.rstrip('/'))
+
     if siteUtils.getCcdVendor() == 'ITL':
-        vendor = ItlResults(vendorDataDir)
-        translator = ItlFitsTranslator(lsstnum, vendorDataDir, '.')
-        met_files = ITL_metrology_files(vendorDataDir, expected_num=1)
+        vendor = ItlResults(vendorDataDir, tree=tree)
+        manifest = TranslationManifest(manifest_file,
+                                       ItlFitsTranslator.version(),
+                                       force=force)
+        translator = ItlFitsTranslator(lsstnum, vendorDataDir, '.',
+                                       header_index=header_index,
+                                       manifest=manifest, tree=tree)
+        met_files = ITL_metrology_files(vendorDataDir, expected_num=1,
+                                        tree=tree)
         MET_date = extract_ITL_metrology_date(met_files[0])
     else:
-        vendor = e2vResults(vendorDataDir)
-        translator = e2vFitsTranslator(lsstnum, vendorDataDir, '.')
-        met_files = e2v_metrology_files(vendorDataDir, expected_num=1)
+        vendor = e2vResults(vendorDataDir, tree=tree)
+        manifest = TranslationManifest(manifest_file,
+                                       e2vFitsTranslator.version(),
+                                       force=force)
+        translator = e2vFitsTranslator(lsstnum, vendorDataDir, '.',
+                                       header_index=header_index,
+                                       manifest=manifest, tree=tree)
+        met_files = e2v_metrology_files(vendorDataDir, expected_num=1,
+                                        tree=tree)
         MET_date = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
 
     results.extend(vendor.run_all())
 
-    translator.run_all()
-    results.extend([lcatr.schema.fileref.make(x) for x in translator.outfiles])
+    # Use the FITS files translated by the producer while extracting
+    # them, if it did so.
+    translation_file = 'vendorIngest_translation.json'
+    if os.path.isfile(translation_file):
+        outfiles, EO_date = streamingTranslation.read_translation(translation_file)
+        print('Using translated FITS files listed in', translation_file)
+        results.extend([lcatr.schema.fileref.make(x) for x in outfiles])
+    else:
+        # Make the filerefs as the files are written.
+        for record in translator.iter_translate(processes=None):
+            results.append(lcatr.schema.fileref.make(record.outfile))
+        EO_date = translator.date_obs
     if met_files:
         results.extend(filerefs_for_metrology_files(met_files, lsstnum))
     system_noise_file = '%s_system_noise.txt' % siteUtils.getUnitId()
@@ -733,8 +766,17 @@ if __name__ == '__main__':
         results.append(lcatr.schema.fileref.make(system_noise_file,
                                                  metadata=metadata))
 
+    # Phase timings and throughput of the ingest (see producer).
+    metrics_file = 'vendorIngest_metrics.json'
+    if os.path.isfile(metrics_file):
+        metadata = dict(LSST_NUM=siteUtils.getUnitId(),
+                        DATA_PRODUCT='INGEST_METRICS',
+                        DATA_SOURCE='VENDOR')
+        results.append(lcatr.schema.fileref.make(metrics_file,
+                                                 metadata=metadata))
+
     results.append(validate('vendor_test_dates',
-                            EO_date=translator.date_obs,
+                            EO_date=EO_date,
                             MET_date=MET_date))
 
     # Persist special bias offsets file for ITL data (see LSSTTD-1255).
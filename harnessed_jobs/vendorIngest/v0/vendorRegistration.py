@@ -0,0 +1,143 @@
+"""
+vendorRegistration.py - registration of unpacked vendor deliveries in the
+dataCatalog, used by producer_vendorIngest.py (and by the registration
+benchmarks, with a localDatacat stand-in for the dataCatalog)
+"""
+import os,sys
+import registry
+import ingestMetrics
+
+
+
+def sanitize(path,debug=False):
+   """Remove offending characters from string"""
+   newPath = path.replace(' ','_').replace('(','').replace(')','')
+   if debug: print 'original  string[',len(path),']: ',path
+   if debug: print 'sanitized string[',len(newPath),']: ',newPath
+   return newPath
+
+
+
+def regVendorFiles(myDC,manifest,targetDirRoot,targetLDirRoot,deliveryTime,numWorkers=1,metrics=None,tarball=None,debug=False):
+   """
+   Register vendor files at SLAC in dataCatalog, in bulk (see
+   registry.register_many).  With numWorkers > 1 the (latency-bound)
+   registrations are performed concurrently by a pool of worker threads,
+   each with its own dataCatalog client session.  If the registry has a
+   journal, the registrations are only journaled here and sent by the
+   journal's background flusher (see registry.enableJournal).
+    myDC = registry.registry instance
+    manifest = ingestManifest.IngestManifest of the ingest, or None.  Files
+               registered by a previous attempt are skipped, and the files
+               registered now are recorded.
+    metrics = [optional] ingestMetrics.IngestMetrics timing the registration
+    tarball = [optional] only register the files extracted from this tarball
+              (base name), as recorded in the manifest
+
+   Returns a dict of the number of files per registration outcome.
+   """
+   dryrun = myDC.dryrun
+   if metrics == None: metrics = ingestMetrics.IngestMetrics()
+   if debug: print '===\nEntering regVendorFiles(',targetDirRoot,',',targetLDirRoot,',',deliveryTime,',',numWorkers,')'
+   site = 'slac.lca.archive'
+
+   myDC.dumpConfig()
+
+   dType = 'LSSTVENDORDATA'
+   filetypeMap = {'fits':'fits','fit':'fits','txt':'txt','jpg':'jpg','png':'png','pdf':'pdf','html':'html','htm':'html','xls':'xls'}
+   metaData = {"vendorDeliveryTime":deliveryTime}
+   numSkipped = 0
+   relPaths = []
+   regList = []
+
+   for root,dirs,files in os.walk(targetDirRoot):
+      print '-----------------'
+      sys.stdout.flush()
+      if debug:
+         print 'root = ',root
+         print '# dirs = ',len(dirs)
+         print '# files = ',len(files)
+         pass
+
+      commonPath = os.path.relpath(root,targetDirRoot)
+      if commonPath == '.': commonPath=''
+      if debug:print 'commonPath = ',commonPath
+
+      for file in files:                   ## Loop over all vendor files and register in dataCat
+         if debug: print 'Adding dataCatalog registration for file: ',file
+
+         filePath = os.path.join(root,file)
+         relPath = os.path.relpath(filePath,targetDirRoot)
+         if tarball != None and (manifest == None or relPath not in manifest.members
+                                 or manifest.members[relPath]['tarball'] != tarball):
+            continue
+         if manifest != None and manifest.done(relPath,'registered'):
+            if debug: print 'Already registered by a previous ingest attempt: ',relPath
+            numSkipped += 1
+            continue
+         dcFolder = os.path.join(targetLDirRoot,sanitize(commonPath,debug))
+         
+         # Extract file extension and assign dataCatalog "file type"
+         ext = os.path.splitext(file)[1].strip('.')
+         if ext in filetypeMap:
+            fType = filetypeMap[ext]
+         else:
+            fType = 'dat'
+            pass
+ 
+         if debug:
+            print '\n Add registry data:'
+            print 'filePath = ',filePath
+            print 'dcFolder = ',dcFolder
+            print 'site     = ',site
+            print 'fType    = ',fType
+            print 'dType    = ',dType
+            pass
+
+         # Content fingerprint, from the size and md5 computed at extraction,
+         # so that unchanged files are not recrawled when re-registered
+         fileMetaData = metaData
+         member = None if manifest == None else manifest.members.get(relPath)
+         if member != None and member['md5'] != None:
+            fileMetaData = dict(metaData)
+            fileMetaData[myDC.fingerprintKey] = registry.fingerprint(member['size'],member['md5'])
+            pass
+
+         relPaths.append(relPath)
+         regList.append((filePath, dcFolder, site, fType, dType, fileMetaData))
+         pass
+      pass
+
+   numOutcomes = {}
+   if myDC.journal != None:
+      print 'Journaling ',len(regList),' registrations in ',myDC.journal.filename
+      with metrics.phase('registration') as phase:
+         myDC.submit(regList)
+         phase.add(nfiles=len(regList),journaled=len(regList))
+         pass
+      ## The journal now owns these registrations
+      if manifest != None and not dryrun:
+         for relPath in relPaths: manifest.mark(relPath,'registered')
+         manifest.sync()
+         pass
+      print '\nNumber of files registered by a previous ingest attempt = ',numSkipped
+      return {'journaled':len(regList)}
+
+   print 'Registering ',len(regList),' files using ',numWorkers,' worker(s)'
+   sys.stdout.flush()
+   with metrics.phase('registration') as phase:
+      outcomes = myDC.register_many(regList,numWorkers=numWorkers)
+      phase.add(nfiles=len(regList))
+      pass
+   for relPath,(filePath,outcome) in zip(relPaths,outcomes):
+      numOutcomes[outcome] = numOutcomes.get(outcome,0) + 1
+      if outcome != registry.ERROR and manifest != None and not dryrun: manifest.mark(relPath,'registered')
+      pass
+   sys.stdout.flush()
+   if manifest != None: manifest.sync()
+   print '\nNumber of files registered by a previous ingest attempt = ',numSkipped
+   for outcome in sorted(numOutcomes):
+      print 'Number of files with registration outcome "%s" = ' % outcome,numOutcomes[outcome]
+      pass
+   myDC.dumpStats()
+   return numOutcomes
@@ -3,14 +3,15 @@ FITS file translator for ITL vendor data.
 """
 from __future__ import absolute_import, print_function, division
 import os
-import subprocess
 from collections import OrderedDict
 import ConfigParser
 import datetime
+import numpy as np
 import scipy.constants
 import astropy.io.fits as fits
 import astropy.time
 from VendorFitsTranslator import VendorFitsTranslator
+from deliveryTree import DeliveryTree
 
 __all__ = ['ItlFitsTranslator']
 
@@ -21,22 +22,59 @@ class ItlFitsTranslator(VendorFitsTranslator):
     """
     FITS Translator for ITL data.
     """
-    def __init__(self, lsst_num, rootdir, outputBaseDir='.'):
+    stream_rules = (('fe55/*fe55.*.fits', 'files', 'fe55', 'fe55',
+                     dict(skip_zero_exptime=True)),
+                    ('bias/*bias.*.fits', 'files', 'fe55', 'bias', {}),
+                    ('dark/*dark.*.fits', 'files', 'dark', 'dark',
+                     dict(skip_zero_exptime=True)),
+                    ('pocketpump/*pocketpump*.fits', 'trap', 'trap', None, {}),
+                    ('superflat2/*superflat.*.fits', 'files', 'sflat_500',
+                     'flat', dict(seqno_prefix='H')),
+                    ('superflat1/*superflat.*.fits', 'files', 'sflat_500',
+                     'flat', dict(seqno_prefix='L')),
+                    ('ptc/*ptc.*.fits', 'pairs', 'flat', 'flat', {}),
+                    ('linearity/*linearity.*.fits', 'files', 'linearity',
+                     'flat', {}),
+                    ('qe/*qe.*.fits', 'lambda', 'lambda', 'flat',
+                     dict(monowl_keyword='MONOWL')))
+    # The various ways ITL specifies the pocket pumped exposure in
+    # their data packages.
+    trap_image_types = {'pocketpump first bias': ('bias', '000'),
+                        'pocket pump': ('ppump', '000'),
+                        'pocketpumped flat': ('ppump', '000'),
+                        'pocketpump flat': ('ppump', '000'),
+                        'pocketpump second bias': ('bias', '001'),
+                        'pocket pump reference flat': ('flat', '000')}
+    # The pocket pumped exposures in the order trap looks for them.
+    trap_precedence = ('pocket pump', 'pocketpumped flat', 'pocketpump flat')
+
+    def __init__(self, lsst_num, rootdir, outputBaseDir='.',
+                 header_index=None, manifest=None, tree=None):
         """
         Constructor.
         lsst_num = LSST-assigned ID number. (LSST_NUM in FITS headers).
         rootdir = Top level directory containing the vendor files
         outputBaseDir = Directory where translated files (within
                         their subfolders)will be written.
+        header_index = [optional] HeaderIndex of the vendor files
+        manifest = [optional] TranslationManifest of earlier translations
+        tree = [optional] DeliveryTree of rootdir
         """
+        if tree is None:
+            tree = DeliveryTree(rootdir.rstrip('/'))
         super(ItlFitsTranslator, self).__init__(lsst_num, rootdir,
-                                                outputBaseDir)
+                                                outputBaseDir,
+                                                header_index=header_index,
+                                                manifest=manifest, tree=tree)
         # Identify the directory containing the subdirectories with
         # the data for the various tests.
-        my_rootdir = rootdir.rstrip('/') # remove any trailing slashes
-        my_rootdir = subprocess.check_output('find %s/ -name superflat1 -print'
-                                             % my_rootdir, shell=True)
-        self.rootdir = os.path.split(my_rootdir)[0]
+        superflat1 = tree.find('superflat1')
+        self.rootdir = os.path.dirname(superflat1[0]) if superflat1 else ''
+        # Incident flux of the QE files, by wavelength, and the QE
+        # files translated before it was known.
+        self._incident_flux = None
+        self._monowl_keyword = 'MONOWL'
+        self._flux_pending = []
 
     def _extract_date_obs(self, hdulist):
         """
@@ -66,7 +104,12 @@ class ItlFitsTranslator(VendorFitsTranslator):
         hdulist[0].header['MONOWL'] = float(hdulist[0].header['MONOWL'])
         hdulist[0].header['TESTTYPE'] = test_type.upper()
         hdulist[0].header['IMGTYPE'] = image_type.upper()
-        self._write_file(hdulist, locals(), verbose=verbose)
+        if test_type == 'lambda':
+            translation_params = self._apply_incident_flux(hdulist[0].header)
+        outfile = self._write_file(hdulist, locals(), verbose=verbose)
+        if test_type == 'lambda' and self._incident_flux is None \
+           and outfile is not None:
+            self._flux_pending.append(outfile)
 
     def fe55(self, pattern='fe55/*fe55.*.fits', time_stamp=None,
              verbose=True):
@@ -94,8 +137,9 @@ class ItlFitsTranslator(VendorFitsTranslator):
         if time_stamp is None:
             time_stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
         infiles = self._infiles(os.path.join(self.rootdir, pattern))
-        image_type = lambda x: fits.open(x)[0].header['OBJECT']
-        infiles = dict([(image_type(item), item) for item in infiles])
+        headers = self.header_index.headers(infiles)
+        infiles = dict([(header['OBJECT'], item)
+                        for item, header in zip(infiles, headers)])
         self.translate(infiles['pocketpump first bias'], 'trap', 'bias', '000',
                        time_stamp=time_stamp, verbose=verbose)
 
@@ -148,12 +192,12 @@ class ItlFitsTranslator(VendorFitsTranslator):
         "Process flat pair data set for full well and ptc analyses."
         if time_stamp is None:
             time_stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        exptime = lambda x: fits.open(x)[0].header['EXPTIME']
         infiles = self._infiles(pattern)
+        headers = self.header_index.headers(infiles)
         # Group files by exposure time and therefore into pairs, presumably.
         groups = OrderedDict()
-        for infile in infiles:
-            my_exptime = exptime(infile)
+        for infile, header in zip(infiles, headers):
+            my_exptime = header['EXPTIME']
             if not groups.has_key(my_exptime):
                 groups[my_exptime] = []
             groups[my_exptime].append(infile)
@@ -173,23 +217,36 @@ class ItlFitsTranslator(VendorFitsTranslator):
     def lambda_scan(self, pattern='qe/*qe.*.fits', time_stamp=None,
                     verbose=True, monowl_keyword='MONOWL'):
         "Process the QE dataset."
-        time_stamp = super(ItlFitsTranslator, self).lambda_scan(pattern,
-                                                                time_stamp=time_stamp,
-                                                                verbose=verbose)
-        flux = self._compute_incident_flux()
-        sensor_id = self.lsst_num
-        command = 'find . -name %(sensor_id)s_lambda_flat*.fits -print' % locals()
-        files = subprocess.check_output(command, shell=True).split()
+        # The incident flux is set in the QE files as they are
+        # translated, so it is computed first.
+        self._incident_flux = self._compute_incident_flux(tree=self.tree)
+        self._monowl_keyword = monowl_keyword
+        return super(ItlFitsTranslator, self).lambda_scan(pattern,
+                                                          time_stamp=time_stamp,
+                                                          verbose=verbose)
+
+    def _apply_incident_flux(self, header):
+        """
+        Replace MONDIODE in the header of a QE file by the incident
+        flux, if it is known, and return it as a string.
+        """
+        if self._incident_flux is None:
+            return None
+        wl = int(header[self._monowl_keyword])
+        header['MONDIODE_ORIG'] = header['MONDIODE']
+        header['MONDIODE'] = self._incident_flux[wl]
+        return repr(self._incident_flux[wl])
+
+    def _set_incident_flux(self, files):
+        "Set the incident flux in QE files translated before it was known."
         for item in files:
             fits_obj = fits.open(item)
-            wl = int(fits_obj[0].header[monowl_keyword])
-            fits_obj[0].header['MONDIODE_ORIG'] = fits_obj[0].header['MONDIODE']
-            fits_obj[0].header['MONDIODE'] = flux[wl]
+            self._apply_incident_flux(fits_obj[0].header)
             fits_obj.writeto(item, clobber=True)
-        return time_stamp
+            self._update_record(item)
 
     @staticmethod
-    def _compute_incident_flux():
+    def _compute_incident_flux(qe_txt=None, tree=None):
         """
         Read in qe.txt file and compute the incident fluxes as a function
         of wavelength.  In that file, there are two notes on computing
@@ -198,30 +255,60 @@ class ItlFitsTranslator(VendorFitsTranslator):
            Note1 = Flux @ sensor is Flux*Throughput/CalScal
            Note2 = Flux is [photons/sec/mm^2@diode]
 
+        qe_txt = [optional] file object of the qe.txt file, which
+                 otherwise is looked for in tree.
+        tree = [optional] DeliveryTree of the delivery (default: that
+               of the vendorData directory)
         """
-        vendor_data_dir = os.readlink('vendorData')
-        command = 'find %(vendor_data_dir)s/ -name qe.txt -print' % locals()
-        qe_txt_file = subprocess.check_output(command, shell=True).split()[0]
         parser = ConfigParser.ConfigParser()
-        parser.read(qe_txt_file)
+        if qe_txt is None:
+            if tree is None:
+                tree = DeliveryTree(os.readlink('vendorData'))
+            qe_txt_file = tree.find('qe.txt')[0]
+            parser.read(qe_txt_file)
+        else:
+            parser.readfp(qe_txt)
         cal_scale = float(dict(parser.items('Info'))['calscale'])
-        data = parser.items('QE')
-        flux_at_sensor = {}
-        for key, value in data:
-            if not key.startswith('qe'):
-                continue
-            tokens = value.split()
-            wl = int(float(tokens[0])) # nm
-            flux = float(tokens[4])    # photons/s/mm^2
-            throughput = float(tokens[5])
-            # Convert to nW/cm^2
-            energy_per_photon = 1e9*planck*clight/(wl*1e-9)   # nJ
-            mm2_per_cm2 = 100.
-            lightpow = flux*energy_per_photon*mm2_per_cm2*throughput/cal_scale
-            flux_at_sensor[wl] = lightpow
-        return flux_at_sensor
-
-    def run_all(self):
+        rows = [value.split() for key, value in parser.items('QE')
+                if key.startswith('qe')]
+        wls = np.array([int(float(tokens[0])) for tokens in rows])  # nm
+        flux = np.array([float(tokens[4]) for tokens in rows],
+                        dtype=float)   # photons/s/mm^2
+        throughput = np.array([float(tokens[5]) for tokens in rows],
+                              dtype=float)
+        # Convert to nW/cm^2
+        energy_per_photon = 1e9*planck*clight/(wls*1e-9)   # nJ
+        mm2_per_cm2 = 100.
+        lightpow = flux*energy_per_photon*mm2_per_cm2*throughput/cal_scale
+        return dict(zip(wls.tolist(), lightpow.tolist()))
+
+    def stream_accepts(self, name):
+        "Also accept the qe.txt file, for the incident flux of the QE files."
+        return os.path.basename(name) == 'qe.txt' or \
+            super(ItlFitsTranslator, self).stream_accepts(name)
+
+    def stream_member(self, name, fileobj):
+        "Translate a vendor file, or read the incident flux from qe.txt."
+        if os.path.basename(name) == 'qe.txt':
+            self._incident_flux = self._compute_incident_flux(fileobj)
+            return
+        super(ItlFitsTranslator, self).stream_member(name, fileobj)
+
+    def finish_stream(self):
+        """
+        Also set the incident flux of the QE files translated before
+        the qe.txt file was read.
+        """
+        outfiles = super(ItlFitsTranslator, self).finish_stream()
+        qe_files = [x for x in self._flux_pending if x in outfiles]
+        if qe_files:
+            if self._incident_flux is None:
+                self._incident_flux = self._compute_incident_flux(tree=self.tree)
+            self._set_incident_flux(qe_files)
+        self._flux_pending = []
+        return outfiles
+
+    def _datasets(self):
         "Run all of the methods for each test type"
         time_stamp = self.fe55()
         self.bias(time_stamp=time_stamp)
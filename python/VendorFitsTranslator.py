@@ -4,9 +4,51 @@ Base class for FITS translators of vendor FITS files.
 from __future__ import absolute_import, print_function
 import os
 import glob
+import fnmatch
 import datetime
-import astropy.io.fits as fits
+import multiprocessing
+from collections import namedtuple
 import lsst.eotest.sensor as sensorTest
+from fitsHeaderIndex import HeaderIndex, read_header
+import fitsPassthrough
+from fitsPassthrough import write_passthrough
+from translationManifest import code_version, file_digest
+
+__all__ = ['VendorFitsTranslator', 'TranslationRecord']
+
+# File written by a translator, as yielded by
+# VendorFitsTranslator.iter_translate.
+TranslationRecord = namedtuple('TranslationRecord', ['outfile', 'test_type',
+                                                     'image_type', 'size',
+                                                     'digest'])
+
+_worker_translator = None
+
+# Header cards of the amplifier geometries, keyed by (NAXIS1, NAXIS2,
+# CCD_MANU), see VendorFitsTranslator._set_amp_geom.
+_amp_geom_cards = {}
+
+def _init_worker(translator):
+    "Pool initializer: keep the translator used by _translate_task."
+    global _worker_translator
+    _worker_translator = translator
+
+def _translate_task(task):
+    """
+    Translate one file as recorded by VendorFitsTranslator._plan,
+    returning the files written, their observation dates and records.
+    """
+    infile, test_type, image_type, seqno, time_stamp, verbose = task
+    translator = _worker_translator
+    translator.outfiles = []
+    translator.obs_dates = []
+    translator.records = []
+    translator._translations = []
+    translator._reused = set()
+    translator.translate(infile, test_type, image_type, seqno,
+                         time_stamp=time_stamp, verbose=verbose)
+    return (translator.outfiles, translator.obs_dates, translator.records,
+            translator._translations, translator._reused)
 
 class VendorFitsTranslator(object):
     """
@@ -19,20 +61,87 @@ class VendorFitsTranslator(object):
     test_types: fe55 dark flat lambda trap sflat_nnn spot
     image_types: bias dark fe55 flat spot ppump
     filenames: <lsst_num>_<test_type>_<image_type>_<seqno>_<time_stamp>.fits
+
+    Besides translating the files of an unpacked delivery (run_all),
+    the vendor files can be translated as they are read from the
+    delivery tarball, e.g., by the ingest job (start_stream,
+    stream_member, finish_stream).  The members are classified using
+    the file patterns of the stream_rules, which are
+
+    (pattern, kind, test_type, image_type, options)
+
+    with kind one of
+    'files': as _process_files, with the options seqno_prefix and
+             skip_zero_exptime,
+    'trap': ITL pocket pumping files, whose image type and seqno are
+            given by trap_image_types for their OBJECT keyword; of the
+            files with the same image type and seqno, the one whose
+            OBJECT comes first in trap_precedence is kept (see trap),
+    'pairs': ITL flat pairs, grouped by EXPTIME (see flat),
+    'exptime': e2v flats, numbered by EXPOSURE (see flat),
+    'lambda': QE dataset, numbered by the monowl_keyword option.
+
+    The header keywords on which the selection and grouping of the
+    files depend are taken from a fitsHeaderIndex.HeaderIndex, so that
+    each vendor file is opened only once, to be translated.
+
+    run_all can translate the files in a process pool: the translate
+    calls made by the dataset methods (see _datasets) are first
+    recorded, then executed in parallel, and their outputs merged in
+    the order of the serial execution, so that outfiles and obs_dates
+    are the same as in the serial mode.  iter_translate does the same,
+    yielding a TranslationRecord for each file as it is written, so
+    that consumers of the files can run during the translation.
+
+    Since only the headers are translated, _write_file rewrites the
+    headers and copies the data units of the vendor files verbatim
+    (see fitsPassthrough.write_passthrough).
+
+    If a translationManifest.TranslationManifest is given, the outputs
+    of an earlier translation of the vendor files by the same version
+    of the translator are reused instead of being written again, and
+    run_all records the files in the manifest as they are written.  The
+    manifest file is written every minute during the translation and
+    at its end, also if the translation fails or the consumer of
+    iter_translate stops early, so that a rerun reuses the files
+    already written.
     """
-    def __init__(self, lsst_num, rootdir, outputBaseDir):
+    stream_rules = ()
+    trap_image_types = {}
+    trap_precedence = ()
+
+    def __init__(self, lsst_num, rootdir, outputBaseDir, header_index=None,
+                 manifest=None, tree=None):
         """
         Constructor.
         lsst_num = LSST-assigned ID number. (LSST_NUM in FITS headers).
         rootdir = Top level directory containing the vendor files
         outputBaseDir = Directory where translated files (within
                         their subfolders)will be written.
+        header_index = [optional] HeaderIndex of the vendor files
+        manifest = [optional] TranslationManifest of earlier translations
+        tree = [optional] DeliveryTree of rootdir, whose FITS files are
+               scanned by run_all
         """
+        if header_index is None:
+            header_index = HeaderIndex()
+        self.header_index = header_index
         self.lsst_num = lsst_num
         self.rootdir = rootdir
         self.output_base_dir = outputBaseDir
         self.outfiles = []
         self.obs_dates = []
+        self.records = []
+        self.manifest = manifest
+        self.tree = tree
+        self._translations = []
+        self._reused = set()
+        self._stream = None
+
+    @classmethod
+    def version(cls):
+        "Return the version of the translator code, for the manifest."
+        return code_version(cls, fitsPassthrough)
 
     @property
     def date_obs(self):
@@ -43,7 +152,11 @@ class VendorFitsTranslator(object):
         return sorted(glob.glob(os.path.join(self.rootdir, pattern)))
 
     def _write_file(self, hdulist, local_vars, verbose=True):
-        "Write translated files with conforming filenames."
+        """
+        Write translated files with conforming filenames.  Return the
+        (relative) path of the file written, or None if it had already
+        been written.
+        """
         outfile = "%(lsst_num)s_%(test_type)s_%(image_type)s_%(seqno)s_%(time_stamp)s.fits" % local_vars
         outdir = os.path.join(self.output_base_dir, local_vars['test_type'],
                               local_vars['time_stamp'])
@@ -53,25 +166,73 @@ class VendorFitsTranslator(object):
             pass
         outfile = os.path.join(outdir, outfile)
         if os.path.relpath(outfile) not in self.outfiles:
-            if verbose:
-                print("writing", outfile)
-            hdulist.writeto(outfile, checksum=True, output_verify='fix')
+            infile = local_vars['infile']
+            name = tuple(local_vars[x] for x in
+                         ('lsst_num', 'test_type', 'image_type', 'seqno'))
+            if local_vars.get('translation_params') is not None:
+                # Other parameters on which the output depends
+                name += (local_vars['translation_params'],)
+            entry = None
+            if self.manifest is not None and not hasattr(infile, 'read'):
+                entry = self.manifest.lookup(infile, name)
+            if entry is not None:
+                if verbose:
+                    print("reusing", entry['outfile'], "for", outfile)
+                self.manifest.reuse(entry, outfile)
+                self._reused.add(os.path.relpath(outfile))
+                size, digest = entry['output'][0], entry['digest']
+            else:
+                if verbose:
+                    print("writing", outfile)
+                written = write_passthrough(hdulist, outfile,
+                                            output_verify='fix')
+                if written is not None:
+                    size, digest = written
+                else:
+                    size, digest = os.path.getsize(outfile), file_digest(outfile)
+            if not hasattr(infile, 'read'):
+                self._translations.append((infile, name,
+                                           os.path.relpath(outfile), digest))
             self.outfiles.append(os.path.relpath(outfile))
+            self.records.append(TranslationRecord(os.path.relpath(outfile),
+                                                  local_vars['test_type'],
+                                                  local_vars['image_type'],
+                                                  size, digest))
             self._extract_date_obs(hdulist)
+            return os.path.relpath(outfile)
+        return None
+
+    @staticmethod
+    def _amp_geom_cards(naxis1, naxis2, vendor):
+        """
+        Return the DETSIZE card of the primary HDU and the dict, keyed
+        by amp, of the DETSIZE, DATASEC and DETSEC cards of the image
+        HDUs for segments of size naxis1 x naxis2, cached since all of
+        the files of a delivery share the same geometry.
+        """
+        key = (naxis1, naxis2, vendor)
+        try:
+            return _amp_geom_cards[key]
+        except KeyError:
+            pass
+        amp_geom = sensorTest.AmplifierGeometry(detxsize=8*naxis1,
+                                               detysize=2*naxis2)
+        amp_cards = dict((amp, [(keyword, amp_geom[amp][keyword])
+                                for keyword in ('DETSIZE', 'DATASEC',
+                                                'DETSEC')])
+                         for amp in range(1, 17))
+        _amp_geom_cards[key] = [('DETSIZE', amp_geom.DETSIZE)], amp_cards
+        return _amp_geom_cards[key]
 
     @staticmethod
     def _set_amp_geom(hdulist):
         "Set the amplifier geometry of the translated FITS file."
-        detxsize = 8*hdulist[1].header['NAXIS1']
-        detysize = 2*hdulist[1].header['NAXIS2']
-        amp_geom = sensorTest.AmplifierGeometry(detxsize=detxsize,
-                                               detysize=detysize)
-        hdulist[0].header['DETSIZE'] = amp_geom.DETSIZE
+        primary_cards, amp_cards = VendorFitsTranslator._amp_geom_cards(
+            hdulist[1].header['NAXIS1'], hdulist[1].header['NAXIS2'],
+            hdulist[0].header.get('CCD_MANU'))
+        hdulist[0].header.update(primary_cards)
         for hdu in range(1, 17):
-            amp = hdulist[hdu].header['AMPNO']
-            hdulist[hdu].header['DETSIZE'] = amp_geom[amp]['DETSIZE']
-            hdulist[hdu].header['DATASEC'] = amp_geom[amp]['DATASEC']
-            hdulist[hdu].header['DETSEC'] = amp_geom[amp]['DETSEC']
+            hdulist[hdu].header.update(amp_cards[hdulist[hdu].header['AMPNO']])
 
     def _process_files(self, test_type, image_type, pattern, seqno_prefix=None,
                        time_stamp=None, verbose=True, skip_zero_exptime=False):
@@ -86,11 +247,12 @@ class VendorFitsTranslator(object):
             print("No files found for TESTTYPE=%(test_type)s, IMGTYPE=%(image_type)s and file pattern %(my_pattern)s\n" % locals())
         if time_stamp is None:
             time_stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        if skip_zero_exptime:
+            headers = self.header_index.headers(infiles)
         for iframe, infile in enumerate(infiles):
             if verbose:
                 print("processing", os.path.basename(infile))
-            if (skip_zero_exptime and
-                fits.open(infile)[0].header['EXPTIME'] == 0):
+            if skip_zero_exptime and headers[iframe]['EXPTIME'] == 0:
                 if verbose:
                     print("skipping zero exposure frame.")
                 continue
@@ -101,6 +263,107 @@ class VendorFitsTranslator(object):
                            time_stamp=time_stamp, verbose=verbose)
         return time_stamp
 
+    def _datasets(self):
+        "Run the methods translating the dataset of each test type."
+        raise NotImplementedError
+
+    def run_all(self, processes=1):
+        """
+        Translate all of the datasets.
+        processes = number of processes translating files in parallel
+                    (None = all cores, 1 = serial)
+        """
+        for record in self.iter_translate(processes=processes):
+            pass
+
+    def iter_translate(self, processes=1):
+        """
+        Translate all of the datasets, yielding the TranslationRecord
+        of each file once it is written, in the order of run_all.
+        processes = number of processes translating files in parallel
+                    (None = all cores, 1 = serial)
+        """
+        if self.tree is not None:
+            self.header_index.scan(self.tree.find('*.fits'))
+        else:
+            self.header_index.scan_tree(self.rootdir)
+        tasks = self._plan()
+        try:
+            if processes == 1:
+                for infile, test_type, image_type, seqno, time_stamp, \
+                        verbose in tasks:
+                    num_records = len(self.records)
+                    num_translations = len(self._translations)
+                    self.translate(infile, test_type, image_type, seqno,
+                                   time_stamp=time_stamp, verbose=verbose)
+                    self._record_translations(
+                        self._translations[num_translations:])
+                    for record in self.records[num_records:]:
+                        yield record
+            else:
+                for record in self._iter_parallel(tasks, processes):
+                    yield record
+        finally:
+            if self.manifest is not None:
+                self.manifest.write()
+
+    def _record_translations(self, translations):
+        "Record the (infile, name, outfile, digest) translations in the manifest."
+        if self.manifest is None:
+            return
+        for infile, name, outfile, digest in translations:
+            self.manifest.record(infile, name, outfile, digest)
+        self.manifest.checkpoint()
+
+    def _iter_parallel(self, tasks, processes):
+        """
+        Translate the files in a pool of processes, merging and yielding
+        their records in the order of the tasks.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(max(1, min(processes, len(tasks))),
+                                    initializer=_init_worker,
+                                    initargs=(self,))
+        try:
+            for outfiles, obs_dates, records, translations, reused \
+                    in pool.imap(_translate_task, tasks, chunksize=1):
+                self.outfiles.extend(outfiles)
+                self.obs_dates.extend(obs_dates)
+                self.records.extend(records)
+                self._translations.extend(translations)
+                self._reused.update(reused)
+                self._record_translations(translations)
+                for record in records:
+                    yield record
+        finally:
+            # All of the results have been received, unless the
+            # consumer stopped early.
+            pool.terminate()
+            pool.join()
+
+    def _plan(self):
+        """
+        Run the dataset methods, recording their translate calls
+        instead of executing them, and return the calls, omitting those
+        that would write a file already written by an earlier call.
+        """
+        tasks = []
+        names = set()
+        def record(infile, test_type, image_type, seqno, time_stamp=None,
+                   verbose=True):
+            name = (test_type, image_type, seqno, time_stamp)
+            if name not in names:
+                names.add(name)
+                tasks.append((infile, test_type, image_type, seqno,
+                              time_stamp, verbose))
+        self.translate = record
+        try:
+            self._datasets()
+        finally:
+            del self.translate
+        return tasks
+
     def lambda_scan(self, pattern=None, time_stamp=None, verbose=True,
                     monowl_keyword='MONOWL'):
         "Process the QE dataset."
@@ -109,10 +372,10 @@ class VendorFitsTranslator(object):
         if time_stamp is None:
             time_stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
         infiles = self._infiles(pattern)
-        for infile in infiles:
+        headers = self.header_index.headers(infiles)
+        for infile, hdr in zip(infiles, headers):
             if verbose:
                 print("processing", os.path.basename(infile))
-            hdr = fits.open(infile)[0].header
             try:
                 if hdr['EXPTIME'] == 0:
                     # Skip the bias frame that ITL includes in their
@@ -127,3 +390,174 @@ class VendorFitsTranslator(object):
             self.translate(infile, 'lambda', 'flat', seqno,
                            time_stamp=time_stamp, verbose=verbose)
         return time_stamp
+
+    def start_stream(self, time_stamp=None, verbose=True):
+        """
+        Start translating vendor files passed one at a time, in any
+        order, to stream_member.  All of the datasets share the time
+        stamp.
+        """
+        if time_stamp is None:
+            time_stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        self._stream = dict(time_stamp=time_stamp, verbose=verbose,
+                            seen=set(), members=dict(), count=0)
+        return time_stamp
+
+    def _stream_rule(self, name):
+        "Return the index of the stream rule matching member name."
+        for index, rule in enumerate(self.stream_rules):
+            if (fnmatch.fnmatch(name, rule[0]) or
+                fnmatch.fnmatch(name, os.path.join('*', rule[0]))):
+                return index
+        return None
+
+    def stream_accepts(self, name):
+        "Return True if the member name is to be passed to stream_member."
+        return self._stream_rule(name) is not None
+
+    def _stream_translate(self, fileobj, test_type, image_type, seqno):
+        """
+        Translate a member, returning the file written and the index of
+        its observation date (None, None if nothing was written).
+        """
+        num_outfiles = len(self.outfiles)
+        fileobj.seek(0)
+        self.translate(fileobj, test_type, image_type, seqno,
+                       time_stamp=self._stream['time_stamp'],
+                       verbose=self._stream['verbose'])
+        if len(self.outfiles) == num_outfiles:
+            return None, None
+        return self.outfiles[-1], len(self.obs_dates) - 1
+
+    def stream_member(self, name, fileobj):
+        """
+        Translate the vendor file with member name (its path in the
+        delivery), read from the file object fileobj.  Files whose
+        sequence number depends on the other files of the dataset are
+        written with a provisional one, and renamed by finish_stream.
+        """
+        index = self._stream_rule(name)
+        if index is None or name in self._stream['seen']:
+            return
+        self._stream['seen'].add(name)
+        pattern, kind, test_type, image_type, options = self.stream_rules[index]
+        if self._stream['verbose']:
+            print("processing", name)
+        header = read_header(fileobj)
+        if kind == 'trap':
+            if header.get('OBJECT') not in self.trap_image_types:
+                return
+            # Written with a provisional seqno, since another file may
+            # take precedence for its image type and seqno.
+            image_type = self.trap_image_types[header['OBJECT']][0]
+            self._stream['count'] += 1
+            outfile, date_index = self._stream_translate(
+                fileobj, test_type, image_type,
+                'stream%06i' % self._stream['count'])
+            self._stream['members'].setdefault(index, []).append(
+                (name, outfile, date_index, header['OBJECT']))
+            return
+        elif kind == 'exptime':
+            seqno = '%03i_flat1' % header['EXPOSURE']
+        elif kind == 'lambda':
+            if header.get('EXPTIME') == 0:
+                # Skip the bias frame that ITL includes in their
+                # set of QE files.
+                return
+            seqno = "%04i" % int(header[options['monowl_keyword']])
+        else:
+            # Files numbered by their position in the dataset.
+            outfile, date_index = None, None
+            exptime = header.get('EXPTIME')
+            if not (kind == 'pairs' or options.get('skip_zero_exptime')) \
+               or exptime != 0:
+                self._stream['count'] += 1
+                outfile, date_index = self._stream_translate(
+                    fileobj, test_type, image_type,
+                    'stream%06i' % self._stream['count'])
+            self._stream['members'].setdefault(index, []).append(
+                (name, outfile, date_index, exptime))
+            return
+        self._stream_translate(fileobj, test_type, image_type, seqno)
+
+    def _stream_rename(self, outfile, seqno):
+        "Give a provisionally named file its final sequence number."
+        tokens = os.path.basename(outfile).split('_')
+        tokens[-2] = seqno
+        final = os.path.join(os.path.dirname(outfile), '_'.join(tokens))
+        os.rename(outfile, final)
+        self.outfiles[self.outfiles.index(outfile)] = final
+        self.records = [x._replace(outfile=final) if x.outfile == outfile
+                        else x for x in self.records]
+
+    def _stream_remove(self, outfile):
+        "Remove a provisionally named file."
+        os.remove(outfile)
+        self.outfiles.remove(outfile)
+        self.records = [x for x in self.records if x.outfile != outfile]
+
+    def _update_record(self, outfile):
+        "Update the size and digest of the record of a rewritten file."
+        self.records = [x._replace(size=os.path.getsize(outfile),
+                                   digest=file_digest(outfile))
+                        if x.outfile == outfile else x for x in self.records]
+
+    def finish_stream(self):
+        """
+        Assign the final sequence numbers of the datasets numbered by
+        position, as run_all would, and return the translated files.
+        """
+        dropped = set()
+        for index, members in self._stream['members'].items():
+            kind, options = self.stream_rules[index][1], self.stream_rules[index][4]
+            members.sort()
+            if kind == 'files':
+                prefix = options.get('seqno_prefix') or ''
+                for iframe, (name, outfile, date_index, exptime) \
+                        in enumerate(members):
+                    if outfile is not None:
+                        self._stream_rename(outfile, prefix + '%03i' % iframe)
+                continue
+            if kind == 'trap':
+                # As trap, keep the file whose OBJECT takes precedence,
+                # and of those with the same OBJECT, the last one.
+                kept = dict()
+                for name, outfile, date_index, obj in members:
+                    if outfile is None:
+                        continue
+                    image_type, seqno = self.trap_image_types[obj]
+                    rank = (self.trap_precedence.index(obj)
+                            if obj in self.trap_precedence else 0)
+                    previous = kept.get((image_type, seqno))
+                    if previous is not None and previous[0] < rank:
+                        self._stream_remove(outfile)
+                        dropped.add(date_index)
+                        continue
+                    if previous is not None:
+                        self._stream_remove(previous[1])
+                        dropped.add(previous[2])
+                    kept[(image_type, seqno)] = (rank, outfile, date_index)
+                for (image_type, seqno), (rank, outfile, date_index) \
+                        in kept.items():
+                    self._stream_rename(outfile, seqno)
+                continue
+            # Keep the first two files in each exptime group as flat1
+            # and flat2, and groups with only one frame not at all.
+            groups = dict()
+            for name, outfile, date_index, exptime in members:
+                if outfile is not None:
+                    groups.setdefault(exptime, []).append((outfile,
+                                                           date_index))
+            for exptime, outfiles in groups.items():
+                keep = outfiles[:2] if len(outfiles) > 1 else []
+                for suffix, (outfile, date_index) in zip(('flat1', 'flat2'),
+                                                         keep):
+                    self._stream_rename(outfile,
+                                        '%09.4f_%s' % (exptime, suffix))
+                for outfile, date_index in outfiles[len(keep):]:
+                    self._stream_remove(outfile)
+                    dropped.add(date_index)
+        self.obs_dates = [x for i, x in enumerate(self.obs_dates)
+                          if i not in dropped]
+        self._stream = None
+        return self.outfiles
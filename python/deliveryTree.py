@@ -0,0 +1,103 @@
+"""
+Index of the directory tree of a vendor delivery, built by a single
+walk of the tree, to locate files by name instead of running find for
+each lookup.
+"""
+from __future__ import absolute_import, print_function
+import os
+import fnmatch
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__all__ = ['DeliveryTree']
+
+def _listdir(path):
+    """
+    Return the (name, is_dir) pairs of the entries of a directory, not
+    following symbolic links, as find does.
+    """
+    if scandir is not None:
+        return [(entry.name, entry.is_dir(follow_symlinks=False))
+                for entry in scandir(path)]
+    entries = []
+    for name in os.listdir(path):
+        entries.append((name, os.path.isdir(os.path.join(path, name))
+                        and not os.path.islink(os.path.join(path, name))))
+    return entries
+
+class DeliveryTree(object):
+    """
+    Paths of the files and directories below rootdir, in the form
+    find prints them, i.e., os.path.join(rootdir, <relative path>).
+    The tree is read when the object is created, so it does not see
+    later changes; the stat data of the files are cached as they are
+    requested.
+    """
+    def __init__(self, rootdir):
+        """
+        Constructor.
+        rootdir = Top level directory of the delivery
+        """
+        self.rootdir = rootdir
+        self.paths = []
+        self._names = []
+        self._suffixes = {}
+        self._stats = {}
+        directories = [rootdir]
+        while directories:
+            directory = directories.pop()
+            try:
+                entries = sorted(_listdir(directory))
+            except OSError:
+                continue
+            subdirs = []
+            for name, is_dir in entries:
+                path = os.path.join(directory, name)
+                self.paths.append(path)
+                self._names.append(name)
+                if is_dir:
+                    subdirs.append(path)
+                else:
+                    suffix = os.path.splitext(name)[1]
+                    self._suffixes.setdefault(suffix, []).append(path)
+            directories.extend(reversed(subdirs))
+
+    def find(self, pattern):
+        """
+        Return the paths whose basename matches the shell-style
+        pattern, as for find -name.
+        """
+        return [path for path, name in zip(self.paths, self._names)
+                if fnmatch.fnmatchcase(name, pattern)]
+
+    def glob(self, pattern):
+        """
+        Return the paths whose path relative to rootdir matches the
+        shell-style pattern, component by component, as for glob.
+        """
+        components = pattern.split('/')
+        matches = []
+        for path in self.paths:
+            relpath = os.path.relpath(path, self.rootdir).split(os.sep)
+            if len(relpath) == len(components) and \
+               all(fnmatch.fnmatchcase(x, y)
+                   for x, y in zip(relpath, components)):
+                matches.append(path)
+        return matches
+
+    def with_suffix(self, suffix):
+        "Return the paths of the files with the extension suffix, e.g., '.txt'."
+        return list(self._suffixes.get(suffix, []))
+
+    def stat(self, path):
+        "Return the os.stat of a file of the tree, cached."
+        try:
+            return self._stats[path]
+        except KeyError:
+            self._stats[path] = os.stat(path)
+            return self._stats[path]
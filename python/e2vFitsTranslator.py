@@ -14,16 +14,45 @@ class e2vFitsTranslator(VendorFitsTranslator):
     """
     FITS Translator for e2v data based on their delta TRR package.
     """
-    def __init__(self, lsst_num, rootdir, outputBaseDir='.'):
+    stream_rules = (('*_xray_xray_*.fits', 'files', 'fe55', 'fe55', {}),
+                    ('*_noims_nois_*.fits', 'files', 'fe55', 'bias', {}),
+                    ('*_dark_dark_*.fits', 'files', 'dark', 'dark', {}),
+                    ('*_trapspp_cycl*.fits', 'files', 'trap', 'ppump', {}),
+                    ('*_sflath_illu_*.fits', 'files', 'sflat_500', 'flat',
+                     dict(seqno_prefix='H')),
+                    ('*_sflatl_illu_*.fits', 'files', 'sflat_500', 'flat',
+                     dict(seqno_prefix='L')),
+                    ('*_xtalk_illu_*.fits', 'files', 'spot', 'spot', {}),
+                    ('*_ifwm_illu_*.fits', 'exptime', 'flat', 'flat', {}),
+                    ('*_flat_*_illu_*.fits', 'lambda', 'lambda', 'flat',
+                     dict(monowl_keyword='WAVELEN')))
+
+    # e2v has added extensions that are improperly formatted after
+    # the image extension for the 16th segment.  We don't use those
+    # extensions so omit them to avoid write errors.
+    num_hdus = 17
+
+    def __init__(self, lsst_num, rootdir, outputBaseDir='.',
+                 header_index=None, manifest=None, tree=None,
+                 archon_keywords=None):
         """
         Constructor.
         lsst_num = LSST-assigned ID number. (LSST_NUM in FITS headers).
         rootdir = Top level directory containing the vendor files
         outputBaseDir = Directory where translated files (within
                         their subfolders)will be written.
+        header_index = [optional] HeaderIndex of the vendor files
+        manifest = [optional] TranslationManifest of earlier translations
+        tree = [optional] DeliveryTree of rootdir
+        archon_keywords = [optional] keywords of the ARCHON extension to
+                          copy to the primary header of the translated
+                          files, e.g., the SYS_N# system noise values
         """
         super(e2vFitsTranslator, self).__init__(lsst_num, rootdir,
-                                                outputBaseDir)
+                                                outputBaseDir,
+                                                header_index=header_index,
+                                                manifest=manifest, tree=tree)
+        self.archon_keywords = archon_keywords
 
     def _extract_date_obs(self, hdulist):
         """
@@ -41,7 +70,8 @@ class e2vFitsTranslator(VendorFitsTranslator):
         files for analysis with the eotest package.
         """
         try:
-            hdulist = fits.open(infile)
+            vendor_hdus = fits.open(infile)
+            hdulist = vendor_hdus[:self.num_hdus]
         except IOError, eobj:
             print(eobj)
             print("skipping")
@@ -77,10 +107,19 @@ class e2vFitsTranslator(VendorFitsTranslator):
         hdulist[0].header['TESTTYPE'] = test_type.upper()
         hdulist[0].header['IMGTYPE'] = image_type.upper()
         self._set_amp_geom(hdulist)
-        # e2v has added extensions that are improperly formatted after
-        # the image extension for the 16th segment.  We don't use
-        # those extensions so omit them to avoid write errors.
-        self._write_file(hdulist[:17], locals(), verbose=verbose)
+        if self.archon_keywords:
+            self._copy_archon_keywords(vendor_hdus, hdulist[0].header)
+        self._write_file(hdulist, locals(), verbose=verbose)
+
+    def _copy_archon_keywords(self, vendor_hdus, header):
+        "Copy the requested keywords of the ARCHON extension to header."
+        try:
+            archon = vendor_hdus['ARCHON'].header
+        except (KeyError, IndexError):
+            return
+        for keyword in self.archon_keywords:
+            if keyword in archon:
+                header[keyword] = archon[keyword]
 
     def fe55(self, pattern='*_xray_xray_*.fits', time_stamp=None,
              verbose=True):
@@ -131,12 +170,12 @@ class e2vFitsTranslator(VendorFitsTranslator):
         "Process flat pair data set for full well and ptc analyses."
         if time_stamp is None:
             time_stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        exptime = lambda x: fits.open(x)[0].header['EXPOSURE']
         infiles = self._infiles(pattern)
-        for infile in infiles:
+        headers = self.header_index.headers(infiles)
+        for infile, header in zip(infiles, headers):
             if verbose:
                 print("processing", os.path.basename(infile))
-            seqno = '%03i_flat1' % exptime(infile)
+            seqno = '%03i_flat1' % header['EXPOSURE']
             self.translate(infile, 'flat', 'flat', seqno, time_stamp=time_stamp,
                            verbose=verbose)
         return time_stamp
@@ -149,7 +188,7 @@ class e2vFitsTranslator(VendorFitsTranslator):
                                                           verbose=verbose,
                                                           monowl_keyword='WAVELEN')
 
-    def run_all(self):
+    def _datasets(self):
         "Run all of the methods for each test type"
         time_stamp = self.fe55()
         self.bias(time_stamp=time_stamp)
@@ -0,0 +1,141 @@
+"""
+Index of the primary header keywords of vendor FITS files used by the
+FITS translators to select and group files.
+"""
+from __future__ import absolute_import, print_function
+import os
+import gzip
+import json
+import fnmatch
+import multiprocessing
+import astropy.io.fits as fits
+
+__all__ = ['read_header', 'HeaderIndex']
+
+_block_size = 2880
+_card_size = 80
+
+def read_header(infile, keywords=None):
+    """
+    Return a dict of the values of keywords (default:
+    HeaderIndex.keywords) in the primary header of a FITS file, given
+    by its path or a file object, reading only the header blocks.
+    Keywords that are missing or have invalid values are omitted.
+    """
+    if keywords is None:
+        keywords = HeaderIndex.keywords
+    if hasattr(infile, 'read'):
+        return _parse_header(infile, keywords)
+    opener = gzip.open if infile.endswith('.gz') else open
+    with opener(infile, 'rb') as fd:
+        return _parse_header(fd, keywords)
+
+def _parse_header(fd, keywords):
+    blocks = []
+    while True:
+        block = fd.read(_block_size)
+        if len(block) < _block_size:
+            raise IOError('Truncated FITS header in %s'
+                          % getattr(fd, 'name', 'file object'))
+        blocks.append(block)
+        if any(block[i:i + 8] == b'END     '
+               for i in range(0, _block_size, _card_size)):
+            break
+    header = fits.Header.fromstring(b''.join(blocks).decode('ascii'))
+    values = {}
+    for keyword in keywords:
+        try:
+            value = header[keyword]
+        except (KeyError, fits.verify.VerifyError, ValueError):
+            continue
+        if isinstance(value, (bool, int, float, str, type(u''))):
+            values[keyword] = value
+    return values
+
+def _scan_file(path):
+    "Pool worker: return path, its size and mtime, and its keywords."
+    status = os.stat(path)
+    return path, status.st_size, status.st_mtime, read_header(path)
+
+class HeaderIndex(object):
+    """
+    Keywords of the primary headers of FITS files, read by a parallel,
+    header-only scan and kept, if a filename is given, in a JSON file so
+    that the scan of a delivery is done once.  Entries are keyed by real
+    path and are rescanned if the size or mtime of the file changes.
+    """
+    keywords = ('EXPTIME', 'EXPOSURE', 'OBJECT', 'MONOWL', 'WAVELEN',
+                'DATE-OBS', 'TIME-OBS')
+
+    def __init__(self, filename=None, processes=None):
+        """
+        Constructor.
+        filename = [optional] JSON file in which the index is kept
+        processes = number of processes of the scan (None = all cores)
+        """
+        self.filename = filename
+        self.processes = processes
+        self.entries = {}
+        if filename is not None and os.path.isfile(filename):
+            with open(filename) as fd:
+                self.entries = json.load(fd)
+
+    def _current(self, path):
+        "Return the entry of path if it is up to date, otherwise None."
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        status = os.stat(path)
+        if entry['size'] != status.st_size or entry['mtime'] != status.st_mtime:
+            return None
+        return entry
+
+    def scan(self, infiles):
+        "Read the headers of the files not yet in the index, in parallel."
+        paths = [os.path.realpath(x) for x in infiles]
+        missing = sorted(set(x for x in paths if self._current(x) is None))
+        if not missing:
+            return
+        processes = self.processes or multiprocessing.cpu_count()
+        processes = min(processes, len(missing))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_scan_file, missing,
+                                   chunksize=max(1, len(missing)//(4*processes)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_scan_file(x) for x in missing]
+        for path, size, mtime, values in results:
+            self.entries[path] = dict(size=size, mtime=mtime, keywords=values)
+        if self.filename is not None:
+            self.write()
+
+    def scan_tree(self, rootdir, pattern='*.fits'):
+        "Scan all files matching pattern below rootdir."
+        infiles = []
+        for root, dirs, files in os.walk(rootdir, followlinks=True):
+            infiles.extend(os.path.join(root, x)
+                           for x in fnmatch.filter(files, pattern))
+        self.scan(infiles)
+
+    def headers(self, infiles):
+        "Return the dicts of keywords of the files, scanning them if needed."
+        self.scan(infiles)
+        return [self.entries[os.path.realpath(x)]['keywords'] for x in infiles]
+
+    def header(self, infile):
+        "Return the dict of keywords of a file."
+        return self.headers([infile])[0]
+
+    def write(self):
+        "Write the index to its file, if possible."
+        tmpfile = self.filename + '.tmp'
+        try:
+            with open(tmpfile, 'w') as output:
+                json.dump(self.entries, output)
+            os.rename(tmpfile, self.filename)
+        except (IOError, OSError) as eobj:
+            print('Unable to write the FITS header index:', eobj)
@@ -0,0 +1,123 @@
+"""
+Header-only passthrough writing of translated FITS files: the headers
+are rewritten and the data units copied byte for byte from the vendor
+file, with the CHECKSUM and DATASUM cards computed incrementally from
+the raw bytes.
+"""
+from __future__ import absolute_import, print_function
+import datetime
+import hashlib
+import itertools
+import numpy as np
+import astropy.io.fits as fits
+
+__all__ = ['write_passthrough', 'ones_complement_sum', 'encode_checksum']
+
+_block_size = 2880
+_chunk_size = 1000*_block_size
+_exclude = (0x3a, 0x3b, 0x3c, 0x3d, 0x3e, 0x3f, 0x40,
+            0x5b, 0x5c, 0x5d, 0x5e, 0x5f, 0x60)
+
+def ones_complement_sum(data, value=0):
+    """
+    Add the 32-bit big-endian words of data, whose length must be a
+    multiple of 4 bytes, to the 32-bit ones' complement sum value.
+    """
+    words = np.frombuffer(data, dtype='>u4')
+    value += int(words.sum(dtype=np.uint64))
+    while value >> 32:
+        value = (value & 0xffffffff) + (value >> 32)
+    return value
+
+def _encode_byte(byte):
+    quotient = byte//4 + ord('0')
+    chars = [quotient + byte % 4, quotient, quotient, quotient]
+    check = True
+    while check:
+        check = False
+        for excluded in _exclude:
+            for j in (0, 2):
+                if chars[j] == excluded or chars[j + 1] == excluded:
+                    chars[j] += 1
+                    chars[j + 1] -= 1
+                    check = True
+    return chars
+
+def encode_checksum(value):
+    """
+    Return the 16 character ASCII encoding of the complement of the
+    checksum value, as stored in the CHECKSUM card.
+    """
+    value = ~value & 0xffffffff
+    asc = [0]*16
+    for i in range(4):
+        chars = _encode_byte((value >> (8*(3 - i))) & 0xff)
+        for j in range(4):
+            asc[4*j + i] = chars[j]
+    return ''.join(chr(asc[(i + 15) % 16]) for i in range(16))
+
+def _passthrough_possible(hdulist):
+    "Return True if the data units of hdulist can be copied verbatim."
+    for hdu in hdulist:
+        if (getattr(hdu, '_file', None) is None or hdu._data_loaded
+                or hdu._data_offset is None):
+            return False
+    return True
+
+def _data_chunks(hdu):
+    "Yield the padded data unit of hdu, read from its file in chunks."
+    fileobj = hdu._file
+    fileobj.seek(hdu._data_offset)
+    remaining = hdu._data_size
+    nbytes = 0
+    while remaining > 0:
+        chunk = fileobj.read(min(remaining, _chunk_size))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        nbytes += len(chunk)
+        yield chunk
+    # Pad the data unit if the vendor file is missing its padding.
+    padding = -nbytes % _block_size
+    if padding:
+        yield b'\0'*padding
+
+def write_passthrough(hdulist, outfile, output_verify='fix'):
+    """
+    Write hdulist, as opened from a vendor file and with only its
+    non-structural header keywords changed, to outfile with the
+    CHECKSUM and DATASUM cards set, and return the size and md5
+    hexdigest of the file written.  If any data have been loaded or
+    modified, the file is written by HDUList.writeto instead, and None
+    is returned.
+    """
+    if not _passthrough_possible(hdulist):
+        hdulist.writeto(outfile, checksum=True, output_verify=output_verify)
+        return None
+    hdulist.verify(option=output_verify)
+    hdulist.update_extend()
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    md5 = hashlib.md5()
+    nbytes = 0
+    with open(outfile, 'wb') as output:
+        for hdu in hdulist:
+            # The data unit is read twice, to compute DATASUM, which
+            # precedes it in the file, then to copy it.
+            datasum = 0
+            for chunk in _data_chunks(hdu):
+                datasum = ones_complement_sum(chunk, datasum)
+            header = hdu.header
+            header.set('DATASUM', str(datasum),
+                       'data unit checksum updated %s' % timestamp)
+            header.set('CHECKSUM', '0'*16,
+                       'HDU checksum updated %s' % timestamp,
+                       before='DATASUM')
+            checksum = ones_complement_sum(
+                header.tostring().encode('ascii'), datasum)
+            header['CHECKSUM'] = encode_checksum(checksum)
+            for chunk in itertools.chain([header.tostring().encode('ascii')],
+                                         _data_chunks(hdu)):
+                output.write(chunk)
+                md5.update(chunk)
+                nbytes += len(chunk)
+    return nbytes, md5.hexdigest()
@@ -0,0 +1,145 @@
+"""
+Manifest of the FITS files written by the vendor FITS translators, used
+to reuse the outputs of an earlier translation of unchanged vendor
+files, e.g., when the validator is rerun after a failure.
+"""
+from __future__ import absolute_import, print_function
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+
+__all__ = ['TranslationManifest', 'code_version', 'file_digest']
+
+_chunk_size = 1024*1024
+
+def file_digest(path):
+    "Return the md5 hexdigest of a file."
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fd:
+        while True:
+            data = fd.read(_chunk_size)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+def code_version(cls, *modules):
+    """
+    Return a digest of the source code of the modules defining cls and
+    its base classes, and of the other modules given, which identifies
+    the version of a translator.
+    """
+    md5 = hashlib.md5()
+    names = set()
+    sources = [inspect.getmodule(x) for x in inspect.getmro(cls)
+               if x is not object] + list(modules)
+    for module in sources:
+        if module.__name__ in names:
+            continue
+        names.add(module.__name__)
+        try:
+            source = inspect.getsource(module)
+        except (IOError, TypeError):
+            source = module.__name__
+        md5.update(source.encode('utf-8'))
+    return md5.hexdigest()
+
+def _fingerprint(path):
+    status = os.stat(path)
+    return [status.st_size, status.st_mtime]
+
+class TranslationManifest(object):
+    """
+    Outputs of the translation of vendor files, kept in a JSON file.
+    An entry is keyed by the real path of the vendor file and the
+    output name (LSST_NUM, test type, image type and seqno), and holds
+    the size and mtime of the vendor file, the translator version, and
+    the path, size, mtime and md5 digest of the output.  It is reused if
+    all of these are unchanged, unless force is set.
+    """
+    def __init__(self, filename, version, force=False):
+        """
+        Constructor.
+        filename = JSON file in which the manifest is kept
+        version = version of the translator (see code_version)
+        force = if True, translate all files again
+        """
+        self.filename = filename
+        self.version = version
+        self.force = force
+        self.entries = {}
+        self._written = time.time()
+        if os.path.isfile(filename):
+            with open(filename) as fd:
+                self.entries = json.load(fd)
+
+    @staticmethod
+    def _key(infile, name):
+        return '%s:%s' % (os.path.realpath(infile), '_'.join(name))
+
+    def lookup(self, infile, name):
+        """
+        Return the entry of the output of infile for name, if it can
+        be reused, otherwise None.
+        """
+        if self.force:
+            return None
+        entry = self.entries.get(self._key(infile, name))
+        if (entry is None or entry['version'] != self.version
+                or entry['source'] != _fingerprint(infile)):
+            return None
+        try:
+            if _fingerprint(entry['outfile']) != entry['output']:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def reuse(self, entry, outfile):
+        """
+        Link, or copy if that fails, the output of entry to outfile,
+        unless it is that file.
+        """
+        if os.path.realpath(entry['outfile']) == os.path.realpath(outfile):
+            return
+        if os.path.lexists(outfile):
+            os.remove(outfile)
+        try:
+            os.link(entry['outfile'], outfile)
+        except OSError:
+            shutil.copy2(entry['outfile'], outfile)
+
+    def record(self, infile, name, outfile, digest=None):
+        """
+        Record outfile as the output of infile for name, computing its
+        md5 digest if it is not given.
+        """
+        if digest is None:
+            digest = file_digest(outfile)
+        self.entries[self._key(infile, name)] = dict(
+            source=_fingerprint(infile), version=self.version,
+            outfile=os.path.abspath(outfile), output=_fingerprint(outfile),
+            digest=digest)
+
+    def checkpoint(self, interval=60.):
+        """
+        Write the manifest if it was last written more than interval
+        seconds ago, so that little is lost if the translation is
+        killed.
+        """
+        if time.time() - self._written >= interval:
+            self.write()
+
+    def write(self):
+        "Write the manifest to its file, if possible."
+        self._written = time.time()
+        tmpfile = self.filename + '.tmp'
+        try:
+            with open(tmpfile, 'w') as output:
+                json.dump(self.entries, output)
+            os.rename(tmpfile, self.filename)
+        except (IOError, OSError) as eobj:
+            print('Unable to write the translation manifest:', eobj)
@@ -0,0 +1,56 @@
+"""
+Unit tests for the deliveryTree module.
+"""
+from __future__ import print_function, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from deliveryTree import DeliveryTree
+
+class DeliveryTreeTestCase(unittest.TestCase):
+    "TestCase class for the index of a delivery directory tree."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = ['ID068_SN20862/qe.txt',
+                      'ID068_SN20862/superflat1/ID068_superflat.001.fits',
+                      'ID068_SN20862/superflat1/ID068_superflat.002.fits',
+                      'metrology/ID068_SN20862_Z_Inspect_1.txt',
+                      'metrology/notes.TXT']
+        for item in self.files:
+            path = os.path.join(self.tmpdir, item)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as output:
+                output.write(item)
+        # find does not follow symbolic links to directories.
+        os.symlink(os.path.join(self.tmpdir, 'metrology'),
+                   os.path.join(self.tmpdir, 'ID068_SN20862', 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, item):
+        return os.path.join(self.tmpdir, item)
+
+    def test_find(self):
+        "Test the lookups by basename, as for find -name."
+        tree = DeliveryTree(self.tmpdir)
+        self.assertEqual(tree.find('superflat1'),
+                         [self._path('ID068_SN20862/superflat1')])
+        self.assertEqual(tree.find('*.txt'),
+                         [self._path(self.files[0]), self._path(self.files[3])])
+        self.assertEqual(tree.find('*CT100*.csv'), [])
+
+    def test_glob_and_suffix(self):
+        "Test the lookups by relative path and by extension."
+        tree = DeliveryTree(self.tmpdir)
+        self.assertEqual(tree.glob('*/superflat1/*superflat.*.fits'),
+                         [self._path(x) for x in self.files[1:3]])
+        self.assertEqual(tree.with_suffix('.txt'),
+                         [self._path(self.files[0]), self._path(self.files[3])])
+        self.assertEqual(tree.stat(self._path(self.files[0])).st_size,
+                         len(self.files[0]))
+
+if __name__ == '__main__':
+    unittest.main()
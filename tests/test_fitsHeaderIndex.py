@@ -0,0 +1,62 @@
+"""
+Unit tests for the fitsHeaderIndex module.
+"""
+from __future__ import print_function, absolute_import
+import os
+import io
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import astropy.io.fits as fits
+from fitsHeaderIndex import HeaderIndex, read_header
+
+class HeaderIndexTestCase(unittest.TestCase):
+    "TestCase class for the header-only scan of FITS files."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(4):
+            hdulist = fits.HDUList([fits.PrimaryHDU()])
+            hdulist[0].header['EXPTIME'] = 0.5*i
+            hdulist[0].header['OBJECT'] = 'pocket pump %i' % i
+            hdulist[0].header['DATE-OBS'] = '2017-02-10'
+            for card in range(40):
+                # Fill more than one header block.
+                hdulist[0].header['KEY%i' % card] = card
+            hdulist.append(fits.ImageHDU(np.zeros((10, 10), dtype=np.int16)))
+            filename = os.path.join(self.tmpdir, 'file_%i.fits' % i)
+            hdulist.writeto(filename)
+            self.files.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_header(self):
+        "Test that only the requested, present keywords are read."
+        header = read_header(self.files[3])
+        self.assertEqual(header, {'EXPTIME': 1.5, 'OBJECT': 'pocket pump 3',
+                                  'DATE-OBS': '2017-02-10'})
+        with open(self.files[1], 'rb') as fd:
+            fileobj = io.BytesIO(fd.read())
+        self.assertEqual(read_header(fileobj, keywords=('KEY39',)),
+                         {'KEY39': 39})
+
+    def test_index(self):
+        "Test the parallel scan, the index file and rescans of changed files."
+        index_file = os.path.join(self.tmpdir, 'index.json')
+        index = HeaderIndex(index_file, processes=2)
+        index.scan_tree(self.tmpdir)
+        self.assertEqual(len(index.entries), 4)
+        index = HeaderIndex(index_file, processes=2)
+        self.assertEqual([x['EXPTIME'] for x in index.headers(self.files)],
+                         [0, 0.5, 1., 1.5])
+        with fits.open(self.files[0], mode='update') as hdulist:
+            hdulist[0].header['EXPTIME'] = 10.
+        status = os.stat(self.files[0])
+        os.utime(self.files[0], (status.st_atime, time.time() + 10))
+        self.assertEqual(index.header(self.files[0])['EXPTIME'], 10.)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Unit tests for the fitsPassthrough module.
+"""
+from __future__ import print_function, absolute_import
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import astropy.io.fits as fits
+from fitsPassthrough import write_passthrough
+from translationManifest import file_digest
+
+class PassthroughTestCase(unittest.TestCase):
+    "TestCase class for the passthrough writing of FITS files."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'vendor.fits')
+        hdulist = fits.HDUList([fits.PrimaryHDU()])
+        for amp in range(2):
+            # BZERO-scaled unsigned data
+            data = np.arange(1000, dtype=np.uint16).reshape(10, 100) + 40000
+            hdulist.append(fits.ImageHDU(data + amp))
+        hdulist.writeto(self.infile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _translated(self, infile):
+        hdulist = fits.open(infile)
+        hdulist[0].header['LSST_NUM'] = '000-00'
+        for amp in range(1, 3):
+            hdulist[amp].header['AMPNO'] = amp
+        return hdulist
+
+    def test_write_passthrough(self):
+        "Test that the output matches the one written by astropy."
+        outfile = os.path.join(self.tmpdir, 'passthrough.fits')
+        reffile = os.path.join(self.tmpdir, 'astropy.fits')
+        size, digest = write_passthrough(self._translated(self.infile), outfile)
+        self.assertEqual(size, os.path.getsize(outfile))
+        self.assertEqual(digest, file_digest(outfile))
+        self._translated(self.infile).writeto(reffile, checksum=True,
+                                              output_verify='fix')
+        output = fits.open(outfile, checksum=True)
+        reference = fits.open(reffile)
+        for hdu, ref_hdu in zip(output, reference):
+            self.assertEqual(hdu.header['DATASUM'], ref_hdu.header['DATASUM'])
+            if hdu.data is not None:
+                self.assertEqual(hdu.data.dtype, np.uint16)
+                np.testing.assert_array_equal(hdu.data, ref_hdu.data)
+        self.assertEqual(output[0].header['LSST_NUM'], '000-00')
+        self.assertEqual(output[2].header['AMPNO'], 2)
+
+    def test_file_object(self):
+        "Test the passthrough writing of a file read into memory."
+        outfile = os.path.join(self.tmpdir, 'passthrough.fits')
+        with open(self.infile, 'rb') as fd:
+            fileobj = io.BytesIO(fd.read())
+        write_passthrough(self._translated(fileobj), outfile)
+        output = fits.open(outfile, checksum=True)
+        self.assertEqual(len(output), 3)
+        np.testing.assert_array_equal(output[1].data,
+                                      fits.getdata(self.infile, 1))
+
+    def test_loaded_data(self):
+        "Test that modified data are written by astropy."
+        outfile = os.path.join(self.tmpdir, 'passthrough.fits')
+        hdulist = self._translated(self.infile)
+        hdulist[1].data[0, 0] = 1
+        self.assertEqual(write_passthrough(hdulist, outfile), None)
+        output = fits.open(outfile, checksum=True)
+        self.assertEqual(output[1].data[0, 0], 1)
+
+if __name__ == '__main__':
+    unittest.main()
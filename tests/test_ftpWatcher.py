@@ -0,0 +1,139 @@
+"""
+Unit tests for the ftpWatcher module.
+"""
+from __future__ import print_function, absolute_import
+import os
+import sys
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.environ['OFFLINEJOBSDIR'], 'harnessed_jobs',
+                                'vendorIngest', 'v0'))
+import ftpWatcher
+import ingestManifest
+
+class FtpWatcherTestCase(unittest.TestCase):
+    "TestCase class for the detection and pre-staging of deliveries."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lcaroot = os.path.join(self.tmpdir, 'lca')
+        self.LSSTID = 'ITL-3800C-000'
+        ftpdir = os.path.join(self.lcaroot, 'vendorData', 'FTP', 'ITL')
+        self.deliverydir = os.path.join(ftpdir, 'delivery', '20260101')
+        os.makedirs(self.deliverydir)
+        srcdir = os.path.join(self.tmpdir, 'src', 'fe55')
+        os.makedirs(srcdir)
+        for i in range(3):
+            with open(os.path.join(srcdir, 'file_%i.txt' % i), 'w') as output:
+                output.write('%i\n' % i)
+        self.tarball = os.path.join(self.deliverydir,
+                                    self.LSSTID + '.tar.bz2')
+        with tarfile.open(self.tarball, 'w:bz2') as tar:
+            tar.add(srcdir, arcname='fe55')
+        with open(self.tarball, 'rb') as fd:
+            self.md5 = hashlib.md5(fd.read()).hexdigest()
+        self.write_md5(self.md5)
+        os.symlink(self.deliverydir, os.path.join(ftpdir, self.LSSTID))
+        self.state_file = os.path.join(self.tmpdir, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_md5(self, md5):
+        md5file = self.tarball + '.md5'
+        with open(md5file + '.tmp', 'w') as output:
+            output.write('%s  %s\n' % (md5, os.path.basename(self.tarball)))
+        os.rename(md5file + '.tmp', md5file)
+
+    def watcher(self):
+        return ftpWatcher.FtpWatcher(self.lcaroot, self.state_file,
+                                     vendors=('ITL',), eTmode='Dev',
+                                     stable_polls=1, processes=1,
+                                     verbose=False)
+
+    def test_delivery_files(self):
+        "Test the recognition of the delivered files."
+        files = ftpWatcher.delivery_files(
+            ['ITL-3800C-000.tar.bz2', 'ITL-3800C-000.tar.bz2.md5',
+             'metrology.tar.gz', 'metrology.tar.gz.md5sum', 'README'],
+            self.LSSTID)
+        self.assertEqual(files, dict(datafile='ITL-3800C-000.tar.bz2',
+                                     md5file='ITL-3800C-000.tar.bz2.md5',
+                                     metrologyDatafile='metrology.tar.gz',
+                                     metrologyMd5file='metrology.tar.gz.md5sum'))
+
+    def test_prestage(self):
+        "Test that a stable delivery is staged once, for the producer."
+        watcher = self.watcher()
+        self.assertEqual(watcher.poll(), [])      # sizes not yet known
+        self.assertEqual(watcher.poll(), [self.LSSTID])
+        entry = watcher.state['deliveries'][self.LSSTID]
+        self.assertEqual(entry['status'], 'staged')
+        self.assertEqual(os.path.basename(entry['vendorDir']),
+                         'staged-20260101')
+        self.assertTrue(os.path.isfile(os.path.join(entry['vendorDir'],
+                                                    'fe55', 'file_2.txt')))
+        self.assertTrue(os.path.isfile(entry['vendorDir'] + '.' +
+                                       os.path.basename(self.tarball) +
+                                       '.index'))
+        manifest = ingestManifest.find_resumable(
+            os.path.dirname(entry['vendorDir']),
+            {os.path.basename(self.tarball): self.md5.upper()})
+        self.assertNotEqual(manifest, None)
+        self.assertTrue(manifest.info['staged'])
+        self.assertTrue(manifest.is_extracted(os.path.basename(self.tarball),
+                                              self.md5.upper()))
+        manifest.close()
+
+        # A restarted watcher does not stage the delivery again.
+        self.assertEqual(self.watcher().poll(), [])
+
+    def test_checksum_error(self):
+        "Test that a failed delivery is retried once it is replaced."
+        self.write_md5('0'*32)
+        watcher = self.watcher()
+        watcher.poll()
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.state['deliveries'][self.LSSTID]['status'],
+                         'failed')
+        self.assertEqual(watcher.poll(), [])
+        self.write_md5(self.md5)
+        os.utime(self.deliverydir, (0, 0))
+        watcher.poll()
+        self.assertEqual(watcher.poll(), [self.LSSTID])
+
+    def test_locked_manifest(self):
+        "Test that a delivery is not staged while its ingest is running."
+        parent = os.path.join(self.lcaroot, 'vendorData', 'ITL', self.LSSTID,
+                              'Dev')
+        os.makedirs(os.path.join(parent, '1234'))
+        tarballs = {os.path.basename(self.tarball): self.md5.upper()}
+        producer = ingestManifest.IngestManifest(
+            os.path.join(parent, '1234.manifest'))
+        producer.set_info(vendorDir=os.path.join(parent, '1234'),
+                          tarballs=tarballs)
+        self.assertRaises(ingestManifest.ManifestLocked,
+                          ingestManifest.IngestManifest, producer.filename,
+                          wait=False)
+        self.assertEqual(ingestManifest.find_resumable(parent, tarballs,
+                                                       wait=False), None)
+        watcher = self.watcher()
+        watcher.poll()
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.state['deliveries'][self.LSSTID]['status'],
+                         'busy')
+        self.assertEqual(sorted(os.listdir(parent)), ['1234', '1234.manifest'])
+
+        # Once the lock is released, the ingest can be resumed.
+        producer.close()
+        self.assertEqual(ingestManifest.locked_manifests(parent), [])
+        manifest = ingestManifest.find_resumable(parent, tarballs, wait=False)
+        self.assertEqual(manifest.filename, producer.filename)
+        self.assertEqual(ingestManifest.locked_manifests(parent),
+                         [producer.filename])
+        manifest.close()
+
+if __name__ == '__main__':
+    unittest.main()
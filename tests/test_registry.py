@@ -0,0 +1,188 @@
+"""
+Unit tests for the dataCatalog registry wrapper, using the localDatacat
+stand-in for the dataCatalog.
+"""
+from __future__ import print_function, absolute_import
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.environ['OFFLINEJOBSDIR'], 'harnessed_jobs',
+                                'vendorIngest', 'v0'))
+import registry
+import localDatacat
+import ingestManifest
+import vendorRegistration
+
+def make_registry(catalog, **kwds):
+    "Quiet registry using LocalDatacat clients of catalog."
+    myDC = registry.registry()
+    myDC.quiet = True
+    myDC.clientFactory = lambda: localDatacat.LocalDatacat(catalog, **kwds)
+    return myDC
+
+class RegistryTestCase(unittest.TestCase):
+    "TestCase class for registry.register and register_many."
+    def setUp(self):
+        self.catalog = localDatacat.LocalCatalog()
+        self.folder = '/LSST/vendorData/ITL/ITL-3800C-000/Dev/1000'
+        self.site = 'slac.lca.archive'
+
+    def records(self, nfiles, site=None, digest='0'):
+        return [('/data/file_%02i.fits' % i, self.folder, site or self.site,
+                 'fits', 'LSSTVENDORDATA',
+                 {'contentFingerprint': registry.fingerprint(i, digest)})
+                for i in range(nfiles)]
+
+    def test_register(self):
+        "Test fresh registration, recrawl and addition of a location."
+        myDC = make_registry(self.catalog)
+        fn, folder, site, fType, dType, metaData = self.records(1)[0]
+        self.assertTrue(myDC.register(fn, folder, site, fType, dType))
+        self.assertEqual(myDC.numNewFolders, 1)
+        self.assertEqual(myDC.numRegistered, 1)
+        self.assertTrue(myDC.register(fn, folder, site, fType, dType))
+        self.assertEqual(myDC.numReCrawl, 1)
+        self.assertTrue(myDC.register(fn, folder, 'BNL', fType, dType))
+        self.assertEqual(myDC.numAddLocs, 1)
+        ds = self.catalog.datasets[os.path.join(folder, 'file_00.fits')]
+        self.assertEqual(sorted(x.site for x in ds._locations),
+                         ['BNL', self.site])
+
+    def test_add_location_recrawl(self):
+        "Test that a location added to a multi-site dataset is recrawled."
+        myDC = make_registry(self.catalog)
+        fn, folder, site, fType, dType, metaData = self.records(1)[0]
+        self.assertTrue(myDC.register(fn, folder, 'BNL', fType, dType,
+                                      metaData))
+        self.assertTrue(myDC.register(fn, folder, 'NCSA', fType, dType,
+                                      metaData))
+        ds = self.catalog.datasets[os.path.join(folder, 'file_00.fits')]
+        for location in ds._locations:
+            location.scanStatus = 'OK'
+        self.catalog.calls.clear()
+        self.assertTrue(myDC.register(fn, folder, site, fType, dType,
+                                      metaData))
+        self.assertEqual(myDC.numAddLocs, 2)
+        self.assertEqual(myDC.numReCrawl, 1)
+        self.assertEqual(myDC.numSkippedReCrawl, 0)
+        self.assertEqual(self.catalog.calls['patch_dataset'], 1)
+        self.assertEqual(dict((x.site, x.scanStatus) for x in ds._locations),
+                         {'BNL': 'OK', 'NCSA': 'OK', site: 'UNSCANNED'})
+
+    def test_register_many(self):
+        "Test the outcomes of bulk registration and the folder listing."
+        myDC = make_registry(self.catalog)
+        outcomes = myDC.register_many(self.records(25), numWorkers=4)
+        self.assertEqual([x[1] for x in outcomes], [registry.REGISTERED]*25)
+        self.assertEqual(self.catalog.calls['mkdir'], 1)
+
+        # Rerun with unchanged and changed content.
+        self.catalog.calls.clear()
+        myDC = make_registry(self.catalog)
+        records = self.records(25)
+        records[:5] = self.records(5, digest='1')
+        outcomes = dict(myDC.register_many(records, numWorkers=4))
+        self.assertEqual(outcomes['/data/file_00.fits'],
+                         registry.RECRAWL_REQUESTED)
+        self.assertEqual(outcomes['/data/file_24.fits'],
+                         registry.ALREADY_REGISTERED)
+        self.assertEqual(myDC.numReCrawl, 5)
+        self.assertEqual(myDC.numSkippedReCrawl, 20)
+        self.assertEqual(self.catalog.calls['children'], 1)
+        self.assertNotIn('path', self.catalog.calls)
+
+    def test_errors(self):
+        "Test that injected dataCatalog errors are reported as outcomes."
+        myDC = make_registry(self.catalog, error_rate=1)
+        outcomes = myDC.register_many(self.records(3))
+        self.assertEqual([x[1] for x in outcomes], [registry.ERROR]*3)
+        self.assertEqual(self.catalog.datasets, {})
+
+class RegistrationJournalTestCase(unittest.TestCase):
+    "TestCase class for journaled registration."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.tmpdir, 'registration.journal')
+        self.catalog = localDatacat.LocalCatalog()
+        self.records = [('/data/file_%02i.fits' % i, '/LSST/test',
+                         'slac.lca.archive', 'fits', 'LSSTVENDORDATA')
+                        for i in range(20)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_drain(self):
+        "Test retries of failed registrations and the drain() barrier."
+        myDC = make_registry(self.catalog, error_rate=0.3, seed=1)
+        myDC.retryDelay = 0.001
+        myDC.enableJournal(self.journal, numWorkers=2)
+        myDC.submit(self.records)
+        self.assertTrue(myDC.drain(timeout=30))
+        myDC.closeJournal()
+        self.assertEqual(len(self.catalog.datasets), len(self.records))
+
+    def test_recovery(self):
+        "Test that a later registry drains the journal left pending."
+        myDC = make_registry(self.catalog, error_rate=1)
+        myDC.retryDelay = 0.05
+        myDC.enableJournal(self.journal)
+        myDC.submit(self.records)
+        self.assertFalse(myDC.drain(timeout=0.2))
+        myDC.closeJournal()
+        self.assertEqual(self.catalog.datasets, {})
+
+        myDC = make_registry(self.catalog)
+        myDC.enableJournal(self.journal)
+        self.assertTrue(myDC.drain(timeout=30))
+        self.assertEqual(myDC.journal.counts()['done'], len(self.records))
+        myDC.closeJournal()
+        self.assertEqual(len(self.catalog.datasets), len(self.records))
+
+    def test_register_tarball(self):
+        "Test the journaling of the files of one tarball of a delivery."
+        vendorDir = os.path.join(self.tmpdir, 'vendorData')
+        manifest = ingestManifest.IngestManifest(vendorDir + '.manifest')
+        for tarball, names in (('data.tar.bz2', ('fe55/a.fits', 'b.txt')),
+                               ('metrology.tar.bz2', ('metrology/c.txt',))):
+            for name in names:
+                path = os.path.join(vendorDir, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                open(path, 'w').close()
+                manifest.add_member(name, tarball, 'file', 0, 0, None)
+        myDC = make_registry(self.catalog)
+        myDC.enableJournal(self.journal)
+        for tarball, expected in (('metrology.tar.bz2', 1), (None, 2),
+                                  (None, 0)):
+            self.assertEqual(vendorRegistration.regVendorFiles(
+                myDC, manifest, vendorDir, '/LSST/test', '20260101',
+                tarball=tarball), {'journaled': expected})
+        self.assertTrue(myDC.drain(timeout=30))
+        myDC.closeJournal()
+        manifest.close()
+        self.assertEqual(sorted(self.catalog.datasets),
+                         ['/LSST/test/b.txt', '/LSST/test/fe55/a.fits',
+                          '/LSST/test/metrology/c.txt'])
+
+    def test_requeue_failed(self):
+        "Test that registrations given up are retried by a later registry."
+        myDC = make_registry(self.catalog, error_rate=1)
+        myDC.retryDelay = 0.001
+        myDC.enableJournal(self.journal, maxAttempts=2)
+        myDC.submit(self.records)
+        self.assertFalse(myDC.drain(timeout=30))
+        self.assertEqual(myDC.journal.counts()['failed'], len(self.records))
+        myDC.closeJournal()
+
+        myDC = make_registry(self.catalog)
+        myDC.enableJournal(self.journal, maxAttempts=2)
+        self.assertTrue(myDC.drain(timeout=30))
+        self.assertEqual(myDC.journal.counts(),
+                         dict(pending=0, done=len(self.records), failed=0))
+        myDC.closeJournal()
+        self.assertEqual(len(self.catalog.datasets), len(self.records))
+
+if __name__ == '__main__':
+    unittest.main()
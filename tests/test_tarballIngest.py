@@ -0,0 +1,383 @@
+"""
+Unit tests for tarballIngest module.
+"""
+from __future__ import print_function, absolute_import
+import os
+import io
+import sys
+import bz2
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.environ['OFFLINEJOBSDIR'], 'harnessed_jobs',
+                                'vendorIngest', 'v0'))
+import tarballIngest
+import parallelDecompress
+import ingestManifest
+import tarballIndex
+
+def make_delivery(tmpdir, tarball, nfiles=5, mode='w:bz2'):
+    """
+    Write a small delivery tarball with a subdirectory and return
+    its md5 checksum and the dict of member contents.
+    """
+    srcdir = os.path.join(tmpdir, 'src')
+    os.makedirs(os.path.join(srcdir, 'report1', 'fe55'))
+    contents = {}
+    for i in range(nfiles):
+        relpath = os.path.join('report1', 'fe55', 'file_%02i.txt' % i)
+        data = ('%i ' % i)*(1000*(i + 1))
+        with open(os.path.join(srcdir, relpath), 'w') as output:
+            output.write(data)
+        contents[relpath] = data
+    with tarfile.open(tarball, mode) as tar:
+        tar.add(os.path.join(srcdir, 'report1'), arcname='report1')
+    shutil.rmtree(srcdir)
+    with open(tarball, 'rb') as fd:
+        md5 = hashlib.md5(fd.read()).hexdigest()
+    return md5, contents
+
+class TarballIngestTestCase(unittest.TestCase):
+    "TestCase class for single-pass tarball verification and extraction."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tarball = os.path.join(self.tmpdir, 'ITL-3800C-000.tar.bz2')
+        self.md5, self.contents = make_delivery(self.tmpdir, self.tarball)
+        self.targetDir = os.path.join(self.tmpdir, 'vendorData')
+        os.makedirs(self.targetDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_md5file(self):
+        "Test the parsing of the md5 file formats used by the vendors."
+        md5file = os.path.join(self.tmpdir, 'checksum.md5')
+        for line in ('%s\n', '%s  ITL-3800C-000.tar.bz2\n',
+                     'MD5 (ITL-3800C-000.tar.bz2) %s\n'):
+            with open(md5file, 'w') as output:
+                output.write(line % self.md5)
+            self.assertEqual(tarballIngest.read_md5file(md5file),
+                             self.md5.upper())
+        with open(md5file, 'w') as output:
+            output.write('\n')
+        self.assertRaises(ValueError, tarballIngest.read_md5file, md5file)
+
+    def test_extract_tarball(self):
+        "Test extraction with a matching checksum and small read chunks."
+        members = tarballIngest.extract_tarball(self.tarball, self.md5,
+                                                self.targetDir,
+                                                chunk_size=512,
+                                                verbose=False)
+        self.assertEqual(len(members), len(self.contents) + 2)
+        for relpath, data in self.contents.items():
+            with open(os.path.join(self.targetDir, relpath)) as fd:
+                self.assertEqual(fd.read(), data)
+
+    def test_checksum_mismatch(self):
+        "Test that extracted files are removed if the checksum is wrong."
+        self.assertRaises(tarballIngest.ChecksumError,
+                          tarballIngest.extract_tarball, self.tarball,
+                          '0'*32, self.targetDir, verbose=False)
+        self.assertEqual(os.listdir(self.targetDir), [])
+
+    def test_resume_with_manifest(self):
+        "Test that a rerun only extracts the members still missing."
+        manifest_file = self.targetDir + '.manifest'
+        manifest = ingestManifest.IngestManifest(manifest_file)
+        members = tarballIngest.extract_tarball(self.tarball, self.md5,
+                                                self.targetDir,
+                                                manifest=manifest,
+                                                verbose=False)
+        manifest.close()
+        self.assertEqual(len(members), len(self.contents) + 2)
+        manifest = ingestManifest.IngestManifest(manifest_file)
+        for relpath, data in self.contents.items():
+            self.assertEqual(manifest.members[relpath]['md5'],
+                             hashlib.md5(data.encode()).hexdigest())
+        self.assertEqual(tarballIngest.extract_tarball(self.tarball, self.md5,
+                                                       self.targetDir,
+                                                       manifest=manifest,
+                                                       verbose=False), [])
+        manifest.close()
+
+        # Simulate an interruption before the last member was recorded
+        # and before the checksum was verified.
+        missing = sorted(self.contents.keys())[-1]
+        with open(manifest_file) as input_:
+            records = [json.loads(line) for line in input_]
+        with open(manifest_file, 'w') as output:
+            for record in records:
+                if (record['record'] == 'verified' or
+                    record.get('name') == missing):
+                    continue
+                output.write(json.dumps(record) + '\n')
+            output.write('{"record": "phase", "na')
+        os.remove(os.path.join(self.targetDir, missing))
+        manifest = ingestManifest.IngestManifest(manifest_file)
+        self.assertEqual(manifest.pending('extracted'), [])
+        members = tarballIngest.extract_tarball(self.tarball, self.md5,
+                                                self.targetDir,
+                                                manifest=manifest,
+                                                verbose=False)
+        self.assertEqual([x.name for x in members], [missing])
+        self.assertTrue(manifest.is_extracted(os.path.basename(self.tarball),
+                                              self.md5.upper()))
+        manifest.close()
+        manifest = ingestManifest.IngestManifest(manifest_file)
+        self.assertTrue(manifest.is_extracted(os.path.basename(self.tarball),
+                                              self.md5.upper()))
+        manifest.close()
+
+    def test_permissions(self):
+        "Test that the final mode and group are set during extraction."
+        manifest = ingestManifest.IngestManifest(self.targetDir + '.manifest')
+        counts = {}
+        tarballIngest.extract_tarball(self.tarball, self.md5, self.targetDir,
+                                      manifest=manifest, file_mode=0o640,
+                                      dir_mode=0o750, gid=os.getgid(),
+                                      counts=counts, verbose=False)
+        manifest.close()
+        for root, dirs, files in os.walk(self.targetDir):
+            for name in dirs:
+                self.assertEqual(os.stat(os.path.join(root, name)).st_mode
+                                 & 0o7777, 0o750)
+            for name in files:
+                status = os.stat(os.path.join(root, name))
+                self.assertEqual(status.st_mode & 0o7777, 0o640)
+                self.assertEqual(status.st_gid, os.getgid())
+        self.assertEqual(counts['members'], len(self.contents) + 2)
+        self.assertEqual(counts['metadata_ops'], 0)
+        self.assertEqual(manifest.pending('permissions'), [])
+
+    def test_umask(self):
+        "Test that the umask is left alone and its bits are added back."
+        class Consumer(object):
+            "Records the umask seen by other threads during extraction."
+            def __init__(self):
+                self.umasks = set()
+            def accepts(self, name):
+                return True
+            def add(self, name, data):
+                umask = os.umask(0o077)
+                os.umask(umask)
+                self.umasks.add(umask)
+        consumer = Consumer()
+        umask = os.umask(0o077)
+        try:
+            counts = {}
+            tarballIngest.extract_tarball(self.tarball, self.md5,
+                                          self.targetDir, file_mode=0o640,
+                                          dir_mode=0o750, gid=os.getgid(),
+                                          counts=counts, consumer=consumer,
+                                          verbose=False)
+        finally:
+            os.umask(umask)
+        self.assertEqual(consumer.umasks, set([0o077]))
+        for root, dirs, files in os.walk(self.targetDir):
+            for name in dirs:
+                self.assertEqual(os.stat(os.path.join(root, name)).st_mode
+                                 & 0o7777, 0o750)
+            for name in files:
+                self.assertEqual(os.stat(os.path.join(root, name)).st_mode
+                                 & 0o7777, 0o640)
+        self.assertEqual(counts['metadata_ops'], counts['members'])
+
+    def test_consumer(self):
+        "Test that accepted members are handed to a consumer."
+        class Consumer(object):
+            def __init__(self):
+                self.members = {}
+            def accepts(self, name):
+                return not name.endswith('00.txt')
+            def add(self, name, data):
+                self.members[name] = data.decode()
+        consumer = Consumer()
+        manifest = ingestManifest.IngestManifest(self.targetDir + '.manifest')
+        tarballIngest.extract_tarball(self.tarball, self.md5, self.targetDir,
+                                      chunk_size=512, manifest=manifest,
+                                      consumer=consumer, verbose=False)
+        manifest.close()
+        expected = dict((name, data) for name, data in self.contents.items()
+                        if not name.endswith('00.txt'))
+        self.assertEqual(consumer.members, expected)
+
+    def _metrology_tarball(self):
+        "Write a second tarball with different members, like metrology data."
+        srcdir = os.path.join(self.tmpdir, 'metrology')
+        os.makedirs(srcdir)
+        with open(os.path.join(srcdir, 'flatness.txt'), 'w') as output:
+            output.write('0.1 0.2 0.3\n'*1000)
+        tarball = os.path.join(self.tmpdir, 'metrology.tar.gz')
+        with tarfile.open(tarball, 'w:gz') as tar:
+            tar.add(srcdir, arcname='metrology')
+        shutil.rmtree(srcdir)
+        with open(tarball, 'rb') as fd:
+            return tarball, hashlib.md5(fd.read()).hexdigest()
+
+    def test_extract_tarballs(self):
+        "Test concurrent extraction of several tarballs."
+        metrology, md5 = self._metrology_tarball()
+        manifest = ingestManifest.IngestManifest(self.targetDir + '.manifest')
+        counts = {}
+        results = tarballIngest.extract_tarballs(
+            [(self.tarball, self.md5, None), (metrology, md5, None)],
+            self.targetDir, counts=counts, manifest=manifest,
+            file_mode=0o640, dir_mode=0o750, gid=os.getgid(), verbose=False)
+        manifest.close()
+        self.assertEqual([len(x) for x in results],
+                         [len(self.contents) + 2, 2])
+        self.assertEqual(counts['members'], len(self.contents) + 4)
+        self.assertTrue(os.path.isfile(os.path.join(self.targetDir,
+                                                    'metrology',
+                                                    'flatness.txt')))
+        manifest = ingestManifest.IngestManifest(self.targetDir + '.manifest')
+        self.assertEqual(manifest.pending('extracted'), [])
+        self.assertEqual(manifest.pending('permissions'), [])
+        manifest.close()
+
+    def test_extract_tarballs_done(self):
+        "Test that done is called as each tarball is verified."
+        metrology, md5 = self._metrology_tarball()
+        manifest = ingestManifest.IngestManifest(self.targetDir + '.manifest')
+        verified = {}
+        def done(datafile, members):
+            verified[datafile] = (len(members), manifest.is_extracted(
+                os.path.basename(datafile), md5s[datafile].upper()))
+        md5s = {self.tarball: self.md5, metrology: md5}
+        tarballIngest.extract_tarballs(
+            [(self.tarball, self.md5, None), (metrology, md5, None)],
+            self.targetDir, manifest=manifest, done=done, verbose=False)
+        manifest.close()
+        self.assertEqual(verified, {self.tarball: (len(self.contents) + 2,
+                                                   True),
+                                    metrology: (2, True)})
+
+        # A tarball failing its checksum is not passed to done.
+        verified.clear()
+        shutil.rmtree(self.targetDir)
+        os.makedirs(self.targetDir)
+        self.assertRaises(tarballIngest.ChecksumError,
+                          tarballIngest.extract_tarballs,
+                          [(metrology, '0'*32, None)], self.targetDir,
+                          done=done, verbose=False)
+        self.assertEqual(verified, {})
+
+    def test_extract_tarballs_failure(self):
+        "Test that a checksum error in one tarball fails the extraction."
+        metrology, md5 = self._metrology_tarball()
+        self.assertRaises(tarballIngest.ChecksumError,
+                          tarballIngest.extract_tarballs,
+                          [(self.tarball, self.md5, None),
+                           (metrology, '0'*32, None)],
+                          self.targetDir, verbose=False)
+        self.assertFalse(os.path.exists(os.path.join(self.targetDir,
+                                                     'metrology',
+                                                     'flatness.txt')))
+
+class ParallelDecompressTestCase(unittest.TestCase):
+    "TestCase class for block-parallel and pipelined decompression."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.targetDir = os.path.join(self.tmpdir, 'vendorData')
+        os.makedirs(self.targetDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_bz2_blocks(self):
+        "Test block splitting of single- and multi-stream bzip2 data."
+        data = b''.join([b'%i %i\n' % (i, (i*7919) % 10007)
+                         for i in range(100000)])
+        compressed = bz2.compress(data, 1)
+        for payload, expected in ((compressed, data),
+                                  (compressed*2, data*2)):
+            reader = parallelDecompress.ParallelBz2Reader(
+                io.BytesIO(payload), processes=2, chunk_size=4096)
+            try:
+                self.assertEqual(reader.read(), expected)
+            finally:
+                reader.close()
+            self.assertTrue(reader.splitter.nblocks > 1)
+
+    def test_parallel_extraction(self):
+        "Test parallel bzip2 and pipelined gzip extraction."
+        for mode, suffix in (('w:bz2', 'bz2'), ('w:gz', 'gz')):
+            tarball = os.path.join(self.tmpdir, 'delivery.tar.' + suffix)
+            md5, contents = make_delivery(self.tmpdir, tarball, mode=mode)
+            targetDir = os.path.join(self.targetDir, suffix)
+            tarballIngest.extract_tarball(tarball, md5, targetDir,
+                                          processes=2, verbose=False)
+            for relpath, data in contents.items():
+                with open(os.path.join(targetDir, relpath)) as fd:
+                    self.assertEqual(fd.read(), data)
+
+class TarballIndexTestCase(unittest.TestCase):
+    "TestCase class for random access to members of indexed tarballs."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        srcdir = os.path.join(self.tmpdir, 'src')
+        os.makedirs(os.path.join(srcdir, 'report1'))
+        self.contents = {}
+        for i in range(4):
+            relpath = os.path.join('report1', 'file_%02i.dat' % i)
+            data = b''.join([b'%i %i\n' % (j, (j*7919*(i + 1)) % 10007)
+                             for j in range(20000*i)])
+            with open(os.path.join(srcdir, relpath), 'wb') as output:
+                output.write(data)
+            self.contents[relpath] = data
+        self.tarballs = {}
+        for mode, suffix, kwds in (('w', 'tar', {}),
+                                   ('w:gz', 'tar.gz', {}),
+                                   ('w:bz2', 'tar.bz2',
+                                    dict(compresslevel=1))):
+            tarball = os.path.join(self.tmpdir, 'delivery.' + suffix)
+            with tarfile.open(tarball, mode, **kwds) as tar:
+                tar.add(os.path.join(srcdir, 'report1'), arcname='report1')
+            with open(tarball, 'rb') as fd:
+                self.tarballs[tarball] = hashlib.md5(fd.read()).hexdigest()
+        shutil.rmtree(srcdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_members(self, index):
+        self.assertEqual(sorted(index.names()), sorted(self.contents.keys()))
+        for relpath, data in self.contents.items():
+            self.assertEqual(index.read_member(relpath), data)
+
+    def test_index_at_extraction(self):
+        "Test members read back through an index built during extraction."
+        for tarball, md5 in self.tarballs.items():
+            targetDir = os.path.join(self.tmpdir, 'vendorData',
+                                     os.path.basename(tarball))
+            index = tarballIndex.TarballIndex(tarball, md5=md5)
+            tarballIngest.extract_tarball(tarball, md5, targetDir,
+                                          index=index, verbose=False)
+            indexFile = targetDir + '.index'
+            index.write(indexFile)
+            index = tarballIndex.TarballIndex.read(indexFile)
+            self.assertEqual(index.md5, md5.upper())
+            self.assertNotEqual(index.seek_points, None)
+            if tarball.endswith('.bz2'):
+                self.assertTrue(len(index.seek_points) > 1)
+            self._check_members(index)
+            self.assertEqual(
+                index.names(), tarballIndex.build_index(tarball).names())
+            path = index.extract_member('report1/file_03.dat',
+                                        os.path.join(self.tmpdir, 'copy'))
+            with open(path, 'rb') as fd:
+                self.assertEqual(fd.read(),
+                                 self.contents['report1/file_03.dat'])
+
+    def test_serial_index(self):
+        "Test an index without seek points, read by sequential decoding."
+        for tarball in self.tarballs:
+            index = tarballIndex.build_index(tarball)
+            index.set_seek_points(index.compression, None)
+            self._check_members(index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Unit tests for the translationManifest module.
+"""
+from __future__ import print_function, absolute_import
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from translationManifest import TranslationManifest, file_digest
+
+class TranslationManifestTestCase(unittest.TestCase):
+    "TestCase class for the reuse of earlier translations."
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'vendor.fits')
+        self.outfile = os.path.join(self.tmpdir, 'translated.fits')
+        self.manifest_file = os.path.join(self.tmpdir, 'manifest.json')
+        self.name = ('000-00', 'fe55', 'fe55', '000')
+        for filename in (self.infile, self.outfile):
+            with open(filename, 'w') as output:
+                output.write(os.path.basename(filename))
+        manifest = TranslationManifest(self.manifest_file, 'v1')
+        manifest.record(self.infile, self.name, self.outfile)
+        manifest.write()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse(self):
+        "Test the reuse of an output by a later translation."
+        manifest = TranslationManifest(self.manifest_file, 'v1')
+        entry = manifest.lookup(self.infile, self.name)
+        self.assertEqual(entry['digest'], file_digest(self.outfile))
+        self.assertEqual(manifest.lookup(self.infile, ('000-00', 'fe55',
+                                                       'bias', '000')), None)
+        outfile = os.path.join(self.tmpdir, 'translated_2.fits')
+        manifest.reuse(entry, outfile)
+        manifest.record(self.infile, self.name, outfile, entry['digest'])
+        self.assertEqual(manifest.lookup(self.infile, self.name)['outfile'],
+                         outfile)
+        with open(outfile) as fd:
+            self.assertEqual(fd.read(), 'translated.fits')
+
+    def test_checkpoint(self):
+        "Test that checkpoint only writes the manifest every interval."
+        manifest = TranslationManifest(self.manifest_file, 'v1')
+        manifest.record(self.infile, ('000-00', 'fe55', 'bias', '000'),
+                        self.outfile)
+        manifest.checkpoint(interval=3600.)
+        self.assertEqual(len(TranslationManifest(self.manifest_file, 'v1')
+                             .entries), 1)
+        manifest.checkpoint(interval=0.)
+        self.assertEqual(len(TranslationManifest(self.manifest_file, 'v1')
+                             .entries), 2)
+
+    def test_changes(self):
+        "Test that changed inputs, outputs or versions are not reused."
+        self.assertEqual(TranslationManifest(self.manifest_file, 'v2')
+                         .lookup(self.infile, self.name), None)
+        self.assertEqual(TranslationManifest(self.manifest_file, 'v1',
+                                             force=True)
+                         .lookup(self.infile, self.name), None)
+        status = os.stat(self.infile)
+        os.utime(self.infile, (status.st_atime, time.time() + 10))
+        self.assertEqual(TranslationManifest(self.manifest_file, 'v1')
+                         .lookup(self.infile, self.name), None)
+        os.utime(self.infile, (status.st_atime, status.st_mtime))
+        os.remove(self.outfile)
+        manifest = TranslationManifest(self.manifest_file, 'v1')
+        self.assertEqual(manifest.lookup(self.infile, self.name), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,13 +3,22 @@ Unit test code for vendorFitsTranslators.py module
 """
 from __future__ import print_function, absolute_import
 import os
+import re
+import sys
 import glob
 import shutil
+import tempfile
 import itertools
 import unittest
+import numpy as np
 import astropy.io.fits as fits
+import lsst.eotest.sensor as sensorTest
+import VendorFitsTranslator
 from ItlFitsTranslator import ItlFitsTranslator
 from e2vFitsTranslator import e2vFitsTranslator
+from translationManifest import TranslationManifest, file_digest
+sys.path.insert(0, os.path.join(os.environ['OFFLINEJOBSDIR'], 'benchmarks'))
+import make_vendor_delivery
 
 _itl_test_file = '/nfs/farm/g/lsst/u1/vendorData/ITL/ITL-3800C-089/Dev/16310/report1/linearity/ID089_SN20234_linearity.0058.fits'
 if not os.path.isfile(_itl_test_file):
@@ -36,10 +45,13 @@ class DummyItlVendorFitsTranslator(ItlFitsTranslator):
         "Re-write the input FITS file with the conforming name."
         lsst_num = self.lsst_num
         time_stamp = '000'
-        self._write_file(fits.open(infile), locals(), verbose=verbose)
+        hdulist = fits.open(infile)
+        if test_type == 'lambda':
+            self._apply_incident_flux(hdulist[0].header)
+        self._write_file(hdulist, locals(), verbose=verbose)
 
     @staticmethod
-    def _compute_incident_flux():
+    def _compute_incident_flux(qe_txt=None, tree=None):
         return dict((wl, 1) for wl in _wls)
 
 class Dummye2vVendorFitsTranslator(e2vFitsTranslator):
@@ -130,6 +142,315 @@ class VendorTranslatorTestCase(unittest.TestCase):
         ref_date = 'T'.join(_date_time_pairs[0])[:len('2017-02-10T10:10:10')]
         self.assertEqual(translator.date_obs, ref_date)
 
+class QeItlVendorFitsTranslator(DummyItlVendorFitsTranslator):
+    "Dummy subclass translating only the QE dataset."
+    def _datasets(self):
+        self.lambda_scan(pattern='ITL_lambda_scan_*.fits', verbose=False)
+
+class FailingQeItlVendorFitsTranslator(QeItlVendorFitsTranslator):
+    "Dummy subclass failing after translating two QE files."
+    def translate(self, *args, **kwds):
+        if len(self.outfiles) == 2:
+            raise RuntimeError('translation failed')
+        super(FailingQeItlVendorFitsTranslator, self).translate(*args, **kwds)
+
+class ParallelTranslationTestCase(unittest.TestCase):
+    """
+    TestCase class for the translation of the files in a process pool.
+    """
+    def setUp(self):
+        "Generate the QE files in a temporary directory."
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        self.rootdir = os.path.join(self.tmpdir, 'vendorData')
+        # ItlFitsTranslator locates the delivery via its superflat1 folder.
+        os.makedirs(os.path.join(self.rootdir, 'superflat1'))
+        os.chdir(self.rootdir)
+        VendorTranslatorTestCase._generate_ITL_lambda_files.__func__(self)
+        os.chdir(self.cwd)
+
+    def tearDown(self):
+        "Clean up the temporary directory."
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def _run_all(self, processes, outdir=None, manifest=None):
+        if outdir is None:
+            outdir = 'processes_%i' % processes
+        outdir = os.path.join(self.tmpdir, outdir)
+        os.mkdir(outdir)
+        os.chdir(outdir)
+        translator = QeItlVendorFitsTranslator('000-00', self.rootdir, '.')
+        translator.manifest = manifest
+        translator.run_all(processes=processes)
+        headers = [fits.open(x)[0].header for x in translator.outfiles]
+        return translator, headers
+
+    def test_parallel_run_all(self):
+        "Test that the parallel translation reproduces the serial one."
+        serial, serial_headers = self._run_all(1)
+        parallel, parallel_headers = self._run_all(3)
+        self.assertEqual(len(parallel.outfiles), 5)
+        self.assertEqual(parallel.outfiles, serial.outfiles)
+        self.assertEqual(parallel.obs_dates, serial.obs_dates)
+        self.assertEqual(parallel.date_obs, serial.date_obs)
+        for header, ref_header in zip(parallel_headers, serial_headers):
+            self.assertEqual(header['MONDIODE_ORIG'], 1)
+            self.assertEqual(header['MONDIODE'], ref_header['MONDIODE'])
+
+    def test_iter_translate(self):
+        "Test the records yielded as the files are written."
+        for processes in (1, 2):
+            outdir = os.path.join(self.tmpdir, 'iter_%i' % processes)
+            os.mkdir(outdir)
+            os.chdir(outdir)
+            translator = QeItlVendorFitsTranslator('000-00', self.rootdir, '.')
+            records = []
+            for record in translator.iter_translate(processes=processes):
+                self.assertTrue(os.path.isfile(record.outfile))
+                records.append(record)
+            self.assertEqual([x.outfile for x in records], translator.outfiles)
+            self.assertEqual(len(records), 5)
+            for record in records:
+                self.assertEqual((record.test_type, record.image_type),
+                                 ('lambda', 'flat'))
+                self.assertEqual(record.size, os.path.getsize(record.outfile))
+                self.assertEqual(record.digest, file_digest(record.outfile))
+
+    def test_manifest(self):
+        "Test the reuse of the files of an earlier translation."
+        manifest_file = os.path.join(self.tmpdir, 'manifest.json')
+        version = QeItlVendorFitsTranslator.version()
+        first, first_headers \
+            = self._run_all(2, manifest=TranslationManifest(manifest_file,
+                                                            version))
+        self.assertEqual(len(first._reused), 0)
+        rerun, rerun_headers \
+            = self._run_all(2, outdir='rerun',
+                            manifest=TranslationManifest(manifest_file,
+                                                         version))
+        self.assertEqual(sorted(rerun._reused), sorted(rerun.outfiles))
+        self.assertEqual(rerun.obs_dates, first.obs_dates)
+        for header, ref_header in zip(rerun_headers, first_headers):
+            self.assertEqual(header['MONDIODE_ORIG'], 1)
+            self.assertEqual(header['MONDIODE'], ref_header['MONDIODE'])
+        forced, forced_headers \
+            = self._run_all(1, outdir='forced',
+                            manifest=TranslationManifest(manifest_file,
+                                                         version, force=True))
+        self.assertEqual(len(forced._reused), 0)
+        self.assertEqual(len(forced.outfiles), 5)
+
+    def test_interrupted_manifest(self):
+        "Test that the files written before a failure are reused."
+        manifest_file = os.path.join(self.tmpdir, 'manifest.json')
+        version = QeItlVendorFitsTranslator.version()
+        os.chdir(self.tmpdir)
+        translator = FailingQeItlVendorFitsTranslator('000-00', self.rootdir,
+                                                      'failed')
+        translator.manifest = TranslationManifest(manifest_file, version)
+        self.assertRaises(RuntimeError, translator.run_all)
+        rerun, headers \
+            = self._run_all(1, outdir='rerun',
+                            manifest=TranslationManifest(manifest_file,
+                                                         version))
+        self.assertEqual(len(rerun._reused), 2)
+        self.assertEqual(len(rerun.outfiles), 5)
+
+        # The consumer of iter_translate stops after two files.
+        os.remove(manifest_file)
+        os.chdir(self.tmpdir)
+        translator = QeItlVendorFitsTranslator('000-00', self.rootdir,
+                                               'stopped')
+        translator.manifest = TranslationManifest(manifest_file, version)
+        try:
+            for record in translator.iter_translate(processes=2):
+                if len(translator.records) == 2:
+                    raise RuntimeError('validation failed')
+        except RuntimeError:
+            pass
+        rerun, headers \
+            = self._run_all(2, outdir='rerun2',
+                            manifest=TranslationManifest(manifest_file,
+                                                         version))
+        self.assertEqual(len(rerun._reused), 2)
+        self.assertEqual(len(rerun.outfiles), 5)
+
+class StreamTranslationTestCase(unittest.TestCase):
+    """
+    TestCase class for the translation of vendor files passed one at a
+    time, as they are extracted from the delivery tarball.
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        self.rootdir = os.path.join(self.tmpdir, 'vendorData')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def _translate(self, Translator, lsst_num, stream):
+        "Translate the delivery, streamed in member name order or not."
+        outdir = os.path.join(self.tmpdir, 'stream' if stream else 'run_all')
+        os.mkdir(outdir)
+        os.chdir(outdir)
+        translator = Translator(lsst_num, self.rootdir, '.')
+        if not stream:
+            translator.run_all()
+            return translator
+        translator.start_stream(verbose=False)
+        for root, dirs, files in sorted(os.walk(self.rootdir)):
+            for filename in sorted(files):
+                name = os.path.relpath(os.path.join(root, filename),
+                                       self.rootdir)
+                if translator.stream_accepts(name):
+                    with open(os.path.join(root, filename), 'rb') as fd:
+                        translator.stream_member(name, fd)
+        translator.finish_stream()
+        return translator
+
+    def _compare(self, Translator, lsst_num):
+        "Test that streaming reproduces the files written by run_all."
+        ref = self._translate(Translator, lsst_num, False)
+        streamed = self._translate(Translator, lsst_num, True)
+        normalize = lambda outfiles: sorted(re.sub(r'\d{14}', 'TS', x)
+                                            for x in outfiles)
+        self.assertEqual(normalize(streamed.outfiles), normalize(ref.outfiles))
+        self.assertEqual(streamed.date_obs, ref.date_obs)
+        for outfile, ref_outfile in zip(sorted(streamed.outfiles),
+                                        sorted(ref.outfiles)):
+            hdus = fits.open(os.path.join(self.tmpdir, 'stream', outfile))
+            ref_hdus = fits.open(os.path.join(self.tmpdir, 'run_all',
+                                              ref_outfile))
+            self.assertEqual(len(hdus), len(ref_hdus))
+            for hdu, ref_hdu in zip(hdus, ref_hdus):
+                # The checksum cards differ by the time they were set.
+                self.assertEqual([x for x in hdu.header.items()
+                                  if x[0] != 'CHECKSUM'],
+                                 [x for x in ref_hdu.header.items()
+                                  if x[0] != 'CHECKSUM'])
+                if ref_hdu.data is not None:
+                    np.testing.assert_array_equal(hdu.data, ref_hdu.data)
+        return streamed
+
+    def test_itl_stream(self):
+        "Test the streaming translation of an ITL delivery."
+        delivery = make_vendor_delivery.ItlDelivery((32, 32), scale=0.2,
+                                                    seed=1)
+        outdir = delivery.write_data(self.rootdir)
+        # A lesser variant of the pocket pumped exposure, read first.
+        delivery.write_fits(delivery.filename(os.path.join(outdir,
+                                                           'pocketpump'),
+                                              'pocketpump', 0),
+                            delivery.header(1., 'pocketpump flat'), 500.)
+        streamed = self._compare(ItlFitsTranslator, delivery.lsst_num)
+        ppump = [x for x in streamed.outfiles if '_trap_ppump_' in x]
+        self.assertEqual(len(ppump), 1)
+        self.assertEqual(fits.open(ppump[0])[0].header['OBJECT'],
+                         'pocket pump')
+
+    def test_e2v_stream(self):
+        "Test the streaming translation of an e2v delivery."
+        delivery = make_vendor_delivery.e2vDelivery((32, 32), scale=0.2,
+                                                    seed=1)
+        os.makedirs(self.rootdir)
+        delivery.write_data(self.rootdir)
+        self._compare(e2vFitsTranslator, delivery.lsst_num)
+
+class AmpGeomTestCase(unittest.TestCase):
+    """
+    TestCase class for the cached amplifier geometry header cards.
+    """
+    def _hdulist(self, naxis1, naxis2):
+        hdulist = fits.HDUList([fits.PrimaryHDU()])
+        hdulist[0].header['CCD_MANU'] = 'E2V'
+        for amp in range(1, 17):
+            hdulist.append(fits.ImageHDU(np.zeros((naxis2, naxis1),
+                                                  dtype=np.int16)))
+            hdulist[amp].header['AMPNO'] = amp
+        return hdulist
+
+    def test_set_amp_geom(self):
+        "Test that the cached cards match the amplifier geometry."
+        for naxis1, naxis2 in ((32, 40), (32, 40), (48, 20)):
+            hdulist = self._hdulist(naxis1, naxis2)
+            e2vFitsTranslator._set_amp_geom(hdulist)
+            amp_geom = sensorTest.AmplifierGeometry(detxsize=8*naxis1,
+                                                   detysize=2*naxis2)
+            self.assertEqual(hdulist[0].header['DETSIZE'], amp_geom.DETSIZE)
+            for amp in range(1, 17):
+                for keyword in ('DETSIZE', 'DATASEC', 'DETSEC'):
+                    self.assertEqual(hdulist[amp].header[keyword],
+                                     amp_geom[amp][keyword])
+        self.assertIn((32, 40, 'E2V'), VendorFitsTranslator._amp_geom_cards)
+        self.assertIn((48, 20, 'E2V'), VendorFitsTranslator._amp_geom_cards)
+
+class e2vBoundedReadTestCase(unittest.TestCase):
+    """
+    TestCase class for the reading of only the image extensions of
+    e2v files.
+    """
+    def setUp(self):
+        "Write an e2v file followed by an ARCHON and a corrupted extension."
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'e2v_xray_xray_000.fits')
+        hdulist = fits.HDUList([fits.PrimaryHDU()])
+        header = hdulist[0].header
+        header['DATE-OBS'] = '2017-02-10T17:52:10.000'
+        header['EXPOSURE'] = 5.
+        header['DEV_ID'] = '16013-05-01'
+        header['WAVELEN'] = 500.
+        header['LIGHTPOW'] = 1.
+        header['MONDIODE'] = 0.
+        header['TEMP_MEA'] = -100.
+        for amp in range(1, 17):
+            hdulist.append(fits.ImageHDU(np.zeros((20, 10), dtype=np.int16)))
+            hdulist[amp].header['AMPNO'] = amp
+        archon = fits.ImageHDU(name='ARCHON')
+        archon.header['SYS_N1'] = 2.5
+        hdulist.append(archon)
+        hdulist.writeto(self.infile)
+        with open(self.infile, 'ab') as output:
+            output.write(b'XTENSION= corrupted'.ljust(2880))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _translate(self, archon_keywords=None):
+        outdir = os.path.join(self.tmpdir, 'output')
+        translator = e2vFitsTranslator('000-00', self.tmpdir, outdir,
+                                       archon_keywords=archon_keywords)
+        fits_open = fits.open
+        self.vendor_hdus = []
+        def recording_open(*args, **kwds):
+            self.vendor_hdus.append(fits_open(*args, **kwds))
+            return self.vendor_hdus[-1]
+        fits.open = recording_open
+        try:
+            translator.translate(self.infile, 'fe55', 'fe55', '000',
+                                 time_stamp='000', verbose=False)
+        finally:
+            fits.open = fits_open
+        self.assertEqual(len(translator.outfiles), 1)
+        return fits.open(translator.outfiles[0], checksum=True)
+
+    def test_translate(self):
+        "Test that only the primary HDU and the image extensions are kept."
+        output = self._translate()
+        # Only the HDUs up to num_hdus are loaded from the vendor file.
+        self.assertEqual(list.__len__(self.vendor_hdus[0]), 17)
+        self.assertEqual(len(output), 17)
+        self.assertEqual(output[0].header['CCD_MANU'], 'E2V')
+        self.assertNotIn('SYS_N1', output[0].header)
+
+    def test_archon_keywords(self):
+        "Test the copying of keywords of the ARCHON extension."
+        output = self._translate(archon_keywords=('SYS_N1', 'SYS_N2'))
+        self.assertEqual(len(output), 17)
+        self.assertEqual(output[0].header['SYS_N1'], 2.5)
+        self.assertNotIn('SYS_N2', output[0].header)
+
 class ItlFitsTranslatorsTestCase(unittest.TestCase):
     """
     TestCase class for ItlFitsTranlator class.